@@ -0,0 +1,223 @@
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
+
+# No window is ever created, so Qt does not need a display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt6.QtGui import QImage
+
+import image_operations
+import tiling
+from filepaths import Filepaths
+
+PRESET_KEYS = ("Saturation", "Contrast", "Brightness", "Exposure", "Warmth")
+
+# Parameters of a preset that changes nothing. Inline parameters that are not given keep these values
+NEUTRAL_PRESET = {
+    "Saturation": 1.0,
+    "Contrast": 1.0,
+    "Brightness": 0.0,
+    "Exposure": 1.0,
+    "Warmth": 1.0
+}
+
+
+def glob_root(pattern):
+    """
+    The directory a glob pattern starts in: its leading components without wildcards.
+    For a plain file path it is the directory of the file.
+    :param pattern: glob pattern or plain file path
+    :return: directory path, '' for the current directory
+    """
+    if not glob.has_magic(pattern):
+        return os.path.dirname(pattern)
+    root = pattern
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root
+
+
+def collect_inputs(patterns):
+    """
+    Expands the input globs into a sorted list of files without duplicates, each with the root of the first
+    pattern that matched it, so the folders below the root can be kept in the output directory.
+    :param patterns: glob patterns or plain file paths
+    :return: list of (file path, root directory) tuples
+    """
+    roots = {}
+    for pattern in patterns:
+        root = glob_root(pattern)
+        for path in glob.glob(pattern, recursive=True):
+            if os.path.isfile(path):
+                roots.setdefault(path, root)
+    return sorted(roots.items())
+
+
+def output_path(input_path, output_dir, extension=None, root=None):
+    """
+    The path the processed image is written to: the path of the image below root, in output_dir.
+    Without root only the file name is kept.
+    :param input_path: path of the source image
+    :param output_dir: directory of the processed images
+    :param extension: optional new file extension, e.g. 'jpg'
+    :param root: optional directory the input was found in, see glob_root()
+    :return: file path
+    """
+    name = os.path.relpath(input_path, root or os.curdir) if root is not None else os.path.basename(input_path)
+    if extension:
+        name = os.path.splitext(name)[0] + '.' + extension.lstrip('.')
+    return os.path.join(output_dir, name)
+
+
+def plan_outputs(inputs, output_dir, extension=None):
+    """
+    The destination of every input. Fails before anything is written if two inputs would be written
+    to the same file, or if a destination is one of the inputs (e.g. the output directory is the input folder).
+    :param inputs: list of (file path, root directory) tuples, see collect_inputs()
+    :param output_dir: directory of the processed images
+    :param extension: optional new file extension
+    :return: list of (input path, destination path) tuples
+    """
+    def key(path):
+        return os.path.normcase(os.path.realpath(path))
+
+    input_keys = {key(path) for path, _ in inputs}
+    destinations = {}
+    plan = []
+    for path, root in inputs:
+        destination = output_path(path, output_dir, extension, root)
+        destination_key = key(destination)
+        if destination_key in input_keys:
+            raise SystemExit(f"{path} would overwrite the input {destination}, choose another output directory")
+        if destination_key in destinations:
+            raise SystemExit(f"{destinations[destination_key]} and {path} would both be written to {destination}")
+        destinations[destination_key] = path
+        plan.append((path, destination))
+    return plan
+
+
+def _init_worker(threads):
+    tiling.set_default_workers(threads)
+
+
+def process_image(input_path, destination, preset, quality=-1):
+    """
+    Decodes an image, applies the preset and encodes the result. Runs in a worker process.
+    :param input_path: path of the source image
+    :param destination: path of the processed image
+    :param preset: dict with the keys of PRESET_KEYS
+    :param quality: encoder quality from 0 to 100, -1 for the default
+    :return: dict with the timings of the three steps, the image size and an error message if it failed
+    """
+    report = {"input": input_path, "output": destination, "error": None, "megapixels": 0.0,
+              "decode": 0.0, "process": 0.0, "encode": 0.0}
+    try:
+        start = time.perf_counter()
+        image = QImage(input_path)
+        if image.isNull():
+            raise ValueError("Could not decode the image")
+        decoded = time.perf_counter()
+
+        image = image_operations.apply_preset(image, preset)
+        processed = time.perf_counter()
+
+        if not image.save(destination, quality=quality):
+            raise ValueError("Could not encode the image")
+        encoded = time.perf_counter()
+
+        report.update(megapixels=image.width() * image.height() / 1e6, decode=decoded - start,
+                      process=processed - decoded, encode=encoded - processed)
+    except Exception as e:
+        report["error"] = str(e)
+    return report
+
+
+def load_preset(args):
+    """
+    Builds the preset from the command line: a named preset from the filters file,
+    with any inline parameters overriding its values.
+    :param args: parsed arguments
+    :return: dict with the keys of PRESET_KEYS, and "LUT" if a .cube file is given
+    """
+    preset = dict(NEUTRAL_PRESET)
+    if args.preset:
+        with open(args.filters, 'r') as json_file:
+            filters = json.load(json_file)
+        if args.preset not in filters:
+            raise SystemExit(f"Unknown preset '{args.preset}'. Available: {', '.join(filters)}")
+        preset.update(filters[args.preset])
+    for key in PRESET_KEYS:
+        value = getattr(args, key.lower())
+        if value is not None:
+            preset[key] = value
+    if args.lut:
+        preset["LUT"] = args.lut
+    return preset
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Applies a Photo-Wizard filter preset to many images, "
+                                                 "without opening a window.")
+    parser.add_argument('inputs', nargs='+', help="input files or glob patterns, e.g. 'photos/**/*.jpg'")
+    parser.add_argument('-o', '--output-dir', required=True, help="directory the processed images are written to")
+    parser.add_argument('-p', '--preset', help="name of a preset in the filters file")
+    parser.add_argument('--filters', default=Filepaths.FILTER_FILE(), help="filters file, Filters.json by default")
+    for key in PRESET_KEYS:
+        parser.add_argument('--' + key.lower(), type=float, help=f"{key} parameter, overrides the preset")
+    parser.add_argument('--lut', help=".cube file to apply instead of the preset parameters")
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help="number of processes")
+    parser.add_argument('--format', help="file extension of the output images, the input extension by default")
+    parser.add_argument('--quality', type=int, default=-1, help="encoder quality from 0 to 100")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    preset = load_preset(args)
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("No input images found")
+        return 1
+    plan = plan_outputs(inputs, args.output_dir, args.format)
+    for directory in {os.path.dirname(destination) for _, destination in plan}:
+        os.makedirs(directory or '.', exist_ok=True)
+
+    workers = max(1, min(args.workers, len(inputs)))
+    # the cores are shared between the processes, so each one tiles with fewer threads
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    start = time.perf_counter()
+    failures = 0
+    megapixels = 0.0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(threads,)) as executor:
+        futures = [executor.submit(process_image, path, destination, preset, args.quality)
+                   for path, destination in plan]
+        for future in concurrent.futures.as_completed(futures):
+            report = future.result()
+            if report["error"]:
+                failures += 1
+                print(f"FAILED {report['input']}: {report['error']}")
+                continue
+            megapixels += report["megapixels"]
+            total = report["decode"] + report["process"] + report["encode"]
+            print(f"{report['input']} -> {report['output']}  {report['megapixels']:.1f} MP  "
+                  f"decode {report['decode'] * 1000:.0f} ms, process {report['process'] * 1000:.0f} ms, "
+                  f"encode {report['encode'] * 1000:.0f} ms, total {total * 1000:.0f} ms")
+
+    elapsed = time.perf_counter() - start
+    processed = len(inputs) - failures
+    print(f"{processed} images ({megapixels:.1f} MP) in {elapsed:.2f} s with {workers} processes: "
+          f"{processed / elapsed:.2f} images/s, {megapixels / elapsed:.1f} MP/s")
+    if failures:
+        print(f"{failures} images failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+# No window is ever created, so Qt does not need a display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+from PyQt6.QtCore import QRect, Qt
+from PyQt6.QtGui import QImage, QTransform
+
+import convolution
+import image_bridge
+import image_operations
+import resampling
+import tiling
+
+# Sizes of the synthetic images in megapixels, all with a 3:2 aspect ratio
+DEFAULT_SIZES = (0.3, 1, 4, 12, 24, 50)
+
+# The bundled photos, benchmarked next to the synthetic images
+BUNDLED_IMAGES = ('Kena.png', 'Kena2.jpg')
+
+# Outputs are only cross-checked against the references on images up to this size, the references are slow
+CHECK_MAX_MEGAPIXELS = 4
+
+# The canvas size the resize operation scales to fit in
+CANVAS_SIZE = (1188, 604)
+
+# A run slower than the baseline by more than this fraction is flagged as a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Runs are never flagged for less than this many seconds more than the baseline, short ones vary by more than that
+REGRESSION_MIN_SECONDS = 0.002
+
+# The saturation change differs from the original HSV round trip by up to one level, see
+# image_operations.adjust_array(). An exposure after it scales that level too
+SATURATION_TOLERANCE = 1
+
+PRESET = {"Saturation": 1.2, "Contrast": 1.1, "Brightness": 10, "Exposure": 1.1, "Warmth": 0.9}
+
+ADJUSTMENTS = {"contrast_factor": 1.2, "brightness_factor": 12, "warmth_factor": 1.1, "saturation_factor": 1.3,
+               "exposure_factor": 0.9}
+
+
+def synthetic_image(megapixels, seed=0):
+    """
+    A reproducible test image: smooth colour gradients with noise, so every operation has real work to do.
+    :param megapixels: size of the image
+    :param seed: seed of the noise
+    :return: QImage object in the working format
+    """
+    height = max(int(round((megapixels * 1e6 / 1.5) ** 0.5)), 1)
+    width = max(int(round(height * 1.5)), 1)
+    q_image, pixels = image_bridge.new_image(width, height)
+    random = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    band_rows = 256
+    for top in range(0, height, band_rows):
+        bottom = min(top + band_rows, height)
+        y = np.linspace(top, bottom - 1, bottom - top, dtype=np.float32)[:, np.newaxis] * (255 / max(height - 1, 1))
+        noise = random.integers(-24, 25, size=(bottom - top, width, 3), dtype=np.int16)
+        pixels[top:bottom, :, 0] = np.clip(x + noise[:, :, 0], 0, 255)
+        pixels[top:bottom, :, 1] = np.clip(y + noise[:, :, 1], 0, 255)
+        pixels[top:bottom, :, 2] = np.clip((x + y) / 2 + noise[:, :, 2], 0, 255)
+        pixels[top:bottom, :, 3] = 255
+    return q_image
+
+
+"""
+Float references of the original formulas of the editor, written out again with plain numpy and independent of
+the lookup tables, color_space and blur_engine, so the checks catch a deviation from the original behaviour.
+Like the original functions, every step computes in the same number type they did and truncates its result
+to 8 bits.
+"""
+
+
+def _reference_point(q_image, function, dtype=np.float64):
+    """
+    Applies function((height, width, 3) array in memory order (blue, green, red)) -> array to the color channels,
+    truncating the result like the original functions did. The alpha channel is kept.
+    :param dtype: the type the original converted the pixels to before computing
+    """
+    pixels = image_bridge.view(image_bridge.to_working_format(q_image))
+    result, out = image_bridge.new_image(q_image.width(), q_image.height())
+    out[:, :, :3] = np.clip(function(pixels[:, :, :3].astype(dtype)), 0, 255).astype(np.uint8)
+    out[:, :, 3] = pixels[:, :, 3]
+    return result
+
+
+def _reference_contrast(q_image, factor):
+    return _reference_point(q_image, lambda colors: (colors - 128) * factor + 128, np.float32)
+
+
+def _reference_brightness(q_image, factor):
+    return _reference_point(q_image, lambda colors: colors + factor, np.int16)
+
+
+def _reference_exposure(q_image, factor):
+    return _reference_point(q_image, lambda colors: colors * factor, np.uint16)
+
+
+def _reference_warmth(q_image, factor):
+    # blue is divided and red multiplied by the factor
+    def warm(colors):
+        colors[:, :, 0] /= factor
+        colors[:, :, 2] *= factor
+        return colors
+    return _reference_point(q_image, warm, np.float32)
+
+
+def _reference_saturation(q_image, factor):
+    """
+    The saturation change of the original editor: a float64 round trip through HSV with the saturation scaled,
+    the hue sector picked from h * 6 and the channels rebuilt from (v, p, q, t).
+    """
+    def saturate(colors):
+        # the original named the channels in memory order (red, green, blue), the way it is followed here
+        red, green, blue = colors[:, :, 0], colors[:, :, 1], colors[:, :, 2]
+        value = np.maximum(np.maximum(red, green), blue)
+        chroma = value - np.minimum(np.minimum(red, green), blue)
+        saturation = np.divide(chroma, value, out=np.zeros_like(value), where=value != 0)
+        divisor = np.where(chroma == 0, 1, chroma)
+        red_distance, green_distance, blue_distance = ((value - channel) / divisor for channel in (red, green, blue))
+        hue = np.where(red == value, blue_distance - green_distance,
+                       np.where(green == value, 2.0 + red_distance - blue_distance,
+                                4.0 + green_distance - red_distance))
+        hue = np.where(chroma == 0, 0.0, hue)
+        hue = (hue / 6.0) % 1.0
+
+        saturation = np.clip(saturation * factor, 0, 1)
+        sector = (hue * 6.0).astype(np.int32)
+        fraction = hue * 6.0 - sector
+        p = value * (1.0 - saturation)
+        q = value * (1.0 - saturation * fraction)
+        t = value * (1.0 - saturation * (1.0 - fraction))
+        sector %= 6
+        choices = [(value, t, p), (q, value, p), (p, value, t), (p, q, value), (t, p, value), (value, p, q)]
+        rgb = [np.select([sector == i for i in range(6)], [choice[channel] for choice in choices])
+               for channel in range(3)]
+        rgb = [np.where(saturation == 0.0, value, channel) for channel in rgb]
+        return np.dstack(rgb)
+    return _reference_point(q_image, saturate)
+
+
+def _reference_adjust(q_image):
+    """
+    The adjustment chain of the original editor, one operation after another.
+    """
+    image = _reference_contrast(q_image, ADJUSTMENTS["contrast_factor"])
+    image = _reference_brightness(image, ADJUSTMENTS["brightness_factor"])
+    image = _reference_warmth(image, ADJUSTMENTS["warmth_factor"])
+    image = _reference_saturation(image, ADJUSTMENTS["saturation_factor"])
+    return _reference_exposure(image, ADJUSTMENTS["exposure_factor"])
+
+
+def _reference_preset(q_image):
+    """
+    A preset the way the original filter buttons applied it, one operation after another.
+    """
+    image = _reference_contrast(q_image, PRESET["Contrast"])
+    image = _reference_exposure(image, PRESET["Exposure"])
+    image = _reference_warmth(image, PRESET["Warmth"])
+    image = _reference_brightness(image, PRESET["Brightness"])
+    return _reference_saturation(image, PRESET["Saturation"])
+
+
+def _reference_blur(radius):
+    """
+    A plain gaussian blur with the kernel of the original editor (sigma = max(radius / 2, 1), 2 * radius + 1 taps),
+    in float64 with reflected borders. The 2D kernel is the product of two 1D ones, so it is applied as a sum of
+    shifted copies along each axis. It rounds, as the blur has since the vectorized engine.
+    """
+    sigma = max(radius / 2.0, 1.0)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-(offsets * offsets) / (2.0 * sigma * sigma))
+    kernel /= kernel.sum()
+
+    def run(q_image):
+        pixels = image_bridge.view(image_bridge.to_working_format(q_image)).astype(np.float64)
+        for axis in (0, 1):
+            padding = [(0, 0)] * 3
+            padding[axis] = (radius, radius)
+            padded = np.pad(pixels, padding, mode='reflect')
+            length = pixels.shape[axis]
+            pixels = sum(weight * np.take(padded, np.arange(i, i + length), axis=axis)
+                         for i, weight in enumerate(kernel))
+        result, out = image_bridge.new_image(q_image.width(), q_image.height())
+        out[...] = np.clip(pixels + 0.5, 0, 255)
+        return result
+    return run
+
+
+def _untiled(function):
+    """
+    Runs an array function on the whole image at once, to check the tiled version against.
+    """
+    def run(q_image):
+        result, out = image_bridge.new_image(q_image.width(), q_image.height())
+        out[...] = function(image_bridge.view(image_bridge.to_working_format(q_image)))
+        return result
+    return run
+
+
+def _crop_box(q_image):
+    width, height = q_image.width(), q_image.height()
+    return height // 4, height * 3 // 4, width * 3 // 4, width // 4
+
+
+def _crop_reference(q_image):
+    top, bottom, right, left = _crop_box(q_image)
+    return q_image.copy(QRect(left, top, right - left, bottom - top))
+
+
+def _canvas_fit(q_image):
+    return resampling.fit_size(q_image.width(), q_image.height(), *CANVAS_SIZE)
+
+
+def _area_matrix(source_size, target_size):
+    # output pixel i averages the source from i * scale to (i + 1) * scale, weighted by the overlap
+    scale = source_size / target_size
+    edges = np.arange(target_size + 1) * scale
+    pixels = np.arange(source_size)
+    overlap = np.minimum(pixels + 1, edges[1:, np.newaxis]) - np.maximum(pixels, edges[:-1, np.newaxis])
+    return np.maximum(overlap, 0) / scale
+
+
+def _resize_reference(q_image):
+    width, height = _canvas_fit(q_image)
+    array = image_bridge.view(image_bridge.to_working_format(q_image)).astype(np.float64)
+    rows = np.tensordot(_area_matrix(q_image.height(), height), array, axes=(1, 0))
+    result = np.tensordot(_area_matrix(q_image.width(), width), rows, axes=(1, 1)).transpose(1, 0, 2)
+    q_result, out = image_bridge.new_image(width, height)
+    out[...] = np.clip(result + 0.5, 0, 255)
+    return q_result
+
+
+def _sharpen_reference(array):
+    return convolution.convolve_image(array, image_operations.sharpen_kernel(1.0), method='direct')
+
+
+"""
+Every operation as (function(q_image), reference function(q_image) or None, largest allowed channel difference).
+"""
+OPERATIONS = {
+    'blur': (lambda image: image_operations.blur(image, 5), _reference_blur(5), 1),
+    # from blur_engine.BOX_BLUR_THRESHOLD on, the gaussian is approximated by three box blurs, which differ from
+    # the exact gaussian by up to 10 levels at sharp edges of photos
+    'blur_large': (lambda image: image_operations.blur(image, 40), _reference_blur(40), 12),
+    'sharpen': (lambda image: image_operations.sharpen(image, 1.0), _untiled(_sharpen_reference), 1),
+    'change_saturation': (lambda image: image_operations.change_saturation(image, 1.4),
+                          lambda image: _reference_saturation(image, 1.4), SATURATION_TOLERANCE),
+    'rotate': (image_operations.rotate, lambda image: image.transformed(QTransform().rotate(-90)), 0),
+    # a right angle costs the same resampling as straightening and has an exact reference
+    'rotate_by': (lambda image: image_operations.rotate_by(image, 90),
+                  lambda image: image.transformed(QTransform().rotate(-90)), 0),
+    # large reductions are block averaged first, which moves the edges of the areas slightly
+    'resize': (lambda image: image_operations.resize(image, *_canvas_fit(image), 'area'), _resize_reference, 8),
+    'mirror_lr': (image_operations.mirror_lr, lambda image: image.mirrored(True, False), 0),
+    'crop': (lambda image: image_operations.crop(image, *_crop_box(image)), _crop_reference, 0),
+    'adjust': (lambda image: image_operations.adjust(image, **ADJUSTMENTS), _reference_adjust,
+               math.ceil(SATURATION_TOLERANCE * max(ADJUSTMENTS["exposure_factor"], 1.0))),
+    # the saturation is the last step of a preset
+    'apply_preset': (lambda image: image_operations.apply_preset(image, PRESET), _reference_preset,
+                     SATURATION_TOLERANCE),
+}
+
+
+def peak_memory(function, q_image):
+    """
+    The peak memory an operation allocates, measured in a separate run because tracing slows it down.
+    numpy reports its buffers to tracemalloc, the QImage of the result is allocated by Qt and added to the peak.
+    :return: bytes
+    """
+    tracemalloc.start()
+    try:
+        result = function(q_image)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    if isinstance(result, QImage):
+        peak += result.sizeInBytes()
+    return peak
+
+
+def compare(result, reference):
+    """
+    The largest difference of a channel between two images, and the fraction of pixels that differ at all.
+    :return: (max difference, fraction of differing pixels), max difference is None if the sizes differ
+    """
+    if result.size() != reference.size():
+        return None, 1.0
+    a = image_bridge.view(image_bridge.to_working_format(result)).astype(np.int16)
+    b = image_bridge.view(image_bridge.to_working_format(reference)).astype(np.int16)
+    difference = np.abs(a - b)
+    return int(difference.max()), float(np.count_nonzero(difference.max(axis=2)) / (a.shape[0] * a.shape[1]))
+
+
+def benchmark(name, operation, q_image, repeat):
+    """
+    Times an operation on an image.
+    :return: dict with the best and median time in seconds, the throughput and the peak memory
+    """
+    function, reference, tolerance = OPERATIONS[operation]
+    times = []
+    result = None
+    for _ in range(repeat):
+        result = None
+        start = time.perf_counter()
+        result = function(q_image)
+        times.append(time.perf_counter() - start)
+    peak = peak_memory(function, q_image)
+
+    megapixels = q_image.width() * q_image.height() / 1e6
+    entry = {"image": name, "operation": operation, "megapixels": round(megapixels, 3),
+             "best": min(times), "median": statistics.median(times), "megapixels_per_second": megapixels / min(times),
+             "peak_memory_mb": peak / 2 ** 20, "max_difference": None, "check": None}
+    if reference is not None and megapixels <= CHECK_MAX_MEGAPIXELS:
+        difference, fraction = compare(result, reference(q_image))
+        entry.update(max_difference=difference, differing_pixels=fraction,
+                     check="ok" if difference is not None and difference <= tolerance else "FAILED")
+    return entry
+
+
+def load_images(sizes, bundled):
+    """
+    The images to benchmark, as (name, function returning the QImage). They are created one at a time when needed.
+    """
+    images = [(f"synthetic {size} MP", lambda size=size: synthetic_image(size)) for size in sizes]
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for file_name in bundled:
+        path = os.path.join(directory, file_name)
+        if os.path.exists(path):
+            images.append((file_name, lambda path=path: image_bridge.to_working_format(QImage(path))))
+    return images
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    The results slower than the same operation on the same image in the baseline.
+    :return: list of (result, baseline entry)
+    """
+    previous = {(entry["image"], entry["operation"]): entry for entry in baseline["results"]}
+    regressions = []
+    for entry in results:
+        old = previous.get((entry["image"], entry["operation"]))
+        if old is not None and entry["best"] > max(old["best"] * (1 + tolerance),
+                                                   old["best"] + REGRESSION_MIN_SECONDS):
+            regressions.append((entry, old))
+    return regressions
+
+
+def print_entry(entry):
+    check = entry["check"] or "-"
+    if entry["max_difference"] is not None:
+        check += f" (max diff {entry['max_difference']})"
+    print(f"{entry['image']:<22} {entry['operation']:<18} {entry['best'] * 1e3:10.1f} {entry['median'] * 1e3:10.1f} "
+          f"{entry['megapixels_per_second']:8.1f} {entry['peak_memory_mb']:8.1f}  {check}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the image operations on synthetic images and the "
+                                                 "bundled photos, and compares them with a saved baseline.")
+    parser.add_argument('--sizes', nargs='*', type=float, default=list(DEFAULT_SIZES),
+                        help="sizes of the synthetic images in megapixels")
+    parser.add_argument('--operations', nargs='*', choices=list(OPERATIONS), default=list(OPERATIONS),
+                        help="operations to benchmark, all by default")
+    parser.add_argument('--no-bundled', action='store_true', help="skip Kena.png and Kena2.jpg")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="runs of every operation, the best one counts")
+    parser.add_argument('-w', '--workers', type=int, help="threads of the tiled operations, every core by default")
+    parser.add_argument('--save-baseline', help="JSON file the results are written to")
+    parser.add_argument('--baseline', help="JSON file of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction a run may be slower than the baseline before it is flagged")
+    args = parser.parse_args()
+
+    if args.workers:
+        tiling.set_default_workers(args.workers)
+
+    print(f"{'image':<22} {'operation':<18} {'best ms':>10} {'median ms':>10} {'MP/s':>8} {'peak MB':>8}  check")
+    results = []
+    for name, load in load_images(args.sizes, () if args.no_bundled else BUNDLED_IMAGES):
+        q_image = load()
+        if q_image.isNull():
+            print(f"Could not load {name}")
+            continue
+        for operation in args.operations:
+            entry = benchmark(name, operation, q_image, args.repeat)
+            results.append(entry)
+            print_entry(entry)
+        del q_image
+
+    failed = [entry for entry in results if entry["check"] == "FAILED"]
+    for entry in failed:
+        print(f"Output mismatch: {entry['operation']} on {entry['image']} differs by up to {entry['max_difference']}")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            regressions = find_regressions(results, json.load(baseline_file), args.tolerance)
+        for entry, old in regressions:
+            print(f"Regression: {entry['operation']} on {entry['image']} took {entry['best'] * 1e3:.1f} ms, "
+                  f"baseline {old['best'] * 1e3:.1f} ms")
+
+    if args.save_baseline:
+        baseline = {"python": sys.version.split()[0], "numpy": np.__version__, "machine": platform.machine(),
+                    "processor": platform.processor(), "workers": tiling.default_workers(), "results": results}
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=4)
+
+    return 1 if failed or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
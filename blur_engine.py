@@ -0,0 +1,165 @@
+import functools
+
+import numpy as np
+
+from convolution import pad_axis, convolve_separable, to_uint8
+
+# From this radius on, the box approximation is used instead of the exact gaussian
+BOX_BLUR_THRESHOLD = 12
+
+
+def sigma_for_radius(radius):
+    """
+    The sigma used for a given blur radius. Same relation the editor has always used.
+    :param radius: blur radius in pixels
+    :return: sigma of the gaussian
+    """
+    return max(radius / 2.0, 1.0)
+
+
+@functools.lru_cache(maxsize=64)
+def gaussian_kernel(radius):
+    """
+    Builds a normalized 1D gaussian kernel of width 2 * radius + 1. \n
+    The 2D gaussian is separable, so two passes of this kernel give the same result as the full 2D kernel.
+    The kernels are cached per radius, so moving the slider back and forth does not rebuild them.
+    :param radius: blur radius in pixels
+    :return: read-only float32 numpy array
+    """
+    sigma = sigma_for_radius(radius)
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    kernel = np.exp(-(x * x) / (2.0 * sigma * sigma))
+    kernel /= kernel.sum()
+    kernel = kernel.astype(np.float32)
+    kernel.flags.writeable = False
+    return kernel
+
+
+@functools.lru_cache(maxsize=64)
+def box_sizes_for_gaussian(sigma, passes=3):
+    """
+    Widths of the box filters whose repeated application approximates a gaussian of the given sigma.
+    :param sigma: sigma of the gaussian to approximate
+    :param passes: number of box passes
+    :return: tuple of odd box widths
+    """
+    ideal_width = np.sqrt(12.0 * sigma * sigma / passes + 1)
+    lower_width = int(np.floor(ideal_width))
+    if lower_width % 2 == 0:
+        lower_width -= 1
+    upper_width = lower_width + 2
+
+    ideal_count = (12.0 * sigma * sigma - passes * lower_width * lower_width - 4 * passes * lower_width - 3 * passes) \
+        / (-4.0 * lower_width - 4.0)
+    lower_count = int(round(ideal_count))
+
+    return tuple(lower_width if i < lower_count else upper_width for i in range(passes))
+
+
+def box_blur_axis(array, radius, axis, border='reflect'):
+    """
+    Averages every pixel with its neighbours inside radius along one axis.
+    It uses a running sum (1D summed-area table), so the cost does not depend on the radius.
+    :param array: numpy array
+    :param radius: half width of the box
+    :param axis: the axis to blur along
+    :param border: one of BORDER_MODES
+    :return: float32 numpy array with the same shape as the input
+    """
+    length = array.shape[axis]
+    padded = pad_axis(array, radius + 1, radius, axis, border)
+    # float32 running sums stay exact enough for 8-bit data on rows up to tens of thousands of pixels
+    table = np.cumsum(padded, axis=axis, dtype=np.float32)
+
+    upper = [slice(None)] * array.ndim
+    lower = [slice(None)] * array.ndim
+    upper[axis] = slice(2 * radius + 1, 2 * radius + 1 + length)
+    lower[axis] = slice(0, length)
+
+    result = np.subtract(table[tuple(upper)], table[tuple(lower)])
+    result /= 2 * radius + 1
+    return result
+
+
+def gaussian_blur(array, radius, border='reflect'):
+    """
+    Exact gaussian blur as two separable 1D passes. Cost grows linearly with the radius.
+    :param array: (height, width, channels) numpy array
+    :param radius: blur radius in pixels
+    :param border: one of BORDER_MODES
+    :return: float32 numpy array
+    """
+    kernel = gaussian_kernel(radius)
+    return convolve_separable(array, kernel, kernel, border)
+
+
+def box_gaussian_blur(array, radius, passes=3, border='reflect'):
+    """
+    Approximates a gaussian blur with repeated box blurs. Cost does not depend on the radius.
+    :param array: (height, width, channels) numpy array
+    :param radius: blur radius in pixels
+    :param passes: number of box passes. 3 is visually indistinguishable from a gaussian
+    :param border: one of BORDER_MODES
+    :return: float32 numpy array
+    """
+    result = array
+    for size in box_sizes_for_gaussian(sigma_for_radius(radius), passes):
+        box_radius = size // 2
+        if box_radius < 1:
+            continue
+        result = box_blur_axis(result, box_radius, 0, border)
+        result = box_blur_axis(result, box_radius, 1, border)
+    return result.astype(np.float32, copy=False)
+
+
+def resolve_method(radius, method=None):
+    """
+    The blur method blur_array() uses for a radius.
+    :param radius: blur radius in pixels
+    :param method: 'gaussian', 'box' or None to pick by radius
+    :return: 'gaussian' or 'box'
+    """
+    if method is None:
+        method = 'gaussian' if radius < BOX_BLUR_THRESHOLD else 'box'
+    if method not in ('gaussian', 'box'):
+        raise ValueError(f"Unknown blur method '{method}'")
+    return method
+
+
+def blur_halo(radius, method=None):
+    """
+    How far a blurred pixel can see. Pixels further away than this have no influence on it.
+    Tiles need this many rows of context on each side to blur without seams.
+    :param radius: blur radius in pixels
+    :param method: 'gaussian', 'box' or None to pick by radius
+    :return: number of pixels
+    """
+    if radius < 1:
+        return 0
+    if resolve_method(radius, method) == 'gaussian':
+        return radius
+    # the box passes are applied one after another, so their reaches add up
+    return sum(size // 2 for size in box_sizes_for_gaussian(sigma_for_radius(radius)))
+
+
+def blur_array(array, radius, method=None, border='reflect', out=None):
+    """
+    Blurs a (height, width, channels) uint8 numpy array.
+    :param array: uint8 numpy array
+    :param radius: blur radius in pixels
+    :param method: 'gaussian', 'box' or None to pick by radius
+    :param border: one of BORDER_MODES
+    :param out: optional uint8 array with the same shape to write into
+    :return: the blurred uint8 numpy array
+    """
+    if out is None:
+        out = np.empty_like(array)
+    if radius < 1:
+        out[...] = array
+        return out
+    if resolve_method(radius, method) == 'gaussian':
+        result = gaussian_blur(array, radius, border)
+    else:
+        result = box_gaussian_blur(array, radius, border=border)
+
+    return to_uint8(result, out=out)
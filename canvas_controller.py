@@ -1,20 +1,409 @@
 import sys
+import time
 
 import numpy as np
-from PyQt6.QtGui import QImage, QPixmap
+from PyQt6.QtGui import QImage, QImageReader, QPixmap
 
 import copy
 
 from PyQt6.QtWidgets import QApplication, QWidget, QGraphicsView, QGraphicsScene
 import image_operations
+import image_statistics
+import instrumentation
+import tile_store
 
-from utilites import ValueProperty
+from edit_graph import EditGraph, split_orientation
+from exporter import Exporter
+from history import EditHistory, compute_snapshot
+from image_pyramid import ImagePyramid
+from image_cache import ImageCache
+from orientation import Orientation
+from render_worker import RenderWorker
+from utilites import Signal, ValueProperty
+
+# Images with more pixels than this are kept in a tile_store.TileStore on disk instead of in memory
+LARGE_IMAGE_PIXELS = 100_000_000
+
+# A large image is edited on a copy scaled down to fit in this size, only render() reads the TileStore
+LARGE_IMAGE_DISPLAY_SIZE = (4096, 4096)
 
 
 class CanvasController:
-    def __init__(self):
-        self.original_image = QImage()
+    """
+    Holds the images related to the canvas. \n
+    The original image is never changed. The edits are kept in an EditGraph and previewed on a proxy:
+    a copy of the original image scaled down to the canvas size.
+    The full resolution result is only computed by render(), when it is needed.
+    Previews are rendered by a RenderWorker, off the GUI thread.
+    Every change of the edit graph is recorded in an EditHistory, so it can be undone and redone.
+    Images larger than LARGE_IMAGE_PIXELS are kept in a TileStore, so the memory used does not grow with
+    the image size: original_image is then a scaled down copy and render() streams the edits over the store.
+    """
+
+    def __init__(self, history_budget=None, image_cache=None, memory_limit=tile_store.DEFAULT_MEMORY_LIMIT):
+        self._original_image = QImage()
+        # The full resolution pixels of a large image, None for images kept in memory
+        self.tile_store = None
+        self.memory_limit = memory_limit
         self.scene_image = QImage()
         self.numpy_array = None
         self.scene_image_updated = ValueProperty(False)
         self.file_path = None
+        # Decoded images of the recently opened files
+        self.image_cache = image_cache if image_cache is not None else ImageCache()
+
+        # The size the proxy is scaled to fit in. None means the original image is used as it is
+        self.proxy_size = None
+        self._proxy_image = None
+
+        # The edits applied to the original image. The proxy outputs of its nodes are cached
+        self.edit_graph = EditGraph()
+        # The edit graph applied to the proxy, before it is scaled for display. A rotation or mirror at the end of
+        # the edits is not applied to it, the canvas shows it with preview_orientation as a display transform
+        self.preview_image = QImage()
+        self.preview_orientation = Orientation()
+        # The histograms of preview_image, image_statistics.ImageStatistics. Kept for the last image they were
+        # computed for, so a preview that did not change the pixels, e.g. a rotation, reuses them
+        self.statistics = ValueProperty(None)
+        self._statistics_cache = (None, None)
+        # The states of the edit graph, with compressed previews of them. history_budget limits their size in bytes
+        self.history = EditHistory() if history_budget is None else EditHistory(history_budget)
+        # Emitted with the nodes whenever the edits are replaced at once (undo, redo, revert, a new original),
+        # so the controls showing them can follow
+        self.edits_restored = Signal()
+
+        self.render_worker = RenderWorker()
+        self.render_worker.rendered.connect(self._show_preview)
+        # when the edits of the shown preview were requested, until the canvas paints it
+        self.preview_requested = None
+
+        # The mipmap pyramid of the full resolution result, used when the canvas is zoomed in. Built on request
+        self.pyramid = ValueProperty(None)
+        self._pyramid_nodes = None
+        self.pyramid_worker = RenderWorker()
+        self.pyramid_worker.rendered.connect(self._set_pyramid)
+
+        # Saves the full resolution result in the background
+        self.exporter = Exporter()
+        self.exporter.finished.connect(self.image_cache.discard)
+
+    @property
+    def original_image(self):
+        return self._original_image
+
+    @original_image.setter
+    def original_image(self, image):
+        self._original_image = image
+        self._proxy_image = None
+        self.edit_graph.clear()
+        self.edit_graph.clear_cache()
+        self.history.clear()
+        self.preview_image = self.proxy_image
+        self.preview_orientation = Orientation()
+        self.statistics.value = self.compute_statistics(self.preview_image)
+        # a preview of the previous original must not replace the new one
+        self.render_worker.cancel()
+        self.pyramid_worker.cancel()
+        self._pyramid_nodes = None
+        self.pyramid.value = None
+        self.edits_restored.emit(self.edit_graph.nodes)
+
+    def open_image(self, file_path):
+        """
+        Makes the image of a file the original image. Recently opened files come from the image cache
+        without being decoded again.
+        :param file_path: path of the image file
+        :return: False if the file could not be read
+        """
+        size = QImageReader(file_path).size()
+        if size.isValid() and size.width() * size.height() > LARGE_IMAGE_PIXELS:
+            return self._open_large_image(file_path)
+
+        image = self.image_cache.load(file_path)
+        if image.isNull():
+            return False
+        self._set_tile_store(None)
+        self.file_path = file_path
+        self.original_image = image
+        return True
+
+    def _open_large_image(self, file_path):
+        store = tile_store.TileStore.from_file(file_path, self.memory_limit)
+        if store is None:
+            return False
+        self._set_tile_store(store)
+        self.file_path = file_path
+        self.original_image = store.scaled(*LARGE_IMAGE_DISPLAY_SIZE)
+        return True
+
+    def _set_tile_store(self, store):
+        if self.tile_store is not None and self.tile_store is not store:
+            self.tile_store.close()
+        self.tile_store = store
+
+    def revert(self):
+        """
+        Drops all the edits. If the file changed on disk since it was opened, it is opened again.
+        """
+        if self.file_path is not None and self.tile_store is None:
+            image = self.image_cache.load(self.file_path)
+            if not image.isNull() and image.cacheKey() != self._original_image.cacheKey():
+                self.original_image = image
+                # setting the original emits edits_restored
+                self.scene_image = self.proxy_image
+                return
+        self.reset_edits()
+        self.edits_restored.emit(self.edit_graph.nodes)
+
+    def set_proxy_size(self, width, height):
+        """
+        Sets the size the proxy has to fit in, usually the size of the canvas.
+        :param width: maximum width of the proxy
+        :param height: maximum height of the proxy
+        """
+        if self.proxy_size != (width, height):
+            self.proxy_size = (width, height)
+            self._proxy_image = None
+            # the stored previews have the old size
+            self.history.clear_snapshots()
+
+    @property
+    def proxy_image(self):
+        """
+        The original image scaled down to fit in proxy_size. It is cached until the original or the size changes.
+        Images that already fit are not scaled.
+        """
+        if self._proxy_image is None:
+            original = self._original_image
+            if self.proxy_size is None or original.isNull() or \
+                    (original.width() <= self.proxy_size[0] and original.height() <= self.proxy_size[1]):
+                self._proxy_image = original
+            else:
+                self._proxy_image = image_operations.scale_to_fit(original, self.proxy_size[0], self.proxy_size[1],
+                                                                  'area')
+        return self._proxy_image
+
+    @property
+    def original_width(self):
+        """
+        The width of the original image at full resolution.
+        """
+        if self.tile_store is not None:
+            return self.tile_store.width
+        return self._original_image.width()
+
+    @property
+    def proxy_scale(self):
+        """
+        The size of the proxy relative to the original image at full resolution.
+        """
+        if self._original_image.isNull() or self.original_width == 0:
+            return 1.0
+        return self.proxy_image.width() / self.original_width
+
+    def update_preview(self, record=True):
+        """
+        Renders the edit graph on the proxy. It runs in the background, scene_image_updated is set
+        when the result is ready. Only the nodes that changed since the last preview are recomputed.
+        An orientation at the end is left to the display, so rotating and mirroring comes from the cache.
+        :param record: whether the current edits are recorded as a new undo step
+        """
+        if record:
+            self.history.record(self.edit_graph.nodes)
+        proxy_image, proxy_scale, nodes = self.proxy_image, self.proxy_scale, self.edit_graph.nodes
+        pixel_nodes, _ = split_orientation(nodes)
+        requested = time.perf_counter()
+        snapshot_base = self.history.snapshot_base()
+
+        def render(check):
+            with instrumentation.timer('preview render', proxy_image):
+                # a newer request stops this render between two nodes
+                image = self.edit_graph.evaluate(proxy_image, proxy_scale, 'proxy', pixel_nodes, progress=check)
+                check()
+                return self._preview_result(nodes, image, requested, snapshot_base)
+        self.render_worker.submit(render)
+
+    def set_edit(self, key, kind=None, **params):
+        """
+        Sets the parameters of an edit and previews the result, see EditGraph.set_node().
+        """
+        self.edit_graph.set_node(key, kind, **params)
+        self.update_preview()
+
+    def add_edit(self, kind, **params):
+        """
+        Adds an edit after all the others and previews the result, see EditGraph.add_node().
+        """
+        self.edit_graph.add_node(kind, **params)
+        self.update_preview()
+
+    def orient(self, kind):
+        """
+        Rotates or mirrors the image. Consecutive rotations and mirrors are composed into one orientation node,
+        which is only applied to the pixels by render() and export(), however many clicks it stands for.
+        :param kind: 'rotate' (90 degrees counter-clockwise), 'mirror_lr' or 'mirror_ud'
+        """
+        edit_graph = self.edit_graph
+        pixel_nodes, orientation = split_orientation(edit_graph.nodes)
+        orientation = orientation.then(kind)
+        # a new node every click, so each one is its own undo step
+        edit_graph.nodes = pixel_nodes
+        if not orientation.is_identity():
+            edit_graph.add_node('orientation', rotation=orientation.rotation, mirrored=orientation.mirrored)
+        self.update_preview()
+
+    def straighten(self, angle, method='bilinear'):
+        """
+        Rotates the image by a small angle, see image_operations.rotate_by().
+        :param angle: angle in degrees, counter-clockwise for positive angles
+        :param method: resampling method, 'bilinear' or 'bicubic'
+        """
+        self.set_edit('straighten', angle=angle, method=method)
+
+    def reset_edits(self):
+        """
+        Drops all the edits and shows the original image again.
+        """
+        self.render_worker.cancel()
+        self.edit_graph.clear()
+        self.history.record(self.edit_graph.nodes)
+        self.history.store_image(self.edit_graph.nodes, self.proxy_image)
+        self.preview_image = self.scene_image = self.proxy_image
+        self.preview_orientation = Orientation()
+        self.statistics.value = self.compute_statistics(self.preview_image)
+
+    def undo(self):
+        """
+        Goes back to the edits before the last change.
+        :return: False if there was nothing to undo
+        """
+        entry = self.history.undo()
+        if entry is None:
+            return False
+        self._restore(entry)
+        return True
+
+    def redo(self):
+        """
+        Goes forward to the edits undone last.
+        :return: False if there was nothing to redo
+        """
+        entry = self.history.redo()
+        if entry is None:
+            return False
+        self._restore(entry)
+        return True
+
+    def _restore(self, entry):
+        """
+        Shows the edits of a history entry. Its stored preview is shown right away if there is one,
+        otherwise the preview is rendered again.
+        """
+        self.render_worker.cancel()
+        self.edit_graph.nodes = entry.nodes
+        self.edits_restored.emit(entry.nodes)
+        image = self.history.image()
+        if image is None:
+            self.update_preview(record=False)
+            return
+        self._show_preview(self._preview_result(entry.nodes, image, time.perf_counter()))
+
+    def _preview_result(self, nodes, image, requested, snapshot_base=None):
+        # what _show_preview() needs besides the preview, computed with it in the render worker. The history
+        # snapshot is compressed here too, the GUI thread only attaches it to its entry
+        snapshot = compute_snapshot(snapshot_base, image) if snapshot_base is not None else None
+        return nodes, image, self.fit_to_display(image, split_orientation(nodes)[1]), \
+            self.compute_statistics(image), snapshot, requested
+
+    def compute_statistics(self, image):
+        """
+        The histograms of an image, see image_statistics.compute(). They are sampled, so they cost a few
+        milliseconds on a preview, and not computed again for the image they were computed for last.
+        :param image: QImage object
+        :return: image_statistics.ImageStatistics object
+        """
+        key, statistics = self._statistics_cache
+        if key != image.cacheKey():
+            statistics = image_statistics.compute(image)
+            self._statistics_cache = (image.cacheKey(), statistics)
+        return statistics
+
+    def fit_to_display(self, image, orientation):
+        """
+        The image scaled down to fit in proxy_size once it is shown in an orientation, e.g. a preview turned
+        by 90 degrees that fits the canvas the other way round. It runs in the render worker with the preview.
+        :param image: QImage object
+        :param orientation: orientation.Orientation object the image is displayed in
+        :return: QImage object, image itself if it already fits
+        """
+        if self.proxy_size is None or image.isNull():
+            return image
+        max_width, max_height = orientation.size(*self.proxy_size)
+        if image.width() <= max_width and image.height() <= max_height:
+            return image
+        return image_operations.scale_to_fit(image, max_width, max_height, 'area')
+
+    def display_to_original_scale(self):
+        """
+        The factor converting a length on the displayed scene_image to original image pixels.
+        """
+        if self.scene_image.isNull() or self.scene_image.width() == 0:
+            return 1.0
+        return self.preview_image.width() / self.scene_image.width() / self.proxy_scale
+
+    def display_to_original_rect(self, top, bottom, right, left):
+        """
+        Maps a rectangle on the displayed scene_image to original image pixels, e.g. the crop rubber band.
+        Sides outside the image are clamped to it.
+        :return: top, bottom, right, left as integers in original image pixels
+        """
+        scale = self.display_to_original_scale()
+        return tuple(max(int(round(side * scale)), 0) for side in (top, bottom, right, left))
+
+    def request_pyramid(self):
+        """
+        Builds the pyramid of the current edits at full resolution in the background, unless it is already built.
+        pyramid is set when it is ready.
+        :return: True if pyramid already shows the current edits
+        """
+        nodes = self.edit_graph.nodes
+        if nodes == self._pyramid_nodes:
+            return self.pyramid.value is not None
+        self._pyramid_nodes = nodes
+        self.pyramid.value = None
+        source = self.tile_store if self.tile_store is not None else self._original_image
+        self.pyramid_worker.submit(
+            lambda check: (nodes, ImagePyramid(self.edit_graph.evaluate(source, nodes=nodes, progress=check))))
+        return False
+
+    def _set_pyramid(self, result):
+        nodes, pyramid = result
+        if nodes == self._pyramid_nodes:
+            self.pyramid.value = pyramid
+
+    def _show_preview(self, result):
+        nodes, image, display_image, statistics, snapshot, self.preview_requested = result
+        self.history.attach_snapshot(nodes, snapshot)
+        self.preview_image = image
+        self.scene_image = display_image
+        self.preview_orientation = split_orientation(nodes)[1]
+        self.statistics.value = statistics
+        self.scene_image_updated.value = True
+
+    def render(self):
+        """
+        Applies the edits to the original image at full resolution.
+        :return: QImage object, or a TileStore for large images. Both can be saved with save(file_path)
+        """
+        if self.tile_store is not None:
+            return self.edit_graph.evaluate(self.tile_store)
+        return self.edit_graph.evaluate(self._original_image)
+
+    def export(self, options):
+        """
+        Renders the current edits at full resolution and saves them in the background, see exporter.Exporter
+        for the progress and the result.
+        :param options: exporter.ExportOptions object
+        """
+        source = self.tile_store if self.tile_store is not None else self._original_image
+        self.exporter.export(self.edit_graph, source, self.edit_graph.nodes, options)
@@ -0,0 +1,202 @@
+import functools
+import os
+
+import numpy as np
+
+import color_space
+
+# Points per axis of a compiled table, the common size of .cube files
+DEFAULT_LUT_SIZE = 33
+
+
+class ColorLUT:
+    """
+    A 3D colour lookup table: table[r, g, b] is the output colour (red, green, blue) of the grid point
+    (r, g, b) / (size - 1), all values from 0 to 1. Colours between the grid points are interpolated trilinearly.
+    """
+
+    def __init__(self, table, title=None):
+        table = np.ascontiguousarray(table, dtype=np.float32)
+        if table.ndim != 4 or table.shape[3] != 3 or not table.shape[0] == table.shape[1] == table.shape[2]:
+            raise ValueError(f"Expected a (size, size, size, 3) table, got {table.shape}")
+        self.table = table
+        self.title = title
+        self._flat = None
+        self._axis = None
+
+    @property
+    def size(self):
+        return self.table.shape[0]
+
+    def _lookup_tables(self):
+        """
+        The flattened table, scaled to 0..255, and for every 8-bit channel value its lower grid index and the
+        weight of the upper one. Computed once, so applying the table needs no divisions.
+        """
+        if self._flat is None:
+            size = self.size
+            self._flat = (self.table * 255).reshape(-1, 3)
+            position = np.arange(256, dtype=np.float32) * ((size - 1) / 255)
+            lower = np.minimum(position.astype(np.intp), size - 2)
+            self._axis = (lower, (position - lower).astype(np.float32))
+        return self._flat, self._axis
+
+    def apply_array(self, argb_array, out=None):
+        """
+        Transforms the colours of an ARGB32 numpy array. Alpha is kept as it is.
+        :param argb_array: (height, width, 4) uint8 numpy array
+        :param out: optional uint8 array with the same shape to write into. It may be argb_array itself
+        :return: the transformed uint8 numpy array
+        """
+        if out is None:
+            out = np.empty_like(argb_array)
+        flat, (lower, weight) = self._lookup_tables()
+        size = self.size
+        red, green, blue = (argb_array[:, :, i] for i in color_space.WORKING_ORDER)
+
+        # index of the lower corner of the grid cell around every pixel, and the weights of the upper corners
+        index = lower[red] * (size * size)
+        index += lower[green] * size
+        index += lower[blue]
+        weights = (weight[red][..., np.newaxis], weight[green][..., np.newaxis], weight[blue][..., np.newaxis])
+
+        # interpolate along blue, then green, then red
+        strides = (size * size, size, 1)
+        result = None
+        for r_step in (0, 1):
+            plane = None
+            for g_step in (0, 1):
+                corner = index + (r_step * strides[0] + g_step * strides[1])
+                low = flat[corner]
+                line = flat[corner + 1]
+                line -= low
+                line *= weights[2]
+                line += low
+                plane = line if plane is None else _lerp(plane, line, weights[1])
+            result = plane if result is None else _lerp(result, plane, weights[0])
+
+        result += 0.5
+        np.clip(result, 0, 255, out=result)
+        for channel, i in enumerate(color_space.WORKING_ORDER):
+            out[:, :, i] = result[:, :, channel]
+        if out is not argb_array:
+            out[:, :, 3] = argb_array[:, :, 3]
+        return out
+
+    def write_cube(self, file_path):
+        """
+        Saves the table as a .cube file, the format used by most photo and video tools.
+        :param file_path: path of the .cube file
+        """
+        with open(file_path, 'w') as cube_file:
+            if self.title:
+                cube_file.write(f'TITLE "{self.title}"\n')
+            cube_file.write(f"LUT_3D_SIZE {self.size}\n")
+            cube_file.write("DOMAIN_MIN 0.0 0.0 0.0\nDOMAIN_MAX 1.0 1.0 1.0\n")
+            # red changes fastest, so the entries are written in [b, g, r] order
+            rows = self.table.transpose(2, 1, 0, 3).reshape(-1, 3)
+            np.savetxt(cube_file, rows, fmt="%.6f")
+
+
+def _lerp(low, high, weight):
+    """
+    low + (high - low) * weight, computed in place in high.
+    """
+    high -= low
+    high *= weight
+    high += low
+    return high
+
+
+def read_cube(file_path):
+    """
+    Reads a 3D lookup table from a .cube file. Inputs outside DOMAIN_MIN..DOMAIN_MAX are rescaled to 0..1.
+    :param file_path: path of the .cube file
+    :return: ColorLUT object
+    """
+    title = None
+    size = None
+    domain_min = np.zeros(3, dtype=np.float32)
+    domain_max = np.ones(3, dtype=np.float32)
+    rows = []
+    with open(file_path, 'r') as cube_file:
+        for line in cube_file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            keyword, _, value = line.partition(' ')
+            if keyword == 'TITLE':
+                title = value.strip().strip('"')
+            elif keyword == 'LUT_3D_SIZE':
+                size = int(value)
+            elif keyword == 'DOMAIN_MIN':
+                domain_min = np.array(value.split(), dtype=np.float32)
+            elif keyword == 'DOMAIN_MAX':
+                domain_max = np.array(value.split(), dtype=np.float32)
+            elif keyword == 'LUT_1D_SIZE':
+                raise ValueError("1D .cube files are not supported")
+            elif keyword[0].isdigit() or keyword[0] in '-.':
+                rows.append(line.split())
+    if size is None or len(rows) != size ** 3:
+        raise ValueError(f"Invalid .cube file {file_path}: expected LUT_3D_SIZE and size^3 entries")
+
+    values = np.array(rows, dtype=np.float32)
+    values = (values - domain_min) / (domain_max - domain_min)
+    table = values.reshape(size, size, size, 3).transpose(2, 1, 0, 3)
+    return ColorLUT(np.clip(table, 0, 1), title or os.path.splitext(os.path.basename(file_path))[0])
+
+
+def compile_pipeline(function, size=DEFAULT_LUT_SIZE, title=None):
+    """
+    Builds a 3D lookup table by running a colour transform on the grid points.
+    :param function: function(rgb) -> rgb on (n, 3) float32 arrays with values from 0 to 255 in RGB order
+    :param size: points per axis
+    :param title: optional name of the table
+    :return: ColorLUT object
+    """
+    axis = np.linspace(0, 255, size, dtype=np.float32)
+    grid = np.stack(np.meshgrid(axis, axis, axis, indexing='ij'), axis=-1).reshape(-1, 3)
+    values = np.clip(function(grid), 0, 255) / 255
+    return ColorLUT(values.reshape(size, size, size, 3), title)
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_preset(preset_items, size):
+    # imported here, image_operations uses this module
+    import image_operations
+
+    preset = dict(preset_items)
+    # the point operations of the preset as (256, 3) curves in RGB order, interpolated between the 8-bit values
+    curves = image_operations.preset_lut(preset)[:, 2::-1].astype(np.float32)
+    saturation = preset["Saturation"]
+
+    def transform(rgb):
+        result = np.empty_like(rgb)
+        for channel in range(3):
+            result[:, channel] = np.interp(rgb[:, channel], np.arange(256), curves[:, channel])
+        if saturation != 1.0:
+            color_space.saturate_hsv(result, saturation, out=result)
+        return result
+
+    lut = compile_pipeline(transform, size)
+    lut.table.setflags(write=False)
+    return lut
+
+
+def compile_preset(preset, size=DEFAULT_LUT_SIZE):
+    """
+    Compiles a filter preset (an entry of Filters.json) into a 3D lookup table. Tables are cached,
+    so every preset is compiled once. A preset imported from a .cube file is read from its file instead.
+    :param preset: dict with the keys "Contrast", "Exposure", "Warmth", "Brightness" and "Saturation",
+    or with the key "LUT" holding the path of a .cube file
+    :param size: points per axis
+    :return: ColorLUT object
+    """
+    if "LUT" in preset:
+        return _read_cube_cached(preset["LUT"], os.path.getmtime(preset["LUT"]))
+    return _compile_preset(tuple(sorted(preset.items())), size)
+
+
+@functools.lru_cache(maxsize=16)
+def _read_cube_cached(file_path, mtime):
+    return read_cube(file_path)
@@ -0,0 +1,212 @@
+import numpy as np
+
+# Channel orders, given as the indexes of (red, green, blue) along the last axis
+RGB = (0, 1, 2)
+BGR = (2, 1, 0)
+
+# The colour channels of the ARGB32 working layout are stored (blue, green, red) in memory on little-endian machines
+WORKING_ORDER = BGR
+
+# Largest channel value, the HSL lightness and the luminance clip are relative to it
+MAX_VALUE = 255.0
+
+# Rec. 601 luma weights of (red, green, blue)
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+# Stands in for a zero chroma in divisions. Every numerator is 0 then too, so the result is 0
+_EPSILON = np.float32(1e-12)
+
+
+def _as_float(array):
+    return np.asarray(array, dtype=np.float32)
+
+
+def _hue(r, g, b, maxc, delta, out):
+    """
+    Writes the hue (from 0 to 1) into out. Ties between maximal channels are resolved red first, then green,
+    like colorsys.
+    """
+    # the hue relative to the maximal channel, in units of delta: blue 4 + (r - g), green 2 + (b - r), red (g - b)
+    np.subtract(r, g, out=out)
+    out += 4 * delta
+    np.copyto(out, b - r + 2 * delta, where=g == maxc)
+    np.copyto(out, g - b, where=r == maxc)
+    out /= 6 * np.maximum(delta, _EPSILON)
+    np.mod(out, 1.0, out=out)
+    return out
+
+
+def rgb_to_hsv(rgb, out=None, order=RGB):
+    """
+    Converts colours to HSV in float32. \n
+    Hue and saturation are from 0 to 1, the value has the range of the input.
+    :param rgb: (..., 3) numpy array
+    :param out: optional float32 array of the same shape to write into. It must not be rgb itself
+    :param order: channel order of rgb, RGB or BGR
+    :return: (..., 3) float32 numpy array of (hue, saturation, value)
+    """
+    rgb = _as_float(rgb)
+    if out is None:
+        out = np.empty(rgb.shape, dtype=np.float32)
+    r, g, b = (rgb[..., i] for i in order)
+
+    maxc = np.maximum(r, g)
+    np.maximum(maxc, b, out=maxc)
+    delta = np.minimum(r, g)
+    np.minimum(delta, b, out=delta)
+    np.subtract(maxc, delta, out=delta)
+
+    _hue(r, g, b, maxc, delta, out[..., 0])
+    np.divide(delta, np.maximum(maxc, _EPSILON), out=out[..., 1])
+    out[..., 2] = maxc
+    return out
+
+
+def hsv_to_rgb(hsv, out=None, order=RGB):
+    """
+    Converts HSV colours back, see rgb_to_hsv(). Every channel is computed with the same formula,
+    so no per-sector masks are needed.
+    :param hsv: (..., 3) numpy array of (hue, saturation, value)
+    :param out: optional float32 array of the same shape to write into. It must not be hsv itself
+    :param order: channel order of the result, RGB or BGR
+    :return: (..., 3) float32 numpy array
+    """
+    hsv = _as_float(hsv)
+    if out is None:
+        out = np.empty(hsv.shape, dtype=np.float32)
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    chroma = v * s
+    k = np.empty_like(chroma)
+    t = np.empty_like(chroma)
+
+    # channel = v - chroma * clip(min(k, 4 - k), 0, 1) with k = (n + 6h) mod 6, n = 5, 3, 1 for red, green, blue
+    for channel, n in zip(order, (5, 3, 1)):
+        np.multiply(h, 6, out=k)
+        k += n
+        np.mod(k, 6, out=k)
+        np.subtract(4, k, out=t)
+        np.minimum(k, t, out=k)
+        np.clip(k, 0, 1, out=k)
+        k *= chroma
+        np.subtract(v, k, out=out[..., channel])
+    return out
+
+
+def rgb_to_hsl(rgb, out=None, order=RGB, max_value=MAX_VALUE):
+    """
+    Converts colours to HSL in float32. \n
+    Hue and saturation are from 0 to 1, the lightness has the range of the input.
+    :param rgb: (..., 3) numpy array with values from 0 to max_value
+    :param out: optional float32 array of the same shape to write into. It must not be rgb itself
+    :param order: channel order of rgb, RGB or BGR
+    :param max_value: the largest channel value
+    :return: (..., 3) float32 numpy array of (hue, saturation, lightness)
+    """
+    rgb = _as_float(rgb)
+    if out is None:
+        out = np.empty(rgb.shape, dtype=np.float32)
+    r, g, b = (rgb[..., i] for i in order)
+
+    maxc = np.maximum(r, g)
+    np.maximum(maxc, b, out=maxc)
+    minc = np.minimum(r, g)
+    np.minimum(minc, b, out=minc)
+    delta = maxc - minc
+
+    _hue(r, g, b, maxc, delta, out[..., 0])
+    # saturation = delta / (max_value - |max + min - max_value|)
+    total = np.add(maxc, minc, out=minc)
+    np.multiply(total, 0.5, out=out[..., 2])
+    total -= max_value
+    np.abs(total, out=total)
+    np.subtract(max_value, total, out=total)
+    np.maximum(total, _EPSILON, out=total)
+    np.divide(delta, total, out=out[..., 1])
+    return out
+
+
+def hsl_to_rgb(hsl, out=None, order=RGB, max_value=MAX_VALUE):
+    """
+    Converts HSL colours back, see rgb_to_hsl(). Every channel is computed with the same formula,
+    so no per-sector masks are needed.
+    :param hsl: (..., 3) numpy array of (hue, saturation, lightness)
+    :param out: optional float32 array of the same shape to write into. It must not be hsl itself
+    :param order: channel order of the result, RGB or BGR
+    :param max_value: the largest channel value
+    :return: (..., 3) float32 numpy array
+    """
+    hsl = _as_float(hsl)
+    if out is None:
+        out = np.empty(hsl.shape, dtype=np.float32)
+    h, s, lightness = hsl[..., 0], hsl[..., 1], hsl[..., 2]
+    a = np.minimum(lightness, max_value - lightness)
+    a *= s
+    k = np.empty_like(a)
+    t = np.empty_like(a)
+
+    # channel = l - a * clip(min(k - 3, 9 - k), -1, 1) with k = (n + 12h) mod 12, n = 0, 8, 4 for red, green, blue
+    for channel, n in zip(order, (0, 8, 4)):
+        np.multiply(h, 12, out=k)
+        k += n
+        np.mod(k, 12, out=k)
+        np.subtract(9, k, out=t)
+        k -= 3
+        np.minimum(k, t, out=k)
+        np.clip(k, -1, 1, out=k)
+        k *= a
+        np.subtract(lightness, k, out=out[..., channel])
+    return out
+
+
+def saturate_hsv(rgb, factor, out=None):
+    """
+    Scales the HSV saturation of colours, clipped to 1, without converting to HSV and back. \n
+    With the value (the maximal channel) unchanged, scaling the saturation moves every channel away from
+    the value: c' = v + (c - v) * min(factor, v / (v - min)). The result is the same for any channel order.
+    :param rgb: (..., 3) numpy array
+    :param factor: saturation factor, 1 changes nothing
+    :param out: optional float32 array of the same shape to write into. It may be rgb itself
+    :return: (..., 3) float32 numpy array
+    """
+    rgb = _as_float(rgb)
+    if out is None:
+        out = np.empty(rgb.shape, dtype=np.float32)
+    # channel-wise maximum/minimum, a reduction over an axis of length 3 is much slower
+    maxc = np.maximum(rgb[..., 0:1], rgb[..., 1:2])
+    np.maximum(maxc, rgb[..., 2:3], out=maxc)
+    gain = np.minimum(rgb[..., 0:1], rgb[..., 1:2])
+    np.minimum(gain, rgb[..., 2:3], out=gain)
+    np.subtract(maxc, gain, out=gain)
+    np.maximum(gain, _EPSILON, out=gain)
+    np.divide(maxc, gain, out=gain)
+    np.minimum(gain, max(factor, 0.0), out=gain)
+
+    np.subtract(rgb, maxc, out=out)
+    out *= gain
+    out += maxc
+    return out
+
+
+def saturate_luminance(rgb, factor, out=None, order=RGB, max_value=MAX_VALUE):
+    """
+    Scales the saturation of colours while keeping their luminance: every channel moves away from
+    the Rec. 601 luma, c' = y + (c - y) * factor, and is clipped to the channel range.
+    :param rgb: (..., 3) numpy array with values from 0 to max_value
+    :param factor: saturation factor, 1 changes nothing
+    :param out: optional float32 array of the same shape to write into. It may be rgb itself
+    :param order: channel order of rgb, RGB or BGR
+    :param max_value: the largest channel value
+    :return: (..., 3) float32 numpy array
+    """
+    rgb = _as_float(rgb)
+    if out is None:
+        out = np.empty(rgb.shape, dtype=np.float32)
+    weights = np.zeros(3, dtype=np.float32)
+    weights[list(order)] = LUMA_WEIGHTS
+    luma = np.matmul(rgb, weights)[..., np.newaxis]
+
+    np.subtract(rgb, luma, out=out)
+    out *= factor
+    out += luma
+    np.clip(out, 0, max_value, out=out)
+    return out
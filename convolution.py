@@ -0,0 +1,250 @@
+import functools
+
+import numpy as np
+
+# np.pad modes used for the pixels outside the image
+BORDER_MODES = {
+    'reflect': 'reflect',
+    'edge': 'edge',
+    'wrap': 'wrap',
+    'constant': 'constant',
+}
+
+# Kernels with more taps than this are convolved in the frequency domain
+FFT_THRESHOLD = 15 * 15
+
+# Relative singular value below which a kernel is treated as rank 1 (separable)
+SEPARABLE_TOLERANCE = 1e-6
+
+# The alpha channel in the ARGB32 memory layout (B, G, R, A)
+COLOR_CHANNELS = slice(0, 3)
+ALPHA_CHANNEL = 3
+
+
+def pad_axis(array, pad_before, pad_after, axis, border='reflect'):
+    """
+    Pads a numpy array along one axis only.
+    :param array: numpy array
+    :param pad_before: number of pixels added in front
+    :param pad_after: number of pixels added at the end
+    :param axis: the axis to pad
+    :param border: one of BORDER_MODES
+    :return: padded numpy array
+    """
+    if border not in BORDER_MODES:
+        raise ValueError(f"Unknown border mode '{border}'")
+    pad_width = [(0, 0)] * array.ndim
+    pad_width[axis] = (pad_before, pad_after)
+    return np.pad(array, pad_width, mode=BORDER_MODES[border])
+
+
+def pad_2d(array, kernel_shape, border='reflect'):
+    """
+    Pads the first two axes of an array so a kernel of kernel_shape fits at every pixel.
+    :param array: (height, width) or (height, width, channels) numpy array
+    :param kernel_shape: (kernel height, kernel width)
+    :param border: one of BORDER_MODES
+    :return: padded numpy array
+    """
+    if border not in BORDER_MODES:
+        raise ValueError(f"Unknown border mode '{border}'")
+    kernel_height, kernel_width = kernel_shape
+    pad_width = [(kernel_height // 2, (kernel_height - 1) // 2), (kernel_width // 2, (kernel_width - 1) // 2)]
+    pad_width += [(0, 0)] * (array.ndim - 2)
+    return np.pad(array, pad_width, mode=BORDER_MODES[border])
+
+
+def convolve_axis(array, kernel, axis, border='reflect'):
+    """
+    Convolves a numpy array with a 1D kernel along one axis.
+    :param array: numpy array
+    :param kernel: 1D kernel
+    :param axis: the axis to convolve along
+    :param border: one of BORDER_MODES
+    :return: float32 numpy array with the same shape as the input
+    """
+    kernel = np.asarray(kernel, dtype=np.float32)[::-1]
+    length = array.shape[axis]
+    padded = pad_axis(array, len(kernel) // 2, (len(kernel) - 1) // 2, axis, border)
+
+    def window(start):
+        index = [slice(None)] * array.ndim
+        index[axis] = slice(start, start + length)
+        return padded[tuple(index)]
+
+    result = np.multiply(window(0), kernel[0], dtype=np.float32)
+    scratch = np.empty_like(result)
+    for i in range(1, len(kernel)):
+        if kernel[i] == 0:
+            continue
+        np.multiply(window(i), kernel[i], out=scratch)
+        result += scratch
+    return result
+
+
+def separate_kernel(kernel):
+    """
+    Splits a 2D kernel into a column and a row vector if it is separable (rank 1).
+    :param kernel: 2D numpy array
+    :return: (column, row) 1D float32 arrays, or None if the kernel is not separable
+    """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    if kernel.shape[0] == 1:
+        return np.ones(1, np.float32), kernel[0, :].astype(np.float32)
+    if kernel.shape[1] == 1:
+        return kernel[:, 0].astype(np.float32), np.ones(1, np.float32)
+
+    u, s, vt = np.linalg.svd(kernel)
+    if s[0] == 0 or s[1] > SEPARABLE_TOLERANCE * s[0]:
+        return None
+    scale = np.sqrt(s[0])
+    return (u[:, 0] * scale).astype(np.float32), (vt[0, :] * scale).astype(np.float32)
+
+
+def convolve_direct(array, kernel, border='reflect'):
+    """
+    Spatial convolution as a sum of shifted, weighted copies of the image. Cost grows with the kernel area.
+    :param array: (height, width) or (height, width, channels) numpy array
+    :param kernel: 2D numpy array
+    :param border: one of BORDER_MODES
+    :return: float32 numpy array
+    """
+    kernel = np.asarray(kernel, dtype=np.float32)[::-1, ::-1]
+    height, width = array.shape[:2]
+    padded = pad_2d(array, kernel.shape, border)
+
+    result = np.zeros(array.shape, dtype=np.float32)
+    scratch = np.empty_like(result)
+    for y, x in zip(*np.nonzero(kernel)):
+        np.multiply(padded[y:y + height, x:x + width], kernel[y, x], out=scratch)
+        result += scratch
+    return result
+
+
+def convolve_separable(array, column, row, border='reflect'):
+    """
+    Convolution with a separable kernel as two 1D passes. Cost grows with the kernel width, not its area.
+    :param array: (height, width) or (height, width, channels) numpy array
+    :param column: 1D kernel applied along the rows axis
+    :param row: 1D kernel applied along the columns axis
+    :param border: one of BORDER_MODES
+    :return: float32 numpy array
+    """
+    result = convolve_axis(array, column, 0, border)
+    return convolve_axis(result, row, 1, border)
+
+
+@functools.lru_cache(maxsize=256)
+def fast_fft_length(length):
+    """
+    The smallest length >= length whose only prime factors are 2, 3 and 5. FFTs of those lengths are fast.
+    :param length: minimum length
+    :return: a 5-smooth length
+    """
+    best = 2 * length
+    power_of_five = 1
+    while power_of_five < best:
+        power_of_three = power_of_five
+        while power_of_three < best:
+            candidate = power_of_three
+            while candidate < length:
+                candidate *= 2
+            best = min(best, candidate)
+            power_of_three *= 3
+        power_of_five *= 5
+    return best
+
+
+def convolve_fft(array, kernel, border='reflect'):
+    """
+    Convolution in the frequency domain. Cost does not depend on the kernel size.
+    :param array: (height, width) or (height, width, channels) numpy array
+    :param kernel: 2D numpy array
+    :param border: one of BORDER_MODES
+    :return: float32 numpy array
+    """
+    kernel = np.asarray(kernel, dtype=np.float32)
+    height, width = array.shape[:2]
+    kernel_height, kernel_width = kernel.shape
+    padded = pad_2d(array, kernel.shape, border).astype(np.float32, copy=False)
+
+    fft_shape = (fast_fft_length(padded.shape[0]), fast_fft_length(padded.shape[1]))
+    kernel_spectrum = np.fft.rfft2(kernel, fft_shape)
+    if padded.ndim == 3:
+        kernel_spectrum = kernel_spectrum[:, :, np.newaxis]
+
+    spectrum = np.fft.rfft2(padded, fft_shape, axes=(0, 1))
+    spectrum *= kernel_spectrum
+    result = np.fft.irfft2(spectrum, fft_shape, axes=(0, 1))
+
+    # the full linear convolution is shifted by the kernel size, the valid part starts there
+    return result[kernel_height - 1:kernel_height - 1 + height,
+                  kernel_width - 1:kernel_width - 1 + width].astype(np.float32)
+
+
+def convolve(array, kernel, border='reflect', method=None):
+    """
+    Convolves an image plane (or a stack of planes) with an arbitrary 2D kernel. \n
+    If no method is given, the cheapest one is picked:
+        - separable kernels are done as two 1D passes
+        - large kernels are done with an FFT
+        - everything else is done directly
+    :param array: (height, width) or (height, width, channels) uint8 or float32 numpy array
+    :param kernel: 2D numpy array
+    :param border: one of BORDER_MODES
+    :param method: 'direct', 'separable', 'fft' or None
+    :return: float32 numpy array
+    """
+    kernel = np.atleast_2d(np.asarray(kernel, dtype=np.float32))
+    vectors = separate_kernel(kernel) if method in (None, 'separable') else None
+
+    if method is None:
+        if vectors is not None:
+            method = 'separable'
+        elif kernel.size > FFT_THRESHOLD:
+            method = 'fft'
+        else:
+            method = 'direct'
+
+    if method == 'separable':
+        if vectors is None:
+            raise ValueError("The kernel is not separable")
+        return convolve_separable(array, vectors[0], vectors[1], border)
+    if method == 'fft':
+        return convolve_fft(array, kernel, border)
+    if method == 'direct':
+        return convolve_direct(array, kernel, border)
+    raise ValueError(f"Unknown convolution method '{method}'")
+
+
+def to_uint8(array, out=None):
+    """
+    Rounds and clips a float array into the valid range [0, 255].
+    :param array: float32 numpy array. It is modified in place
+    :param out: optional uint8 array to write into
+    :return: uint8 numpy array
+    """
+    array += 0.5
+    np.clip(array, 0, 255, out=array)
+    if out is None:
+        return array.astype(np.uint8)
+    np.copyto(out, array, casting='unsafe')
+    return out
+
+
+def convolve_image(argb_array, kernel, border='reflect', method=None, out=None):
+    """
+    Convolves the color channels of an ARGB32 image and keeps the alpha channel untouched.
+    :param argb_array: (height, width, 4) uint8 numpy array
+    :param kernel: 2D numpy array
+    :param border: one of BORDER_MODES
+    :param method: 'direct', 'separable', 'fft' or None
+    :param out: optional uint8 array with the same shape to write into
+    :return: the convolved uint8 numpy array
+    """
+    if out is None:
+        out = np.empty_like(argb_array)
+    color = convolve(argb_array[:, :, COLOR_CHANNELS], kernel, border, method)
+    to_uint8(color, out=out[:, :, COLOR_CHANNELS])
+    out[:, :, ALPHA_CHANNEL] = argb_array[:, :, ALPHA_CHANNEL]
+    return out
@@ -0,0 +1,344 @@
+import threading
+
+import image_operations
+import tile_store
+from orientation import Orientation
+
+
+def _crop(image, scale, top, bottom, right, left):
+    # the crop is given in original image pixels and may reach outside of the image
+    return image_operations.crop(image, max(int(round(top * scale)), 0), max(int(round(bottom * scale)), 0),
+                                 max(int(round(right * scale)), 0), max(int(round(left * scale)), 0))
+
+
+def _blur(image, scale, radius):
+    # the radius is given in original image pixels, a scaled down image needs a proportionally smaller one
+    return image_operations.blur(image, int(round(radius * scale)))
+
+
+def _sharpen(image, scale, strength):
+    return image_operations.sharpen(image, strength)
+
+
+def _brightness_luts(factor=0.0, gamma=1.0):
+    luts = []
+    if factor != 0:
+        luts.append(image_operations.brightness_lut(factor))
+    if gamma != 1.0:
+        luts.append(image_operations.brightness_rev_lut(gamma))
+    return luts
+
+
+def _factor_luts(lut_function):
+    return lambda factor: [lut_function(factor)] if factor != 1.0 else []
+
+
+# The kinds of node that are lookup tables: function(**params) -> list of lookup tables, empty for the identity.
+# Adjacent ones are composed into one table when nothing is cached, see EditGraph.evaluate()
+LUT_OPERATIONS = {
+    'contrast': _factor_luts(image_operations.contrast_lut),
+    'brightness': _brightness_luts,
+    'warmth': _factor_luts(image_operations.warmth_lut),
+    'exposure': _factor_luts(image_operations.exposure_lut),
+}
+
+
+def compose_nodes(nodes):
+    """
+    Composes the lookup tables of nodes of LUT_OPERATIONS into one.
+    :param nodes: EditNode objects of kinds in LUT_OPERATIONS
+    :return: (256, 4) uint8 numpy array, or None if the nodes change nothing
+    """
+    luts = [lut for node in nodes for lut in LUT_OPERATIONS[node.kind](**node.params)]
+    return image_operations.compose_luts(*luts) if luts else None
+
+
+def _apply_luts(image, nodes):
+    lut = compose_nodes(nodes)
+    if lut is None:
+        return image
+    if isinstance(image, tile_store.TileStore):
+        return image_operations.apply_lut_store(image, lut)
+    return image_operations.apply_lut(image, lut)
+
+
+def _lut_operation(kind):
+    return lambda image, scale, **params: _apply_luts(image, (EditNode(kind, kind, params),))
+
+
+def _point_operation(function, identity):
+    def operation(image, scale, factor):
+        if factor == identity:
+            return image
+        return function(image, factor)
+    return operation
+
+
+# Parameters of an adjust node that change nothing, the keyword arguments of image_operations.adjust()
+ADJUST_IDENTITY = {
+    'contrast_factor': 1.0,
+    'brightness_factor': 0.0,
+    'brightness_gamma': 1.0,
+    'warmth_factor': 1.0,
+    'saturation_factor': 1.0,
+    'exposure_factor': 1.0,
+}
+
+
+def _adjust_operation(adjust):
+    # all the adjustments of the adjust panel in one pass, see image_operations.adjust_array()
+    def operation(image, scale, **factors):
+        if all(factors.get(name, identity) == identity for name, identity in ADJUST_IDENTITY.items()):
+            return image
+        return adjust(image, **factors)
+    return operation
+
+
+def _orientation(image, scale, rotation, mirrored):
+    return Orientation(rotation, mirrored).apply(image)
+
+
+def _straighten(image, scale, angle, method='bilinear', expand=True):
+    if angle == 0:
+        return image
+    return image_operations.rotate_by(image, angle, method, expand)
+
+
+# Every kind of node and the function computing it: function(image, scale, **params) -> image,
+# where scale is the size of the image relative to the original.
+OPERATIONS = {
+    'crop': _crop,
+    'rotate': lambda image, scale: image_operations.rotate(image),
+    'mirror_lr': lambda image, scale: image_operations.mirror_lr(image),
+    'mirror_ud': lambda image, scale: image_operations.mirror_ud(image),
+    'orientation': _orientation,
+    'straighten': _straighten,
+    'blur': _blur,
+    'sharpen': _sharpen,
+    'contrast': _lut_operation('contrast'),
+    'brightness': _lut_operation('brightness'),
+    'warmth': _lut_operation('warmth'),
+    'saturation': _point_operation(image_operations.change_saturation, 1.0),
+    'exposure': _lut_operation('exposure'),
+    'adjust': _adjust_operation(image_operations.adjust),
+    'filter': lambda image, scale, preset: image_operations.apply_preset(image, preset),
+}
+
+
+def _store_crop(store, scale, top, bottom, right, left):
+    return image_operations.crop_store(store, max(int(round(top * scale)), 0), max(int(round(bottom * scale)), 0),
+                                       max(int(round(right * scale)), 0), max(int(round(left * scale)), 0))
+
+
+def _store_blur(store, scale, radius):
+    radius = int(round(radius * scale))
+    return image_operations.blur_store(store, radius) if radius >= 1 else store
+
+
+def _store_sharpen(store, scale, strength):
+    return image_operations.sharpen_store(store, strength) if strength != 0 else store
+
+
+def _store_orientation(store, scale, rotation, mirrored):
+    # the 8 orientations are at most two mirrors followed by a quarter turn: a half turn is both mirrors,
+    # an odd rotation is a quarter turn after the even one below it
+    orientation = Orientation(rotation, mirrored)
+    half_turn = orientation.rotation >= 2
+    steps = []
+    if orientation.mirrored != half_turn:
+        steps.append(image_operations.mirror_lr_store)
+    if half_turn:
+        steps.append(image_operations.mirror_ud_store)
+    if orientation.swaps_axes():
+        steps.append(image_operations.rotate_store)
+    result = store
+    for step in steps:
+        image = step(result)
+        # only the last intermediate store is kept
+        if result is not store:
+            result.close()
+        result = image
+    return result
+
+
+def _store_straighten(store, scale, angle, method='bilinear', expand=True):
+    if angle == 0:
+        return store
+    return image_operations.rotate_by_store(store, angle, method, expand)
+
+
+# The same operations on a tile_store.TileStore, for images larger than the memory
+STORE_OPERATIONS = {
+    'crop': _store_crop,
+    'rotate': lambda store, scale: image_operations.rotate_store(store),
+    'mirror_lr': lambda store, scale: image_operations.mirror_lr_store(store),
+    'mirror_ud': lambda store, scale: image_operations.mirror_ud_store(store),
+    'orientation': _store_orientation,
+    'straighten': _store_straighten,
+    'blur': _store_blur,
+    'sharpen': _store_sharpen,
+    'contrast': _lut_operation('contrast'),
+    'brightness': _lut_operation('brightness'),
+    'warmth': _lut_operation('warmth'),
+    'saturation': _point_operation(
+        lambda store, factor: image_operations.adjust_store(store, saturation_factor=factor), 1.0),
+    'exposure': _lut_operation('exposure'),
+    'adjust': _adjust_operation(image_operations.adjust_store),
+    'filter': lambda store, scale, preset: image_operations.apply_preset_store(store, preset),
+}
+
+
+def split_orientation(nodes):
+    """
+    Splits the orientation node at the end of the nodes off, so the rest can be rendered and the orientation
+    shown by a display transform, without moving any pixels.
+    :param nodes: tuple of EditNode objects
+    :return: (the nodes before it, orientation.Orientation object), the identity if the last node is no orientation
+    """
+    if nodes and nodes[-1].kind == 'orientation':
+        return nodes[:-1], Orientation(**nodes[-1].params)
+    return nodes, Orientation()
+
+
+class EditNode:
+    """
+    One operation of the edit graph with its parameters. Nodes are never changed, a new node replaces an old one.
+    """
+
+    def __init__(self, key, kind, params):
+        if kind not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{kind}'")
+        self.key = key
+        self.kind = kind
+        self.params = params
+
+    def apply(self, image, scale):
+        if isinstance(image, tile_store.TileStore):
+            return STORE_OPERATIONS[self.kind](image, scale, **self.params)
+        return OPERATIONS[self.kind](image, scale, **self.params)
+
+    def __eq__(self, other):
+        return isinstance(other, EditNode) and \
+            (self.key, self.kind, self.params) == (other.key, other.kind, other.params)
+
+    def __repr__(self):
+        return f"EditNode({self.key!r}, {self.kind!r}, {self.params!r})"
+
+
+class EditGraph:
+    """
+    The non-destructive list of edits applied to the original image, in order. \n
+    The output of every node is cached per evaluation key (e.g. 'proxy'). Evaluating again reuses the cached outputs
+    up to the first node that changed, so changing one parameter only recomputes that node and the ones after it.
+    """
+
+    def __init__(self):
+        self.nodes = ()
+        self._caches = {}
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def set_node(self, key, kind=None, **params):
+        """
+        Sets the parameters of the node with the given key. A new node is added at the end if there is none yet.
+        :param key: name of the node, e.g. 'saturation'
+        :param kind: the operation, one of OPERATIONS. Defaults to key
+        :param params: parameters of the operation
+        """
+        node = EditNode(key, kind or key, params)
+        nodes = list(self.nodes)
+        for i, existing in enumerate(nodes):
+            if existing.key == key:
+                nodes[i] = node
+                break
+        else:
+            nodes.append(node)
+        self.nodes = tuple(nodes)
+
+    def add_node(self, kind, **params):
+        """
+        Adds a new node at the end, even if there is already one of the same kind, e.g. a second rotation.
+        :param kind: the operation, one of OPERATIONS
+        :param params: parameters of the operation
+        :return: the key of the new node
+        """
+        self._counter += 1
+        key = f"{kind}-{self._counter}"
+        self.nodes = self.nodes + (EditNode(key, kind, params),)
+        return key
+
+    def remove_node(self, key):
+        self.nodes = tuple(node for node in self.nodes if node.key != key)
+
+    def clear(self):
+        self.nodes = ()
+
+    def clear_cache(self):
+        self._caches = {}
+
+    def evaluate(self, source, scale=1.0, cache_key=None, nodes=None, progress=None):
+        """
+        Applies the nodes to a source image.
+        :param source: QImage object, the original or a scaled down copy of it, or a TileStore of the original
+        :param scale: the size of source relative to the original
+        :param cache_key: name of the cache to use, e.g. 'proxy'. None computes everything without caching
+        :param nodes: the nodes to apply, the current ones by default
+        :param progress: optional function(done, total) called after every node that is computed. It may raise
+        to stop the evaluation between two nodes, e.g. a render that is not needed anymore. The nodes computed
+        until then stay cached
+        :return: QImage object
+        """
+        if nodes is None:
+            nodes = self.nodes
+        if cache_key is None:
+            image = source
+            start = 0
+            while start < len(nodes):
+                # a run of lookup table nodes is applied as one composed table, in a single pass over the image.
+                # Cached evaluations keep one pass per node, so changing one of them only recomputes from there
+                end = start
+                while end < len(nodes) and nodes[end].kind in LUT_OPERATIONS:
+                    end += 1
+                if end - start > 1:
+                    result = _apply_luts(image, nodes[start:end])
+                else:
+                    end = start + 1
+                    result = nodes[start].apply(image, scale)
+                # the files of intermediate stores are not needed anymore
+                if isinstance(image, tile_store.TileStore) and image is not source and result is not image:
+                    image.close()
+                image = result
+                start = end
+                if progress is not None:
+                    try:
+                        progress(end, len(nodes))
+                    except Exception:
+                        # the evaluation stops here, so its intermediate store is not needed either
+                        if isinstance(image, tile_store.TileStore) and image is not source:
+                            image.close()
+                        raise
+            return image
+
+        with self._lock:
+            caches = self._caches
+            cached_source, entries = caches.get(cache_key, (None, []))
+            if cached_source is not source:
+                entries = []
+
+            image = source
+            for i, node in enumerate(nodes):
+                if i < len(entries) and entries[i][0] == node:
+                    image = entries[i][1]
+                    continue
+                # this node changed, so everything after it is stale
+                del entries[i:]
+                image = node.apply(image, scale)
+                entries.append((node, image))
+                # kept before progress may stop the evaluation, so the next one starts from here
+                caches[cache_key] = (source, entries)
+                if progress is not None:
+                    progress(i + 1, len(nodes))
+            del entries[len(nodes):]
+
+            caches[cache_key] = (source, entries)
+            return image
@@ -0,0 +1,212 @@
+import logging
+import os
+import tempfile
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtGui import QImageWriter
+
+import image_operations
+import tile_store
+
+logger = logging.getLogger(__name__)
+
+# Default encoder quality of the lossy formats. Other formats use the default of Qt (-1)
+DEFAULT_QUALITY = {'jpg': 92, 'jpeg': 92, 'webp': 90}
+
+# Share of the progress bar the rendering takes, the rest is the encoding
+RENDER_SHARE = 0.8
+
+
+class ExportCancelled(Exception):
+    """
+    Raised inside an export job when it is cancelled, to stop it between two steps.
+    """
+
+
+class ExportOptions:
+    """
+    Where and how an export is encoded.
+    :param file_path: path of the exported file
+    :param file_format: format name known to Qt, e.g. 'jpg'. The extension of file_path by default
+    :param quality: encoder quality from 0 to 100, None for the default of the format
+    :param progressive: write progressive JPEG files
+    :param max_size: (width, height) the image is scaled down to fit in, None for the full resolution
+    """
+
+    def __init__(self, file_path, file_format=None, quality=None, progressive=False, max_size=None):
+        self.file_path = file_path
+        self.file_format = (file_format or os.path.splitext(file_path)[1].lstrip('.') or 'png').lower()
+        self.quality = DEFAULT_QUALITY.get(self.file_format, -1) if quality is None else quality
+        self.progressive = progressive
+        self.max_size = max_size
+
+
+def fit(image, max_size):
+    """
+    Scales a rendered image down to fit in max_size with the Lanczos filter. Smaller images are not enlarged.
+    :param image: QImage object or TileStore
+    :param max_size: (width, height), or None
+    :return: QImage object, or image itself if it already fits
+    """
+    if max_size is None:
+        return image
+    max_width, max_height = max_size
+    if isinstance(image, tile_store.TileStore):
+        if image.width <= max_width and image.height <= max_height:
+            return image
+        return image.scaled(max_width, max_height, 'lanczos')
+    if image.width() <= max_width and image.height() <= max_height:
+        return image
+    return image_operations.scale_to_fit(image, max_width, max_height, 'lanczos')
+
+
+def encode(image, options, progress=None):
+    """
+    Encodes an image into a temporary file next to the destination and moves it into place when it is complete,
+    so a failed or cancelled export never leaves a partial file, nor damages the file it overwrites.
+    :param image: QImage object or TileStore
+    :param options: ExportOptions object
+    :param progress: optional function(fraction) called while a TileStore is written band by band, and before
+    the file is moved into place. It may raise ExportCancelled to drop the file
+    """
+    directory = os.path.dirname(os.path.abspath(options.file_path))
+    handle, temporary_path = tempfile.mkstemp(suffix='.' + options.file_format, dir=directory)
+    os.close(handle)
+    try:
+        if isinstance(image, tile_store.TileStore):
+            if options.file_format in tile_store.STREAMED_FORMATS:
+                if not image.save(temporary_path, options.quality, progress):
+                    raise OSError(f"Could not write {options.file_path}")
+                if progress is not None:
+                    progress(1.0)
+                os.replace(temporary_path, options.file_path)
+                return
+            # the other encoders need the whole image in memory
+            if not image.fits_in_memory():
+                raise OSError(f"The image is too large to be encoded as {options.file_format.upper()} within the "
+                              f"memory limit, export it as "
+                              f"{' or '.join(name.upper() for name in tile_store.STREAMED_FORMATS)}")
+            image = image.to_q_image()
+
+        writer = QImageWriter(temporary_path, options.file_format.encode())
+        writer.setQuality(options.quality)
+        writer.setOptimizedWrite(True)
+        writer.setProgressiveScanWrite(options.progressive)
+        if not writer.write(image):
+            raise OSError(f"Could not write {options.file_path}: {writer.errorString()}")
+        # the writer keeps the file open until it is deleted
+        del writer
+        # the encoder cannot be interrupted, a cancel during it still drops the file
+        if progress is not None:
+            progress(1.0)
+        os.replace(temporary_path, options.file_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+class _ExportJob(QRunnable):
+    """
+    Renders the edits at full resolution and encodes them on a thread of the pool of its Exporter.
+    """
+
+    def __init__(self, exporter, generation, edit_graph, source, nodes, options):
+        super(_ExportJob, self).__init__()
+        self.exporter = exporter
+        self.generation = generation
+        self.edit_graph = edit_graph
+        self.source = source
+        self.nodes = nodes
+        self.options = options
+
+    def report(self, fraction):
+        if self.exporter.is_stale(self.generation):
+            raise ExportCancelled()
+        # The exporter lives in the GUI thread, so this is delivered there through a queued connection
+        self.exporter._job_progress.emit(self.generation, fraction)
+
+    def run(self):
+        try:
+            self.report(0.0)
+            image = self.edit_graph.evaluate(
+                self.source, nodes=self.nodes,
+                progress=lambda done, total: self.report(RENDER_SHARE * done / total))
+            result = fit(image, self.options.max_size)
+            encode(result, self.options, lambda fraction: self.report(RENDER_SHARE + (1 - RENDER_SHARE) * fraction))
+            if isinstance(image, tile_store.TileStore) and image is not self.source:
+                image.close()
+        except ExportCancelled:
+            self.exporter._job_done.emit(self.generation, None)
+            return
+        except Exception as e:
+            logger.exception("Export to %s failed", self.options.file_path)
+            self.exporter._job_done.emit(self.generation, str(e))
+            return
+        self.exporter._job_done.emit(self.generation, '')
+
+
+class Exporter(QObject):
+    """
+    Exports the edits at the full resolution of the original image in the background. \n
+    The image is rendered and encoded on a thread of its own, so the window stays usable and the previews keep
+    rendering on the global pool meanwhile. progress reports the fraction done. cancel() stops the export at the
+    next step and nothing is written. One export runs at a time, a new one cancels the running one.
+    """
+    progress = pyqtSignal(float)
+    finished = pyqtSignal(str)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    _job_progress = pyqtSignal(int, float)
+    _job_done = pyqtSignal(int, object)
+
+    def __init__(self):
+        super(Exporter, self).__init__()
+        self.thread_pool = QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(1)
+        self.generation = 0
+        self.busy = False
+        self.options = None
+        self._job_progress.connect(self._on_job_progress)
+        self._job_done.connect(self._on_job_done)
+
+    def export(self, edit_graph, source, nodes, options):
+        """
+        Starts an export.
+        :param edit_graph: EditGraph object
+        :param source: the original QImage, or its TileStore
+        :param nodes: the nodes to apply, taken when the export is requested so later edits do not change it
+        :param options: ExportOptions object
+        """
+        self.cancel()
+        self.generation += 1
+        self.busy = True
+        self.options = options
+        self.thread_pool.start(_ExportJob(self, self.generation, edit_graph, source, nodes, options))
+
+    def cancel(self):
+        if self.busy:
+            self.generation += 1
+            self.busy = False
+            self.cancelled.emit()
+
+    def is_stale(self, generation):
+        return generation != self.generation
+
+    def wait(self):
+        """
+        Blocks until the running export is done, e.g. before the application quits.
+        """
+        self.thread_pool.waitForDone()
+
+    def _on_job_progress(self, generation, fraction):
+        if not self.is_stale(generation):
+            self.progress.emit(fraction)
+
+    def _on_job_done(self, generation, error):
+        if self.is_stale(generation) or error is None:
+            return
+        self.busy = False
+        if error:
+            self.failed.emit(error)
+        else:
+            self.finished.emit(self.options.file_path)
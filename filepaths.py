@@ -11,6 +11,7 @@ class Filepaths:
     __FILTER_INPUT_DIALOG = 'ui_files/filter_input_dialog.ui'
     __FILTER_FILE = 'Filters.json'
     __CROP_TOOLBAR = 'ui_files/crop_toolbar.ui'
+    __LUT_DIRECTORY = 'luts'
 
     @staticmethod
     def MAIN_WINDOW():
@@ -48,6 +49,10 @@ class Filepaths:
     def CROP_TOOLBAR():
         return os.path.abspath(Filepaths.__CROP_TOOLBAR)
 
+    @staticmethod
+    def LUT_DIRECTORY():
+        return os.path.abspath(Filepaths.__LUT_DIRECTORY)
+
 
 if __name__ == '__main__':
     print(Filepaths.EDIT_TOOLBAR())
@@ -0,0 +1,342 @@
+import threading
+import time
+import zlib
+
+import numpy as np
+
+import image_bridge
+
+# Bytes the compressed snapshots of the history may use before the oldest checkpoints are dropped
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# A full snapshot is stored at least every CHECKPOINT_INTERVAL entries, so restoring one never applies more deltas
+CHECKPOINT_INTERVAL = 10
+
+# Side of the square tiles compared between snapshots
+TILE_SIZE = 128
+
+# Changes of the same edits closer together than this (in seconds) are merged into one undo step, e.g. a slider drag
+COALESCE_SECONDS = 1.0
+
+# zlib level of the snapshots. Low levels are much faster and compress photos almost as well
+COMPRESSION_LEVEL = 1
+
+
+class _Snapshot:
+    """
+    The compressed image of a history entry: either a full checkpoint or the tiles that differ
+    from the image of the previous entry.
+    """
+
+    def __init__(self, shape, checkpoint, data, base=None):
+        self.shape = shape
+        self.checkpoint = checkpoint
+        # checkpoint: compressed bytes of the whole image. delta: list of (row, column, shape, compressed bytes)
+        self.data = data
+        # the snapshot of the previous entry a delta was computed against
+        self.base = base
+        self.size = len(data) if checkpoint else sum(len(tile[3]) for tile in data)
+
+
+def _rebuild(chain):
+    """
+    Rebuilds an image from a checkpoint and the deltas after it.
+    :param chain: list of _Snapshot objects, the checkpoint first
+    :return: (height, width, 4) uint8 numpy array backed by a new QImage
+    """
+    checkpoint = chain[0]
+    height, width, _ = checkpoint.shape
+    q_image, pixels = image_bridge.new_image(width, height)
+    pixels[...] = np.frombuffer(zlib.decompress(checkpoint.data), np.uint8).reshape(checkpoint.shape)
+    for snapshot in chain[1:]:
+        for row, column, shape, data in snapshot.data:
+            pixels[row:row + shape[0], column:column + shape[1]] = \
+                np.frombuffer(zlib.decompress(data), np.uint8).reshape(shape)
+    return pixels
+
+
+def _delta(previous, pixels, base):
+    """
+    Compresses the tiles of pixels that differ from previous. Returns None if most tiles changed,
+    then a checkpoint is smaller and faster to restore.
+    """
+    height, width, _ = pixels.shape
+    tiles = []
+    tile_count = 0
+    for row in range(0, height, TILE_SIZE):
+        for column in range(0, width, TILE_SIZE):
+            tile_count += 1
+            tile = pixels[row:row + TILE_SIZE, column:column + TILE_SIZE]
+            if np.array_equal(tile, previous[row:row + TILE_SIZE, column:column + TILE_SIZE]):
+                continue
+            tiles.append((row, column, tile.shape,
+                          zlib.compress(np.ascontiguousarray(tile), COMPRESSION_LEVEL)))
+    if len(tiles) * 2 > tile_count:
+        return None
+    return _Snapshot(pixels.shape, False, tiles, base)
+
+
+class SnapshotBase:
+    """
+    What the snapshot of an entry is computed against: the snapshots from the last checkpoint up to the entry
+    before it, or nothing when a checkpoint is due. It is taken on the GUI thread by EditHistory.snapshot_base(),
+    and the snapshot is then computed from it in the render worker, see compute_snapshot(). The image of the
+    previous entry is rebuilt once and shared by all the renders of the same entry, e.g. during a slider drag.
+    """
+
+    def __init__(self, chain):
+        self.chain = chain
+        self._pixels = None
+        self._lock = threading.Lock()
+
+    @property
+    def snapshot(self):
+        return self.chain[-1] if self.chain else None
+
+    def pixels(self):
+        """
+        :return: (height, width, 4) uint8 numpy array of the previous entry, or None if a checkpoint is due
+        """
+        with self._lock:
+            if self._pixels is None and self.chain:
+                self._pixels = _rebuild(self.chain)
+            return self._pixels
+
+
+def compute_snapshot(base, q_image):
+    """
+    Compresses a rendered image into a snapshot: the tiles that differ from the image of base, or a checkpoint.
+    It only reads base and the image, so it can run off the GUI thread.
+    :param base: SnapshotBase object
+    :param q_image: QImage object
+    :return: _Snapshot object, to be given to EditHistory.attach_snapshot()
+    """
+    pixels = image_bridge.view(image_bridge.to_working_format(q_image))
+    previous = base.pixels()
+    if previous is not None and previous.shape == pixels.shape:
+        snapshot = _delta(previous, pixels, base.snapshot)
+        if snapshot is not None:
+            return snapshot
+    return _Snapshot(pixels.shape, True, zlib.compress(np.ascontiguousarray(pixels), COMPRESSION_LEVEL))
+
+
+class HistoryEntry:
+    """
+    One undo step: the edit graph nodes after the step, and optionally a snapshot of the rendered image.
+    """
+
+    def __init__(self, nodes, keys):
+        self.nodes = nodes
+        self.keys = keys
+        self.time = time.monotonic()
+        self.snapshot = None
+
+
+def changed_keys(old_nodes, new_nodes):
+    """
+    The keys of the nodes that were added, removed or changed between two edit graph states.
+    :return: frozenset of node keys
+    """
+    old = {node.key: node for node in old_nodes}
+    new = {node.key: node for node in new_nodes}
+    return frozenset(key for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+
+
+class EditHistory:
+    """
+    Undo/redo stack of the edits. \n
+    Every entry stores the edit graph nodes, which are tiny, so any step can be restored by rendering again.
+    To make stepping back instant, the rendered preview is also stored as a compressed snapshot:
+    a full checkpoint every CHECKPOINT_INTERVAL entries (or when the size changes) and only the changed tiles
+    in between. When the snapshots exceed the memory budget, the oldest checkpoints and the deltas
+    depending on them are dropped. Those steps can still be undone, they are just rendered again.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.entries = [HistoryEntry((), frozenset())]
+        self.position = 0
+        self.memory_used = 0
+        # only a record right after another one may be merged into it, never into a step reached by undo or redo
+        self._coalesce = False
+        self._base = SnapshotBase(())
+
+    def clear(self, nodes=()):
+        self.entries = [HistoryEntry(tuple(nodes), frozenset())]
+        self.position = 0
+        self.memory_used = 0
+        self._coalesce = False
+
+    def clear_snapshots(self):
+        """
+        Drops every stored image, e.g. when the preview size changed. The steps themselves are kept.
+        """
+        for entry in self.entries:
+            entry.snapshot = None
+        self.memory_used = 0
+
+    @property
+    def current(self):
+        return self.entries[self.position]
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.entries) - 1
+
+    def record(self, nodes):
+        """
+        Adds the new state of the edit graph after the current entry and drops the redo steps.
+        Repeated changes of the same nodes in quick succession replace the last entry instead.
+        :param nodes: the nodes of the edit graph
+        :return: True if something was recorded
+        """
+        nodes = tuple(nodes)
+        current = self.current
+        if nodes == current.nodes:
+            return False
+        keys = changed_keys(current.nodes, nodes)
+
+        self._drop_redo()
+        coalesce = self._coalesce and self.position > 0 and keys == current.keys and \
+            time.monotonic() - current.time < COALESCE_SECONDS
+        self._coalesce = True
+        if coalesce:
+            self._drop_snapshots_from(self.position)
+            current.nodes = nodes
+            current.time = time.monotonic()
+            return True
+
+        self.entries.append(HistoryEntry(nodes, keys))
+        self.position += 1
+        return True
+
+    def undo(self):
+        """
+        :return: the entry to go back to, or None if there is none
+        """
+        if not self.can_undo():
+            return None
+        self._coalesce = False
+        self.position -= 1
+        return self.current
+
+    def redo(self):
+        """
+        :return: the entry to go forward to, or None if there is none
+        """
+        if not self.can_redo():
+            return None
+        self._coalesce = False
+        self.position += 1
+        return self.current
+
+    def store_image(self, nodes, q_image):
+        """
+        Stores the rendered image of the current entry, if it was rendered for the current nodes.
+        It compresses the image right away, renders use snapshot_base() and attach_snapshot() instead.
+        :param nodes: the nodes the image was rendered for
+        :param q_image: QImage object
+        """
+        self.attach_snapshot(nodes, compute_snapshot(self.snapshot_base(), q_image))
+
+    def snapshot_base(self):
+        """
+        What the snapshot of the current entry is computed against, see compute_snapshot().
+        :return: SnapshotBase object, the same one as long as the previous entries keep their snapshots
+        """
+        chain = self._chain(self.position - 1) if self.position > 0 else None
+        if chain is None or self._entries_since_checkpoint(self.position) >= CHECKPOINT_INTERVAL:
+            chain = ()
+        if tuple(chain) != self._base.chain:
+            self._base = SnapshotBase(tuple(chain))
+        return self._base
+
+    def attach_snapshot(self, nodes, snapshot):
+        """
+        Stores a snapshot computed by compute_snapshot() as the image of the current entry, if it was rendered
+        for the current nodes and the snapshot it depends on is still there.
+        :param nodes: the nodes the image was rendered for
+        :param snapshot: _Snapshot object, or None
+        """
+        entry = self.current
+        if snapshot is None or entry.nodes != tuple(nodes) or entry.snapshot is not None:
+            return
+        if not snapshot.checkpoint and (self.position == 0 or
+                                        self.entries[self.position - 1].snapshot is not snapshot.base):
+            return
+        entry.snapshot = snapshot
+        self.memory_used += snapshot.size
+        self._enforce_budget()
+
+    def image(self, position=None):
+        """
+        Restores the stored image of an entry.
+        :param position: index of the entry, the current one by default
+        :return: QImage object, or None if the entry has no usable snapshot
+        """
+        pixels = self.image_array(self.position if position is None else position)
+        if pixels is None:
+            return None
+        return image_bridge.to_q_image(pixels)
+
+    def image_array(self, position):
+        """
+        Rebuilds the image of an entry from the nearest checkpoint before it and the deltas after that.
+        :return: (height, width, 4) uint8 numpy array backed by a new QImage, or None
+        """
+        chain = self._chain(position)
+        return _rebuild(chain) if chain is not None else None
+
+    def _chain(self, position):
+        """
+        The snapshots the image of an entry is rebuilt from, the checkpoint first.
+        :return: list of _Snapshot objects, or None if one of them is missing
+        """
+        chain = []
+        for i in range(position, -1, -1):
+            snapshot = self.entries[i].snapshot
+            if snapshot is None:
+                return None
+            chain.append(snapshot)
+            if snapshot.checkpoint:
+                return chain[::-1]
+        return None
+
+    def _entries_since_checkpoint(self, position):
+        count = 0
+        for i in range(position - 1, -1, -1):
+            count += 1
+            snapshot = self.entries[i].snapshot
+            if snapshot is None or snapshot.checkpoint:
+                break
+        return count
+
+    def _drop_snapshots_from(self, position):
+        """
+        Drops the snapshot of the entry at position and of the deltas that depend on it.
+        """
+        for i in range(position, len(self.entries)):
+            snapshot = self.entries[i].snapshot
+            if snapshot is None or (i > position and snapshot.checkpoint):
+                break
+            self.memory_used -= snapshot.size
+            self.entries[i].snapshot = None
+
+    def _drop_redo(self):
+        for entry in self.entries[self.position + 1:]:
+            if entry.snapshot is not None:
+                self.memory_used -= entry.snapshot.size
+        del self.entries[self.position + 1:]
+
+    def _enforce_budget(self):
+        """
+        Drops the oldest checkpoints, together with their deltas, until the snapshots fit in the memory budget.
+        The snapshot of the current entry is kept.
+        """
+        for i, entry in enumerate(self.entries):
+            if self.memory_used <= self.memory_budget or i >= self.position:
+                break
+            if entry.snapshot is not None and entry.snapshot.checkpoint:
+                self._drop_snapshots_from(i)
@@ -0,0 +1,109 @@
+import sys
+
+import numpy as np
+from PyQt6.QtGui import QImage
+
+import instrumentation
+
+# Every image_operations function works on this layout: 4 bytes per pixel, in memory (blue, green, red, alpha)
+WORKING_FORMAT = QImage.Format.Format_ARGB32
+
+# Formats that already have the working memory layout and can be used without a conversion
+COMPATIBLE_FORMATS = (QImage.Format.Format_ARGB32, QImage.Format.Format_RGB32)
+
+
+class _QImageBuffer:
+    """
+    Exposes the memory of a QImage to numpy through __array_interface__. \n
+    Arrays made from it keep it as their base, so the QImage stays alive as long as any view of it exists.
+    """
+
+    def __init__(self, q_image, writable):
+        self.q_image = q_image
+        pointer = q_image.bits() if writable else q_image.constBits()
+        self.address = int(pointer)
+        self.__array_interface__ = {
+            'shape': (q_image.height(), q_image.bytesPerLine()),
+            'typestr': '|u1',
+            'data': (self.address, not writable),
+            'version': 3,
+        }
+
+
+def to_working_format(q_image):
+    """
+    Converts a QImage of any format to the working format. Images already in a compatible format are
+    returned as they are, so the conversion only happens once, when the image is loaded.
+    :param q_image: QImage object
+    :return: QImage object in a compatible format
+    """
+    if q_image.format() in COMPATIBLE_FORMATS:
+        return q_image
+    return q_image.convertToFormat(WORKING_FORMAT)
+
+
+def view(q_image, writable=False):
+    """
+    Returns the pixels of a QImage as a numpy array without copying them. \n
+    Row padding (bytesPerLine) is honored through the row stride. A writable view detaches the QImage
+    from other QImages sharing its data first, so writing to it only changes this image.
+    :param q_image: QImage object in a compatible format, see to_working_format()
+    :param writable: whether the returned array may be written to
+    :return: (height, width, 4) uint8 numpy array backed by the QImage memory
+    """
+    if q_image.format() not in COMPATIBLE_FORMATS:
+        raise ValueError(f"Expected a 32-bit image, got {q_image.format()}. Use to_working_format() first")
+    rows = np.asarray(_QImageBuffer(q_image, writable))
+    return rows[:, :q_image.width() * 4].reshape(q_image.height(), q_image.width(), 4)
+
+
+def new_image(width, height):
+    """
+    Allocates a QImage in the working format together with a writable numpy view of it.
+    Operations write their result straight into the view, so no copy is needed to get a QImage back.
+    :param width: width of the image
+    :param height: height of the image
+    :return: (QImage object, (height, width, 4) uint8 numpy array)
+    """
+    q_image = QImage(width, height, WORKING_FORMAT)
+    return q_image, view(q_image, writable=True)
+
+
+def _owner(numpy_array):
+    """
+    Finds the QImage a numpy array is a view of.
+    :param numpy_array: numpy array
+    :return: the _QImageBuffer the array is a view of, or None
+    """
+    base = numpy_array
+    while base is not None:
+        if isinstance(base, _QImageBuffer):
+            return base
+        base = getattr(base, 'base', None)
+    return None
+
+
+def to_q_image(numpy_array):
+    """
+    Returns a QImage with the pixels of a (height, width, 4) uint8 numpy array. \n
+    If the array is a full view of a QImage (made by view() or new_image()), that QImage is returned
+    without copying. Otherwise the pixels are copied once into a new QImage.
+    :param numpy_array: (height, width, 4) uint8 numpy array in the working memory layout
+    :return: QImage object
+    """
+    height, width, _ = numpy_array.shape
+    owner = _owner(numpy_array)
+    if owner is not None:
+        q_image = owner.q_image
+        if numpy_array.__array_interface__['data'][0] == owner.address and \
+                numpy_array.shape == (q_image.height(), q_image.width(), 4) and \
+                numpy_array.strides == (q_image.bytesPerLine(), 4, 1):
+            return q_image
+
+    q_image, pixels = new_image(width, height)
+    pixels[...] = numpy_array
+    return q_image
+
+
+# every call of the functions above is timed while instrumentation is enabled
+instrumentation.instrument_module(sys.modules[__name__])
@@ -0,0 +1,92 @@
+import collections
+import logging
+import os
+import threading
+
+from PyQt6.QtGui import QImage
+
+import image_bridge
+
+logger = logging.getLogger(__name__)
+
+# Bytes of decoded images kept in memory before the least recently used ones are dropped
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+
+
+class ImageCache:
+    """
+    Keeps decoded images in memory, so opening or reverting a recently used file does not decode it again. \n
+    Images are stored in the working format and keyed by the path and the modification time of the file,
+    so a file changed on disk is decoded again. When the images exceed the memory budget,
+    the least recently used ones are dropped. An image larger than the budget is never cached.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(file_path):
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size
+
+    def load(self, file_path):
+        """
+        Returns the decoded image of a file, from the cache if it did not change since it was decoded.
+        The returned QImage is shared with the cache, operations must not write into it.
+        :param file_path: path of the image file
+        :return: QImage object in the working format, a null QImage if the file cannot be decoded
+        """
+        try:
+            key = self._key(file_path)
+        except OSError as e:
+            logger.warning("Could not read %s: %s", file_path, e)
+            return QImage()
+
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        image = QImage(file_path)
+        if image.isNull():
+            return image
+        image = image_bridge.to_working_format(image)
+        self._store(key, image)
+        return image
+
+    def _store(self, key, image):
+        size = image.sizeInBytes()
+        if size > self.memory_budget:
+            return
+        with self._lock:
+            # an older version of the same file is not needed anymore
+            for old_key in [old_key for old_key in self._images if old_key[0] == key[0]]:
+                self.memory_used -= self._images.pop(old_key).sizeInBytes()
+            self._images[key] = image
+            self.memory_used += size
+            while self.memory_used > self.memory_budget:
+                _, dropped = self._images.popitem(last=False)
+                self.memory_used -= dropped.sizeInBytes()
+
+    def discard(self, file_path):
+        """
+        Drops the cached image of a file, e.g. after it was overwritten.
+        :param file_path: path of the image file
+        """
+        path = os.path.abspath(file_path)
+        with self._lock:
+            for key in [key for key in self._images if key[0] == path]:
+                self.memory_used -= self._images.pop(key).sizeInBytes()
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.memory_used = 0
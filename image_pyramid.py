@@ -0,0 +1,126 @@
+import collections
+import math
+
+import numpy as np
+from PyQt6.QtGui import QPixmap
+
+import image_bridge
+import tile_store
+
+# Side of the square tiles the levels are drawn in
+TILE_SIZE = 256
+
+# Tiles kept as QPixmaps, about 64 MB. A canvas needs a few dozen of them per frame
+MAX_CACHED_TILES = 256
+
+# Levels larger than this many bytes are built in a TileStore when the source is one
+MAX_LEVEL_BYTES = 256 * 1024 * 1024
+
+
+def downsample(source, out=None):
+    """
+    Halves the size of an image by averaging blocks of 2x2 pixels. An odd last row or column is averaged
+    with itself, so it is kept.
+    :param source: (height, width, 4) uint8 numpy array
+    :param out: optional ((height + 1) // 2, (width + 1) // 2, 4) uint8 array to write into
+    :return: uint8 numpy array
+    """
+    height, width, _ = source.shape
+    if out is None:
+        out = np.empty(((height + 1) // 2, (width + 1) // 2, 4), dtype=np.uint8)
+    rows = (source[0::2], source[1::2])
+    total = np.zeros(out.shape, dtype=np.uint16)
+    for row in rows:
+        total[:row.shape[0]] += row[:, 0::2]
+        total[:row.shape[0], :(width // 2)] += row[:, 1::2]
+    if height % 2:
+        total[-1] += rows[0][-1, 0::2]
+        total[-1, :(width // 2)] += rows[0][-1, 1::2]
+    if width % 2:
+        total[:, -1] *= 2
+    total += 2
+    np.floor_divide(total, 4, out=total)
+    out[...] = total
+    return out
+
+
+class ImagePyramid:
+    """
+    A mipmap pyramid of an image: level 0 is the image itself and every next level has half its size,
+    down to a single tile. \n
+    A canvas draws from the smallest level that still has at least the resolution it displays, and only
+    the tiles that are visible, so drawing costs the same at any zoom, whatever the size of the image.
+    The levels are built once. Tiles are converted to QPixmaps when they are first drawn and cached.
+    The source can be a QImage or a tile_store.TileStore, then the large levels stay on disk too.
+    """
+
+    def __init__(self, source):
+        if isinstance(source, tile_store.TileStore):
+            self.width, self.height = source.width, source.height
+            levels = [source.array]
+        else:
+            self._source = image_bridge.to_working_format(source)
+            self.width, self.height = self._source.width(), self._source.height()
+            levels = [image_bridge.view(self._source)]
+        # keeps the stores of the levels alive
+        self._stores = [source] if isinstance(source, tile_store.TileStore) else []
+
+        while max(levels[-1].shape[0], levels[-1].shape[1]) > TILE_SIZE:
+            previous = levels[-1]
+            height, width = (previous.shape[0] + 1) // 2, (previous.shape[1] + 1) // 2
+            if self._stores and height * width * 4 > MAX_LEVEL_BYTES:
+                store = self._stores[-1].empty_like(width, height)
+                self._stores.append(store)
+                for top, bottom in store.bands():
+                    downsample(previous[2 * top:2 * bottom], store.array[top:bottom])
+                    store.release(top, bottom)
+                    self._stores[-2].release(2 * top, 2 * bottom)
+                levels.append(store.array)
+            else:
+                levels.append(downsample(previous))
+        self.levels = levels
+        self._tiles = collections.OrderedDict()
+
+    def level_count(self):
+        return len(self.levels)
+
+    def level_for_scale(self, scale):
+        """
+        The smallest level with at least the resolution of the display.
+        :param scale: displayed size relative to level 0, e.g. 0.25 when zoomed out to 25%
+        :return: index of the level
+        """
+        if scale <= 0:
+            return len(self.levels) - 1
+        level = int(math.floor(math.log2(1 / scale))) if scale < 1 else 0
+        return min(max(level, 0), len(self.levels) - 1)
+
+    def tile_range(self, level, left, top, right, bottom):
+        """
+        The tiles of a level that cover a rectangle given in level 0 pixels.
+        :return: (first column, first row, last column, last row), inclusive
+        """
+        size = TILE_SIZE << level
+        height, width = self.levels[level].shape[:2]
+        columns = (width + TILE_SIZE - 1) // TILE_SIZE
+        rows = (height + TILE_SIZE - 1) // TILE_SIZE
+        return (max(int(left // size), 0), max(int(top // size), 0),
+                min(int(right // size), columns - 1), min(int(bottom // size), rows - 1))
+
+    def tile(self, level, column, row):
+        """
+        A tile of a level as a QPixmap. Recently used tiles are cached.
+        :return: QPixmap object of at most TILE_SIZE x TILE_SIZE pixels
+        """
+        key = (level, column, row)
+        pixmap = self._tiles.get(key)
+        if pixmap is not None:
+            self._tiles.move_to_end(key)
+            return pixmap
+        top, left = row * TILE_SIZE, column * TILE_SIZE
+        pixels = self.levels[level][top:top + TILE_SIZE, left:left + TILE_SIZE]
+        pixmap = QPixmap.fromImage(image_bridge.to_q_image(np.ascontiguousarray(pixels)))
+        self._tiles[key] = pixmap
+        if len(self._tiles) > MAX_CACHED_TILES:
+            self._tiles.popitem(last=False)
+        return pixmap
@@ -0,0 +1,108 @@
+import sys
+
+import numpy as np
+
+import color_space
+import image_bridge
+import instrumentation
+
+# Pixels sampled at most. Larger images are sampled on a regular grid, which keeps the shape of the histograms
+DEFAULT_MAX_SAMPLES = 1 << 18
+
+# The channels in memory order, see image_bridge.WORKING_FORMAT
+CHANNELS = ('blue', 'green', 'red', 'alpha')
+
+# Every channel counts into its own 256 bins of one bincount
+_CHANNEL_OFFSETS = np.arange(len(CHANNELS), dtype=np.uint16) * 256
+
+# color_space.LUMA_WEIGHTS in 1/256, so the luminance is computed in integers. They add up to 256
+_LUMA_WEIGHTS = tuple(int(round(weight * 256)) for weight in color_space.LUMA_WEIGHTS)
+
+
+class ImageStatistics:
+    """
+    The histograms of an image: one per channel and one of the Rec. 601 luminance, 256 bins each. \n
+    They may be computed on a sample of the pixels, samples is the number of pixels counted.
+    """
+
+    def __init__(self, histograms, samples):
+        # name -> (256,) int64 numpy array, for 'red', 'green', 'blue', 'alpha' and 'luminance'
+        self.histograms = histograms
+        self.samples = samples
+
+    def mean(self, channel='luminance'):
+        if not self.samples:
+            return 0.0
+        return float(np.dot(self.histograms[channel], np.arange(256))) / self.samples
+
+    def percentile(self, fraction, channel='luminance'):
+        """
+        The smallest value at least fraction of the pixels are darker or equal to.
+        :param fraction: from 0 to 1
+        :return: int from 0 to 255
+        """
+        cumulative = np.cumsum(self.histograms[channel])
+        return int(np.searchsorted(cumulative, fraction * self.samples))
+
+    def clipped(self, channel='luminance'):
+        """
+        The fractions of pixels at the ends of the range, e.g. blown out highlights.
+        :return: (fraction at 0, fraction at 255)
+        """
+        if not self.samples:
+            return 0.0, 0.0
+        histogram = self.histograms[channel]
+        return float(histogram[0]) / self.samples, float(histogram[255]) / self.samples
+
+
+def sample_step(width, height, max_samples=DEFAULT_MAX_SAMPLES):
+    """
+    The spacing of the sampling grid, in pixels, so that at most max_samples pixels are sampled.
+    :return: int, 1 when every pixel is used
+    """
+    if not max_samples or width * height <= max_samples:
+        return 1
+    return int(np.ceil(np.sqrt(width * height / max_samples)))
+
+
+def compute_array(argb_array, max_samples=DEFAULT_MAX_SAMPLES):
+    """
+    Computes the histograms of a (height, width, 4) uint8 numpy array in the working memory layout. \n
+    The four channels are counted with a single bincount, the luminance with another one.
+    :param argb_array: (height, width, 4) uint8 numpy array
+    :param max_samples: the number of pixels sampled at most, None or 0 counts every pixel
+    :return: ImageStatistics object
+    """
+    height, width = argb_array.shape[:2]
+    step = sample_step(width, height, max_samples)
+    sample = argb_array[::step, ::step]
+    samples = sample.shape[0] * sample.shape[1]
+
+    counts = np.bincount((sample + _CHANNEL_OFFSETS).reshape(-1), minlength=256 * len(CHANNELS))
+    histograms = {name: counts[i * 256:(i + 1) * 256] for i, name in enumerate(CHANNELS)}
+
+    red_weight, green_weight, blue_weight = _LUMA_WEIGHTS
+    luminance = np.multiply(sample[..., 2], red_weight, dtype=np.uint16)
+    luminance += np.multiply(sample[..., 1], green_weight, dtype=np.uint16)
+    luminance += np.multiply(sample[..., 0], blue_weight, dtype=np.uint16)
+    luminance += 128
+    luminance >>= 8
+    histograms['luminance'] = np.bincount(luminance.reshape(-1), minlength=256)[:256]
+    return ImageStatistics(histograms, samples)
+
+
+def compute(q_image, max_samples=DEFAULT_MAX_SAMPLES):
+    """
+    Computes the histograms of an image (PyQt6 QImage object), see compute_array().
+    :param q_image: QImage object
+    :param max_samples: the number of pixels sampled at most, None or 0 counts every pixel
+    :return: ImageStatistics object, with no samples for a null image
+    """
+    if q_image.isNull():
+        empty = np.zeros(256, dtype=np.int64)
+        return ImageStatistics({name: empty for name in CHANNELS + ('luminance',)}, 0)
+    return compute_array(image_bridge.view(image_bridge.to_working_format(q_image)), max_samples)
+
+
+# every call of the functions above is timed while instrumentation is enabled
+instrumentation.instrument_module(sys.modules[__name__])
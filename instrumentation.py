@@ -0,0 +1,229 @@
+import bisect
+import functools
+import inspect
+import json
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from PyQt6.QtGui import QImage
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets in milliseconds, the last bucket holds everything slower
+BUCKET_BOUNDS_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# Environment variable that enables the instrumentation at start-up. Its value is the file dumped at exit
+PROFILE_VARIABLE = 'PHOTO_WIZARD_PROFILE'
+
+
+def megapixels(image):
+    """
+    The size of an image argument in megapixels, None for anything that is not an image.
+    :param image: QImage object, (height, width, ...) numpy array or TileStore
+    """
+    if isinstance(image, QImage):
+        return image.width() * image.height() / 1e6
+    if isinstance(image, np.ndarray) and image.ndim >= 2:
+        return image.shape[0] * image.shape[1] / 1e6
+    if hasattr(image, 'width') and hasattr(image, 'height') and isinstance(image.width, int):
+        return image.width * image.height / 1e6
+    return None
+
+
+def size_class(image_megapixels):
+    """
+    The size class latencies are grouped by: the power of two megapixels the image fits in.
+    :param image_megapixels: size in megapixels, or None
+    :return: label, e.g. '<= 4 MP', or '-' without an image
+    """
+    if image_megapixels is None:
+        return '-'
+    bound = 2.0 ** math.ceil(math.log2(max(image_megapixels, 1 / 64)))
+    return f"<= {bound:g} MP"
+
+
+class Histogram:
+    """
+    Latencies of one operation on one size class, counted in BUCKET_BOUNDS_MS buckets.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.last = 0.0
+
+    def add(self, milliseconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.maximum = max(self.maximum, milliseconds)
+        self.last = milliseconds
+
+    def percentile(self, fraction):
+        """
+        The upper bound of the bucket the percentile falls in, the maximum for the last bucket.
+        """
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        bounds = [str(bound) for bound in BUCKET_BOUNDS_MS] + ['inf']
+        return {"count": self.count, "total_ms": self.total, "mean_ms": self.total / max(self.count, 1),
+                "max_ms": self.maximum, "p50_ms": self.percentile(0.5), "p95_ms": self.percentile(0.95),
+                "buckets_ms": {bound: count for bound, count in zip(bounds, self.counts) if count}}
+
+
+class Recorder:
+    """
+    Collects latency histograms per operation and image size class. \n
+    Recording costs nothing while it is disabled, so the timers can stay in the code. Threads record concurrently,
+    nested timers are recorded each with their own time.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.last = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, image_megapixels=None):
+        """
+        Adds one latency.
+        :param name: name of the operation
+        :param seconds: duration
+        :param image_megapixels: size of the image it worked on, if any
+        """
+        if not self.enabled:
+            return
+        milliseconds = seconds * 1e3
+        key = (name, size_class(image_megapixels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.add(milliseconds)
+            self.last[name] = milliseconds
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.last = {}
+
+    def to_dict(self):
+        with self._lock:
+            return {f"{name} [{size}]": histogram.to_dict()
+                    for (name, size), histogram in sorted(self.histograms.items())}
+
+    def report(self):
+        """
+        The histograms as a text table, the slowest operations in total first.
+        :return: str
+        """
+        with self._lock:
+            items = sorted(self.histograms.items(), key=lambda item: -item[1].total)
+            lines = [f"{'operation':<40} {'size':<12} {'count':>7} {'total ms':>10} {'mean ms':>9} "
+                     f"{'p50 ms':>8} {'p95 ms':>8} {'max ms':>9}"]
+            for (name, size), histogram in items:
+                lines.append(f"{name:<40} {size:<12} {histogram.count:>7} {histogram.total:>10.1f} "
+                             f"{histogram.total / histogram.count:>9.2f} {histogram.percentile(0.5):>8.2f} "
+                             f"{histogram.percentile(0.95):>8.2f} {histogram.maximum:>9.2f}")
+        return '\n'.join(lines)
+
+    def dump(self, file_path):
+        """
+        Writes the histograms to a file, as JSON if its name ends with .json, otherwise as a text table.
+        :param file_path: path of the file
+        """
+        try:
+            with open(file_path, 'w') as dump_file:
+                if file_path.lower().endswith('.json'):
+                    json.dump(self.to_dict(), dump_file, indent=4)
+                else:
+                    dump_file.write(self.report() + '\n')
+        except OSError as e:
+            logger.error("Could not write the latency profile to %s: %s", file_path, e)
+
+
+recorder = Recorder()
+
+
+class timer:
+    """
+    Times a block into the recorder:
+    with instrumentation.timer('update_canvas', image): ...
+    """
+
+    def __init__(self, name, image=None):
+        self.name = name
+        self.image = image
+        self.start = None
+
+    def __enter__(self):
+        if recorder.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            recorder.record(self.name, time.perf_counter() - self.start, megapixels(self.image))
+
+
+def timed(function, name=None):
+    """
+    Wraps a function so that every call is timed into the recorder, grouped by the size of its first image argument.
+    :param function: the function to wrap
+    :param name: name it is recorded as, module.function by default
+    :return: the wrapped function
+    """
+    name = name or f"{function.__module__}.{function.__qualname__}"
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not recorder.enabled:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            image_megapixels = None
+            for argument in args:
+                image_megapixels = megapixels(argument)
+                if image_megapixels is not None:
+                    break
+            recorder.record(name, time.perf_counter() - start, image_megapixels)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
+def instrument_module(module):
+    """
+    Replaces every public function of a module by a timed() wrapper. It is called at the end of the module itself,
+    so other modules that keep references to its functions get the wrappers too.
+    :param module: the module
+    """
+    for name, function in list(vars(module).items()):
+        if name.startswith('_') or not inspect.isfunction(function) or function.__module__ != module.__name__:
+            continue
+        if not getattr(function, '__instrumented__', False):
+            setattr(module, name, timed(function))
+
+
+def enable():
+    """
+    Starts recording. The image operations and the QImage/numpy conversions are timed from now on.
+    """
+    recorder.enabled = True
+
+
+def disable():
+    recorder.enabled = False
@@ -1,7 +1,11 @@
+import logging
+import os
 import sys
 from widgets import main_window
 from PyQt6.QtWidgets import QApplication
 
+import instrumentation
+
 
 def add_stylesheet_to_app(app):
     try:
@@ -12,8 +16,14 @@ def add_stylesheet_to_app(app):
 
 
 def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
     app = QApplication(sys.argv)
     add_stylesheet_to_app(app)
+    # PHOTO_WIZARD_PROFILE=latency.json records the latencies of the whole session and writes them at exit
+    profile_path = os.environ.get(instrumentation.PROFILE_VARIABLE)
+    if profile_path:
+        instrumentation.enable()
+        app.aboutToQuit.connect(lambda: instrumentation.recorder.dump(profile_path))
     _main_window = main_window.UI_MainWindow()
     _main_window.show()
     app.exec()
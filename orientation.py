@@ -0,0 +1,97 @@
+import numpy as np
+from PyQt6.QtGui import QTransform
+
+import image_bridge
+
+
+class Orientation:
+    """
+    A composition of 90 degree rotations and mirrors, one of the 8 orientations of an image. \n
+    It is stored as an optional left-right mirror followed by a number of 90 degree counter-clockwise rotations,
+    so any sequence of rotate and mirror clicks composes into one Orientation, and the pixels are moved once
+    when it is applied, however many clicks it stands for.
+    """
+
+    def __init__(self, rotation=0, mirrored=False):
+        self.rotation = rotation % 4
+        self.mirrored = bool(mirrored)
+
+    def is_identity(self):
+        return self.rotation == 0 and not self.mirrored
+
+    def swaps_axes(self):
+        return self.rotation % 2 == 1
+
+    def rotated(self):
+        """
+        This orientation followed by a rotation by 90 degrees counter-clockwise.
+        """
+        return Orientation(self.rotation + 1, self.mirrored)
+
+    def mirrored_lr(self):
+        """
+        This orientation followed by a left-right mirror. Mirroring after k rotations equals mirroring first
+        and rotating -k times.
+        """
+        return Orientation(-self.rotation, not self.mirrored)
+
+    def mirrored_ud(self):
+        """
+        This orientation followed by an upside-down mirror, a left-right mirror and a half turn.
+        """
+        return Orientation(-self.rotation + 2, not self.mirrored)
+
+    def then(self, kind):
+        """
+        This orientation followed by one of the edits 'rotate', 'mirror_lr' or 'mirror_ud'.
+        """
+        return {'rotate': self.rotated, 'mirror_lr': self.mirrored_lr, 'mirror_ud': self.mirrored_ud}[kind]()
+
+    def size(self, width, height):
+        """
+        The size of an image of width x height in this orientation.
+        :return: (width, height)
+        """
+        return (height, width) if self.swaps_axes() else (width, height)
+
+    def apply_array(self, array):
+        """
+        The pixels in this orientation, as a view of array without copying.
+        :param array: (height, width, ...) numpy array
+        :return: numpy array view
+        """
+        if self.mirrored:
+            array = array[:, ::-1]
+        return np.rot90(array, self.rotation, axes=(0, 1))
+
+    def apply(self, q_image):
+        """
+        Applies the orientation to an image (PyQt6 QImage object) with a single copy of the pixels.
+        :param q_image: QImage object
+        :return: the oriented copy, or q_image itself for the identity
+        """
+        if self.is_identity():
+            return q_image
+        return image_bridge.to_q_image(self.apply_array(image_bridge.view(image_bridge.to_working_format(q_image))))
+
+    def q_transform(self, width, height):
+        """
+        The transform that displays an image of width x height in this orientation, with its top left corner
+        at the origin, e.g. for a QGraphicsPixmapItem.
+        :return: QTransform object
+        """
+        transform = QTransform()
+        if self.mirrored:
+            transform = transform * QTransform(-1, 0, 0, 1, width, 0)
+        for _ in range(self.rotation):
+            # after each step the image is (height, width) sized, a counter-clockwise quarter turn in y-down
+            # coordinates maps (x, y) to (y, width - x)
+            transform = transform * QTransform(0, -1, 1, 0, 0, width)
+            width, height = height, width
+        return transform
+
+    def __eq__(self, other):
+        return isinstance(other, Orientation) and (self.rotation, self.mirrored) == (other.rotation, other.mirrored)
+
+    def __repr__(self):
+        return f"Orientation({self.rotation}, {self.mirrored})"
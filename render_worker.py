@@ -0,0 +1,96 @@
+import logging
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+
+class RenderCancelled(Exception):
+    """
+    Raised inside a render when a newer request made it stale, to stop it between two steps.
+    """
+
+
+class _RenderJob(QRunnable):
+    """
+    Runs one render function on a thread of the pool and reports the result back to its RenderWorker.
+    """
+
+    def __init__(self, worker, generation, function):
+        super(_RenderJob, self).__init__()
+        self.worker = worker
+        self.generation = generation
+        self.function = function
+
+    def check(self, *args):
+        """
+        Raises RenderCancelled once the render is stale. It takes any arguments, so it can be given as the progress
+        function of EditGraph.evaluate().
+        """
+        if self.worker.is_stale(self.generation):
+            raise RenderCancelled()
+
+    def run(self):
+        result = None
+        try:
+            self.check()
+            result = self.function(self.check)
+        except RenderCancelled:
+            result = None
+        except Exception:
+            logger.exception("Render failed")
+        # The worker lives in the GUI thread, so this is delivered there through a queued connection
+        self.worker._job_done.emit(self.generation, result)
+
+
+class RenderWorker(QObject):
+    """
+    Runs image operations off the GUI thread, latest request wins. \n
+    Only one render is in flight at a time. Requests made while it runs replace each other, so dragging a slider
+    renders the newest parameters only. When a newer request or cancel() comes in, the in-flight render
+    becomes stale: it stops at its next check, and whatever it returns is dropped instead of being shown.
+    """
+    rendered = pyqtSignal(object)
+    _job_done = pyqtSignal(int, object)
+
+    def __init__(self, thread_pool=None):
+        super(RenderWorker, self).__init__()
+        self.thread_pool = thread_pool if thread_pool is not None else QThreadPool.globalInstance()
+        self.generation = 0
+        self.busy = False
+        self.pending = None
+        self._job_done.connect(self._on_job_done)
+
+    def submit(self, function):
+        """
+        Requests a render. The result is emitted through the rendered signal, unless a newer request comes first.
+        :param function: function(check) returning the rendered image. check() raises RenderCancelled once a newer
+        request came in, the render calls it between its steps, e.g. as the progress of EditGraph.evaluate()
+        """
+        self.generation += 1
+        self.pending = (self.generation, function)
+        if not self.busy:
+            self._start_pending()
+
+    def cancel(self):
+        """
+        Drops the pending request and makes the in-flight render stale.
+        """
+        self.generation += 1
+        self.pending = None
+
+    def is_stale(self, generation):
+        return generation != self.generation
+
+    def _start_pending(self):
+        generation, function = self.pending
+        self.pending = None
+        self.busy = True
+        self.thread_pool.start(_RenderJob(self, generation, function))
+
+    def _on_job_done(self, generation, result):
+        self.busy = False
+        if not self.is_stale(generation) and result is not None:
+            self.rendered.emit(result)
+        if self.pending is not None:
+            self._start_pending()
@@ -0,0 +1,200 @@
+import functools
+import math
+
+import numpy as np
+
+import tiling
+
+# Lanczos lobes, 3 is sharp without much ringing
+LANCZOS_LOBES = 3
+
+# Larger reductions are first averaged over blocks of whole pixels until the image is at most this many times
+# the target size, the filter only runs on the rest. The result is almost the same, at a fraction of the cost
+REDUCING_GAP = 2.0
+
+# Weight tables kept, a few per canvas size, thumbnail size and export size
+WEIGHT_CACHE_SIZE = 64
+
+# Output rows computed with one matrix product
+BAND_ROWS = 64
+
+
+def _triangle(x):
+    return np.maximum(1 - np.abs(x), 0)
+
+
+def _lanczos(x):
+    x = np.abs(x)
+    return np.where(x < LANCZOS_LOBES, np.sinc(x) * np.sinc(x / LANCZOS_LOBES), 0)
+
+
+# The filters and their support in pixels of the larger of the two images. 'area' is computed exactly
+# from the overlap of the pixels, see weight_table()
+FILTERS = {
+    'area': (None, 0.5),
+    'bilinear': (_triangle, 1.0),
+    'lanczos': (_lanczos, float(LANCZOS_LOBES)),
+}
+
+
+@functools.lru_cache(maxsize=WEIGHT_CACHE_SIZE)
+def weight_table(source_size, target_size, filter_name='lanczos', extent=None):
+    """
+    The taps of a 1D resampling, computed once per sizes and filter and then cached. \n
+    Output pixel i covers the source from i * scale to (i + 1) * scale, with scale = extent / target_size.
+    When downscaling the filter is stretched by the scale, so every source pixel contributes (no aliasing).
+    Taps outside of the source get no weight and the others are normalized to sum to 1.
+    :param source_size: number of source pixels
+    :param target_size: number of output pixels
+    :param filter_name: one of FILTERS
+    :param extent: the length of the source the output covers, in source pixels. source_size by default
+    :return: (indices, weights): read-only (target_size, taps) intp and float32 numpy arrays
+    """
+    if filter_name not in FILTERS:
+        raise ValueError(f"Unknown filter '{filter_name}', expected one of {tuple(FILTERS)}")
+    kernel, support = FILTERS[filter_name]
+    scale = (extent or source_size) / target_size
+    filter_scale = max(scale, 1.0)
+    radius = support * filter_scale
+    centres = (np.arange(target_size) + 0.5) * scale
+    first = np.floor(centres - radius).astype(np.intp)
+    taps = int(math.ceil(2 * radius)) + 1
+    positions = first[:, np.newaxis] + np.arange(taps)
+
+    if kernel is None:
+        # the part of every source pixel inside the footprint of the output pixel
+        low, high = centres - scale / 2, centres + scale / 2
+        weights = np.minimum(positions + 1, high[:, np.newaxis]) - np.maximum(positions, low[:, np.newaxis])
+        weights = np.maximum(weights, 0)
+    else:
+        weights = kernel((positions + 0.5 - centres[:, np.newaxis]) / filter_scale)
+    weights[(positions < 0) | (positions >= source_size)] = 0
+    totals = weights.sum(axis=1, keepdims=True)
+    weights = weights / np.where(totals == 0, 1, totals)
+
+    indices = np.clip(positions, 0, source_size - 1)
+    weights = weights.astype(np.float32)
+    indices.setflags(write=False)
+    weights.setflags(write=False)
+    return indices, weights
+
+
+@functools.lru_cache(maxsize=WEIGHT_CACHE_SIZE)
+def band_matrices(source_size, target_size, filter_name='lanczos', extent=None):
+    """
+    The weight table of weight_table() as dense matrices, one per band of BAND_ROWS output pixels,
+    so a band is filtered with one matrix product. Cached like the weight table.
+    :return: list of (top, bottom, first source pixel, end source pixel, (bottom - top, end - first) float32 matrix)
+    """
+    indices, weights = weight_table(source_size, target_size, filter_name, extent)
+    bands = []
+    for top, bottom in tiling.tile_bounds(target_size, BAND_ROWS):
+        band_indices = indices[top:bottom]
+        first, end = int(band_indices.min()), int(band_indices.max()) + 1
+        matrix = np.zeros((bottom - top, end - first), dtype=np.float32)
+        # the taps clamped to the edge fall on the same pixel, their (zero) weights add up
+        np.add.at(matrix, (np.arange(bottom - top)[:, np.newaxis], band_indices - first), weights[top:bottom])
+        matrix.setflags(write=False)
+        bands.append((top, bottom, first, end, matrix))
+    return bands
+
+
+def reduction_factor(source_size, target_size):
+    """
+    The factor of the block average done before the filter, see REDUCING_GAP.
+    :return: int, 1 for no reduction
+    """
+    return max(int(source_size / (target_size * REDUCING_GAP)), 1)
+
+
+def box_reduce(source, factor_x, factor_y, workers=None):
+    """
+    Averages blocks of factor_x x factor_y pixels. The rows and columns that do not fill a whole block are dropped.
+    Every source pixel is read once, in bands of rows that stay in the CPU cache, on the thread pool of tiling.
+    :param source: (height, width, 4) uint8 numpy array
+    :return: (height // factor_y, width // factor_x, 4) uint8 numpy array
+    """
+    height, width = source.shape[0] // factor_y, source.shape[1] // factor_x
+    out = np.empty((height, width, 4), dtype=np.uint8)
+    # 16 bits hold the sum of 256 bytes
+    total_type = np.uint16 if factor_x * factor_y <= 256 else np.uint32
+
+    def run_band(bounds):
+        top, bottom = bounds
+        blocks = source[top * factor_y:bottom * factor_y].reshape(bottom - top, factor_y, source.shape[1], 4)
+        rows = blocks[:, 0].astype(total_type)
+        for offset in range(1, factor_y):
+            rows += blocks[:, offset]
+        blocks = rows[:, :width * factor_x].reshape(bottom - top, width, factor_x, 4)
+        total = blocks[:, :, 0].copy()
+        for offset in range(1, factor_x):
+            total += blocks[:, :, offset]
+        total += factor_x * factor_y // 2
+        out[top:bottom] = total // (factor_x * factor_y)
+
+    tiling.map_limited(run_band, tiling.tile_bounds(height, BAND_ROWS), workers)
+    return out
+
+
+def filter_rows(source, bands, workers=None):
+    """
+    Resamples the rows of an image with the matrices of band_matrices(), one matrix product per band.
+    :param source: (rows, width, 4) numpy array of any number type
+    :param bands: see band_matrices()
+    :return: (target rows, width, 4) float32 numpy array
+    """
+    width = source.shape[1]
+    out = np.empty((bands[-1][1], width, 4), dtype=np.float32)
+
+    def run_band(band):
+        top, bottom, first, end, matrix = band
+        rows = source[first:end].reshape(end - first, width * 4).astype(np.float32)
+        np.matmul(matrix, rows, out=out[top:bottom].reshape(bottom - top, width * 4))
+
+    tiling.map_limited(run_band, bands, workers)
+    return out
+
+
+def resample_array(source, width, height, filter_name='lanczos', out=None, workers=None):
+    """
+    Resizes an ARGB32 numpy array to width x height with a separable filter. \n
+    Large reductions are block averaged first (see REDUCING_GAP). Then the columns are filtered with the cached
+    band matrices, the result is transposed and its rows are filtered the same way.
+    :param source: (height, width, 4) uint8 numpy array
+    :param width: width of the result
+    :param height: height of the result
+    :param filter_name: 'area', 'bilinear' or 'lanczos'
+    :param out: optional (height, width, 4) uint8 array to write into
+    :param workers: number of threads, every core by default
+    :return: uint8 numpy array
+    """
+    source_height, source_width = source.shape[:2]
+    if out is None:
+        out = np.empty((height, width, 4), dtype=np.uint8)
+    if (source_width, source_height) == (width, height):
+        out[...] = source
+        return out
+
+    factor_x, factor_y = reduction_factor(source_width, width), reduction_factor(source_height, height)
+    if factor_x > 1 or factor_y > 1:
+        source = box_reduce(source, factor_x, factor_y, workers)
+    # the dropped partial blocks are outside of the extent of the reduced image, so nothing moves
+    rows = filter_rows(source, band_matrices(source.shape[0], height, filter_name, source_height / factor_y),
+                       workers)
+    columns = filter_rows(rows.transpose(1, 0, 2),
+                          band_matrices(source.shape[1], width, filter_name, source_width / factor_x), workers)
+    result = columns.transpose(1, 0, 2)
+    result += 0.5
+    # lanczos overshoots at edges
+    np.clip(result, 0, 255, out=result)
+    out[...] = result
+    return out
+
+
+def fit_size(width, height, max_width, max_height):
+    """
+    The size of an image of width x height scaled to fit in max_width x max_height, keeping its aspect ratio.
+    :return: (width, height), at least 1 x 1
+    """
+    scale = min(max_width / width, max_height / height)
+    return max(int(round(width * scale)), 1), max(int(round(height * scale)), 1)
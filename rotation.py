@@ -0,0 +1,166 @@
+import math
+
+import numpy as np
+
+import tiling
+
+# Rows of the output computed at once, the float working buffers are about 16 x BAND_ROWS x width floats
+BAND_ROWS = 64
+
+# Catmull-Rom style cubic (Keys, a = -0.5), interpolating and without overshoot on linear ramps
+CUBIC_A = -0.5
+
+METHODS = ('nearest', 'bilinear', 'bicubic')
+
+
+def rotated_size(width, height, angle, expand=True):
+    """
+    The size of an image of width x height rotated by angle degrees.
+    :param expand: whether the result holds the whole rotated image, otherwise it keeps the size
+    :return: (width, height)
+    """
+    if not expand:
+        return width, height
+    radians = math.radians(angle)
+    cos, sin = abs(math.cos(radians)), abs(math.sin(radians))
+    # rounded first, so right angles do not grow by a pixel through floating point error
+    return (int(math.ceil(round(width * cos + height * sin, 6))),
+            int(math.ceil(round(width * sin + height * cos, 6))))
+
+
+def inverse_mapping(width, height, out_width, out_height, angle):
+    """
+    The affine map from output pixel centres to source pixel coordinates of a rotation about the image centre.
+    :return: (x0, y0, xx, xy, yx, yy): source x = x0 + xx * column + xy * row, source y = y0 + yx * column + yy * row
+    """
+    radians = math.radians(angle)
+    cos, sin = math.cos(radians), math.sin(radians)
+    centre_x, centre_y = (width - 1) / 2, (height - 1) / 2
+    out_centre_x, out_centre_y = (out_width - 1) / 2, (out_height - 1) / 2
+    # counter-clockwise on screen in y-down coordinates, inverted: source = R(-angle) * (output - centre)
+    return (centre_x - cos * out_centre_x + sin * out_centre_y,
+            centre_y - sin * out_centre_x - cos * out_centre_y,
+            cos, -sin, sin, cos)
+
+
+def cubic_weights(t):
+    """
+    The weights of the 4 taps at offsets -1, 0, 1, 2 for a fractional position t of the Keys cubic.
+    :param t: float32 numpy array of positions from 0 to 1
+    :return: list of 4 float32 arrays
+    """
+    a = CUBIC_A
+    t2 = t * t
+    t3 = t2 * t
+    return [a * (t3 - 2 * t2 + t),
+            (a + 2) * t3 - (a + 3) * t2 + 1,
+            -(a + 2) * t3 + (2 * a + 3) * t2 - a * t,
+            a * (t2 - t3)]
+
+
+def resample_band(source, mapping, out, top, method='bilinear', source_top=0, height=None):
+    """
+    Computes rows of the output of an affine resampling, see rotate_array(). \n
+    Every output pixel is mapped back into the source and interpolated from its neighbours there, gathering
+    all pixels of the band at once. Pixels mapped outside of the source are transparent.
+    :param source: (rows, width, 4) uint8 numpy array, the rows of the source the band needs
+    :param mapping: see inverse_mapping()
+    :param out: (band rows, out width, 4) uint8 array to write into
+    :param top: the output row of the first row of out
+    :param method: 'nearest', 'bilinear' or 'bicubic'
+    :param source_top: the source row of the first row of source
+    :param height: the number of rows of the whole source, the rows of source by default
+    """
+    rows, columns = out.shape[:2]
+    height = height or source.shape[0]
+    width = source.shape[1]
+    x0, y0, xx, xy, yx, yy = mapping
+    column = np.arange(columns, dtype=np.float32)
+    row = np.arange(top, top + rows, dtype=np.float32)[:, np.newaxis]
+    x = (x0 + xy * row) + xx * column
+    y = (y0 + yy * row) + yx * column
+
+    # pixels whose centre lands outside of the source are transparent
+    inside = (x > -0.5) & (x < width - 0.5) & (y > -0.5) & (y < height - 0.5)
+    # every pixel gathered as one 32-bit word from a flat index is much faster than gathering rows of 4 bytes,
+    # the views of images and tile stores are contiguous, so this does not copy
+    words = np.ascontiguousarray(source).view(np.uint32).reshape(-1)
+
+    def gather(row_index, column_index):
+        return np.take(words, row_index * width + column_index).view(np.uint8).reshape(rows, columns, 4)
+
+    if method == 'nearest':
+        column_index = np.clip(np.rint(x), 0, width - 1).astype(np.intp)
+        row_index = np.clip(np.rint(y), 0, height - 1).astype(np.intp) - source_top
+        result = gather(row_index, column_index)
+    else:
+        left, upper = np.floor(x), np.floor(y)
+        fx, fy = x - left, y - upper
+        left, upper = left.astype(np.intp), upper.astype(np.intp)
+        if method == 'bilinear':
+            offsets = (0, 1)
+            weights_x = [1 - fx, fx]
+            weights_y = [1 - fy, fy]
+        elif method == 'bicubic':
+            offsets = (-1, 0, 1, 2)
+            weights_x = cubic_weights(fx)
+            weights_y = cubic_weights(fy)
+        else:
+            raise ValueError(f"Unknown resampling method '{method}', expected one of {METHODS}")
+
+        # the taps outside of the source repeat its edge
+        column_indices = [np.clip(left + offset, 0, width - 1) for offset in offsets]
+        result = np.zeros((rows, columns, 4), dtype=np.float32)
+        for row_offset, weight_y in zip(offsets, weights_y):
+            row_index = np.clip(upper + row_offset, 0, height - 1) - source_top
+            line = np.zeros((rows, columns, 4), dtype=np.float32)
+            for column_index, weight_x in zip(column_indices, weights_x):
+                line += gather(row_index, column_index) * weight_x[..., np.newaxis]
+            result += line * weight_y[..., np.newaxis]
+        result += 0.5
+        np.clip(result, 0, 255, out=result)
+
+    out[...] = result
+    out[~inside] = 0
+
+
+def source_rows(mapping, top, bottom, out_width, height, method='bilinear'):
+    """
+    The range of source rows the output rows top to bottom read, for streaming large images.
+    :return: (first row, end row), clamped to the source and at least one row, the edge row the taps repeat
+    """
+    x0, y0, xx, xy, yx, yy = mapping
+    corners = [y0 + yx * column + yy * row for column in (0, out_width - 1) for row in (top, bottom - 1)]
+    margin = 2 if method == 'bicubic' else 1
+    first = min(max(int(math.floor(min(corners))) - margin, 0), height - 1)
+    end = min(int(math.ceil(max(corners))) + margin + 1, height)
+    return first, max(end, first + 1)
+
+
+def rotate_array(source, angle, method='bilinear', expand=True, out=None, workers=None):
+    """
+    Rotates an ARGB32 numpy array by any angle about its centre, counter-clockwise for positive angles.
+    The output is computed in bands of BAND_ROWS rows on the thread pool of tiling.
+    :param source: (height, width, 4) uint8 numpy array
+    :param angle: angle in degrees
+    :param method: 'nearest', 'bilinear' or 'bicubic'
+    :param expand: whether the result holds the whole rotated image (see rotated_size()), otherwise it keeps
+    the size and the corners are cut off
+    :param out: optional uint8 array of the rotated size to write into
+    :param workers: number of threads, every core by default
+    :return: the rotated uint8 numpy array, with transparent corners
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown resampling method '{method}', expected one of {METHODS}")
+    height, width = source.shape[:2]
+    out_width, out_height = rotated_size(width, height, angle, expand)
+    if out is None:
+        out = np.empty((out_height, out_width, 4), dtype=np.uint8)
+    mapping = inverse_mapping(width, height, out_width, out_height, angle)
+
+    def run_band(bounds):
+        top, bottom = bounds
+        resample_band(source, mapping, out[top:bottom], top, method)
+
+    tiling.map_limited(run_band, tiling.tile_bounds(out_height, BAND_ROWS), workers)
+    return out
@@ -0,0 +1,166 @@
+import logging
+import os
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+import image_operations
+import tiling
+from edit_graph import EditNode
+
+logger = logging.getLogger(__name__)
+
+# The box the thumbnails are scaled to fit in
+THUMBNAIL_SIZE = (112, 72)
+
+
+def preset_key(preset):
+    """
+    A hashable key of the parameters of a preset. Presets with the same parameters share their thumbnail.
+    A preset read from a .cube file also keys on the modification time of the file, like color_lut.compile_preset(),
+    so the thumbnail follows when the file is changed.
+    :param preset: dict of preset parameters
+    :return: tuple
+    """
+    key = tuple(sorted(preset.items()))
+    if "LUT" in preset:
+        try:
+            key += (os.path.getmtime(preset["LUT"]),)
+        except OSError:
+            pass
+    return key
+
+
+def _other_edits(nodes):
+    # the edits besides the filter, with a placeholder where the filter is. Thumbnails only change when these do
+    return tuple(None if node.key == 'filter' else node for node in nodes)
+
+
+def with_preset(nodes, preset):
+    """
+    The edits as they are when the preset is applied, see UI_FilterWidget.apply_filter(): the preset replaces
+    the filter node, or is added after the other edits if there is none yet.
+    :param nodes: tuple of EditNode objects
+    :param preset: dict of preset parameters
+    :return: tuple of EditNode objects
+    """
+    filter_node = EditNode('filter', 'filter', {'preset': preset})
+    if any(node.key == 'filter' for node in nodes):
+        return tuple(filter_node if node.key == 'filter' else node for node in nodes)
+    return tuple(nodes) + (filter_node,)
+
+
+class _ThumbnailJob(QRunnable):
+    """
+    Renders the edits with one preset on the small source image on a thread of the pool and reports back
+    to its renderer.
+    """
+
+    def __init__(self, renderer, generation, name, key, source, scale, nodes):
+        super(_ThumbnailJob, self).__init__()
+        self.renderer = renderer
+        self.generation = generation
+        self.name = name
+        self.key = key
+        self.source = source
+        self.scale = scale
+        self.nodes = nodes
+
+    def run(self):
+        if self.renderer.is_stale(self.generation):
+            return
+        try:
+            image = self.source
+            for node in self.nodes:
+                image = node.apply(image, self.scale)
+        except Exception:
+            logger.exception("Could not render the thumbnail of %s", self.name)
+            # reported as None, so the renderer forgets the request and a later one tries again
+            image = None
+        # The renderer lives in the GUI thread, so this is delivered there through a queued connection
+        self.renderer._job_done.emit(self.generation, self.name, self.key, image)
+
+
+class ThumbnailRenderer(QObject):
+    """
+    Renders small previews of presets in a background thread pool. \n
+    The current edits are applied with each preset to a copy of the source image scaled down to THUMBNAIL_SIZE,
+    so a thumbnail shows what the preview becomes when the preset is chosen. Results are cached per preset
+    parameters until the source image or the other edits change, then the cache is dropped and renders still
+    running for the old ones are ignored. Every thumbnail is emitted through thumbnail_ready as soon as it is done.
+    """
+    thumbnail_ready = pyqtSignal(str, object)
+    _job_done = pyqtSignal(int, str, object, object)
+
+    def __init__(self, size=THUMBNAIL_SIZE, thread_pool=None):
+        super(ThumbnailRenderer, self).__init__()
+        self.size = size
+        if thread_pool is None:
+            # a pool of its own, so thumbnails never hold up the preview on the global pool
+            thread_pool = QThreadPool(self)
+            thread_pool.setMaxThreadCount(tiling.default_workers())
+        self.thread_pool = thread_pool
+        self.generation = 0
+        self.source_key = None
+        self.source = None
+        self.scale = 1.0
+        self.nodes = ()
+        self.cache = {}
+        self._requested = {}
+        self._job_done.connect(self._on_job_done)
+
+    def set_source(self, q_image, scale=1.0, nodes=()):
+        """
+        Sets the image and the edits the thumbnails show. Nothing is dropped if they are the same as before,
+        the filter node does not count as the presets replace it.
+        :param q_image: QImage object, the unedited image
+        :param scale: the size of q_image relative to the original
+        :param nodes: tuple of EditNode objects, the current edits
+        """
+        source_key = q_image.cacheKey()
+        other_edits = _other_edits(nodes)
+        if source_key == self.source_key and other_edits == _other_edits(self.nodes):
+            return
+        self.generation += 1
+        self.nodes = tuple(nodes)
+        self.cache = {}
+        self._requested = {}
+        if source_key != self.source_key:
+            self.source_key = source_key
+            self.source = None
+            if not q_image.isNull():
+                self.source = image_operations.scale_to_fit(q_image, self.size[0], self.size[1], 'area')
+        if self.source is not None:
+            # the edits take sizes in original image pixels, like a crop or a blur radius
+            self.scale = scale * self.source.width() / q_image.width()
+
+    def request(self, name, preset):
+        """
+        Asks for the thumbnail of a preset. It is emitted right away if it is cached, otherwise once it is rendered.
+        :param name: name of the preset, passed back with the thumbnail
+        :param preset: dict of preset parameters
+        """
+        if self.source is None:
+            return
+        key = preset_key(preset)
+        if key in self.cache:
+            self.thumbnail_ready.emit(name, self.cache[key])
+            return
+        names = self._requested.setdefault(key, set())
+        first = not names
+        names.add(name)
+        if first:
+            self.thread_pool.start(_ThumbnailJob(self, self.generation, name, key, self.source, self.scale,
+                                                 with_preset(self.nodes, dict(preset))))
+
+    def is_stale(self, generation):
+        return generation != self.generation
+
+    def _on_job_done(self, generation, name, key, image):
+        if self.is_stale(generation):
+            return
+        if image is None:
+            self._requested.pop(key, None)
+            return
+        self.cache[key] = image
+        for requested_name in self._requested.pop(key, {name}):
+            self.thumbnail_ready.emit(requested_name, image)
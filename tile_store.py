@@ -0,0 +1,326 @@
+import contextlib
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+import numpy as np
+from PyQt6.QtCore import QRect
+from PyQt6.QtGui import QImage, QImageIOHandler, QImageReader
+
+import image_bridge
+import resampling
+import tiling
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of the pixel memory an operation over a TileStore keeps resident, for all its threads together
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Copies of a band an operation may hold at once: source with halo, result and float working buffers
+BAND_COPIES = 8
+
+# Copies of a band decoding holds at once: the decoded band and its conversion to the working format
+DECODE_COPIES = 2
+
+# The formats save() writes band by band. The other encoders need the whole image in memory
+STREAMED_FORMATS = ('bmp', 'png')
+
+_PAGE_SIZE = mmap.PAGESIZE
+
+
+@contextlib.contextmanager
+def _allocation_limit(image_bytes):
+    """
+    Raises the limit Qt puts on the images it decodes (in MB) to image_bytes while the block runs, if it is lower,
+    and puts the previous limit back afterwards.
+    """
+    previous = QImageReader.allocationLimit()
+    needed = math.ceil(image_bytes / (1024 * 1024)) + 1
+    if previous and previous < needed:
+        QImageReader.setAllocationLimit(needed)
+    try:
+        yield
+    finally:
+        QImageReader.setAllocationLimit(previous)
+
+
+def _png_chunk(png_file, chunk_type, data):
+    png_file.write(struct.pack('>I', len(data)) + chunk_type + data)
+    png_file.write(struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+class TileStore:
+    """
+    An ARGB32 image kept in a memory-mapped file instead of RAM, for images larger than the memory. \n
+    The pixels are in the working memory layout, row after row, so horizontal bands of rows are plain numpy views
+    of the file. Operations stream over such bands (see stream()) and release them when they are done,
+    so only the bands in flight are resident, whatever the size of the image. The file is deleted by close().
+    """
+
+    def __init__(self, width, height, memory_limit=DEFAULT_MEMORY_LIMIT, directory=None):
+        self.width = width
+        self.height = height
+        self.memory_limit = memory_limit
+        handle, self.path = tempfile.mkstemp(suffix='.tiles', dir=directory)
+        os.close(handle)
+        self.array = np.memmap(self.path, dtype=np.uint8, mode='w+', shape=(height, width, 4))
+
+    @classmethod
+    def from_q_image(cls, q_image, memory_limit=DEFAULT_MEMORY_LIMIT, directory=None):
+        """
+        Copies a QImage into a new store.
+        :param q_image: QImage object
+        :return: TileStore object
+        """
+        source = image_bridge.view(image_bridge.to_working_format(q_image))
+        store = cls(q_image.width(), q_image.height(), memory_limit, directory)
+        for top, bottom in store.bands():
+            store.array[top:bottom] = source[top:bottom]
+            store.release(top, bottom)
+        return store
+
+    @classmethod
+    def from_file(cls, file_path, memory_limit=DEFAULT_MEMORY_LIMIT, directory=None):
+        """
+        Decodes an image file into a new store, without holding more than memory_limit of pixels. \n
+        An image that fits is decoded at once. Formats whose decoder can read a region (e.g. JPEG) are decoded in
+        bands as large as the limit allows. The decoder cannot go on where it stopped, so every band decodes the
+        file again up to its last row. Other formats cannot be decoded within the limit and fail.
+        :param file_path: path of the image file
+        :return: TileStore object, or None if the file cannot be decoded
+        """
+        reader = QImageReader(file_path)
+        size = reader.size()
+        if not size.isValid():
+            return None
+        row_bytes = size.width() * 4
+        rows = memory_limit // (row_bytes * DECODE_COPIES)
+        if rows < size.height() and not reader.supportsOption(QImageIOHandler.ImageOption.ClipRect):
+            logger.warning("%s needs %d MB to decode, more than the memory limit of %d MB", file_path,
+                           row_bytes * size.height() * DECODE_COPIES // (1024 * 1024), memory_limit // (1024 * 1024))
+            return None
+        store = cls(size.width(), size.height(), memory_limit, directory)
+
+        for top, bottom in tiling.tile_bounds(store.height, max(rows, 1)):
+            if top > 0:
+                reader = QImageReader(file_path)
+            if bottom - top < store.height:
+                reader.setClipRect(QRect(0, top, store.width, bottom - top))
+            with _allocation_limit((bottom - top) * row_bytes):
+                band = reader.read()
+            if band.isNull():
+                store.close()
+                return None
+            store.array[top:bottom] = image_bridge.view(image_bridge.to_working_format(band))
+            del band
+            store.release(top, bottom)
+        return store
+
+    def empty_like(self, width=None, height=None):
+        """
+        A new store with the same memory limit and directory, and the same size unless another one is given.
+        :return: TileStore object
+        """
+        return TileStore(self.width if width is None else width, self.height if height is None else height,
+                         self.memory_limit, os.path.dirname(self.path))
+
+    def band_rows(self, halo=0, workers=1):
+        """
+        The number of rows per band, so that workers bands in flight stay within the memory limit.
+        :param halo: extra rows an operation reads on each side of a band
+        :param workers: number of bands processed at once
+        :return: rows per band, at least 1
+        """
+        # an empty image has no bands, the row size is only kept from being 0
+        row_bytes = max(self.width, 1) * 4 * BAND_COPIES
+        rows = self.memory_limit // (row_bytes * max(workers, 1)) - 2 * halo
+        return int(max(rows, 1))
+
+    def bands(self, halo=0, workers=1):
+        return tiling.tile_bounds(self.height, self.band_rows(halo, workers))
+
+    def release(self, top, bottom):
+        """
+        Writes the rows top to bottom back to the file and drops them from memory.
+        The pages are read again from the file when they are used next.
+        """
+        mapping = getattr(self.array, '_mmap', None)
+        if mapping is None or bottom <= top:
+            return
+        row_bytes = self.width * 4
+        start = top * row_bytes // _PAGE_SIZE * _PAGE_SIZE
+        end = min(bottom * row_bytes, len(mapping))
+        mapping.flush(start, end - start)
+        if hasattr(mapping, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+            mapping.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def to_q_image(self):
+        """
+        Copies the whole image into a QImage. It needs the memory of the whole image.
+        :return: QImage object, a null QImage for an empty store (like image_operations.crop() of an empty region)
+        """
+        if not self.width or not self.height:
+            return QImage()
+        q_image, pixels = image_bridge.new_image(self.width, self.height)
+        for top, bottom in self.bands():
+            pixels[top:bottom] = self.array[top:bottom]
+            self.release(top, bottom)
+        return q_image
+
+    def scaled(self, max_width, max_height, filter_name='area'):
+        """
+        A copy of the image scaled down to fit in max_width x max_height, streamed band by band.
+        Every band is first averaged over blocks of whole pixels, the rest of the reduction is done by
+        resampling.resample_array() on the averaged image.
+        :param filter_name: filter of the rest of the reduction, see resampling.FILTERS
+        :return: QImage object, a null QImage for an empty store
+        """
+        if not self.width or not self.height:
+            return QImage()
+        factor = max(1, min(self.width // max_width, self.height // max_height))
+        rows = max(self.band_rows() // factor, 1) * factor
+        height, width = self.height // factor, self.width // factor
+        q_image, pixels = image_bridge.new_image(width, height)
+        for top in range(0, height * factor, rows):
+            bottom = min(top + rows, height * factor)
+            pixels[top // factor:bottom // factor] = resampling.box_reduce(self.array[top:bottom], factor, factor)
+            self.release(top, bottom)
+        if width <= max_width and height <= max_height:
+            return q_image
+        result, result_pixels = image_bridge.new_image(*resampling.fit_size(width, height, max_width, max_height))
+        resampling.resample_array(pixels, result_pixels.shape[1], result_pixels.shape[0], filter_name,
+                                  out=result_pixels)
+        return result
+
+    def fits_in_memory(self):
+        """
+        :return: True if the whole image fits in the memory limit, e.g. to be encoded at once
+        """
+        return self.width * self.height * 4 <= self.memory_limit
+
+    def save(self, file_path, quality=-1, progress=None):
+        """
+        Saves the image. BMP and PNG files are written band by band (see STREAMED_FORMATS). Other formats need
+        the memory of the whole image and fail if it is more than the memory limit.
+        :param file_path: path of the image file
+        :param quality: encoder quality from 0 to 100, -1 for the default
+        :param progress: optional function(fraction) called after every band of a BMP or PNG file
+        :return: True on success
+        """
+        extension = os.path.splitext(file_path)[1].lower().lstrip('.')
+        if extension == 'bmp':
+            return self._save_bmp(file_path, progress)
+        if extension == 'png':
+            return self._save_png(file_path, quality, progress)
+        if not self.fits_in_memory():
+            logger.warning("The image is too large to be encoded as %s within the memory limit, save it as %s",
+                           extension.upper() or 'this format', ' or '.join(name.upper() for name in STREAMED_FORMATS))
+            return False
+        return self.to_q_image().save(file_path, quality=quality)
+
+    def _save_bmp(self, file_path, progress=None):
+        row_bytes = self.width * 4
+        image_bytes = row_bytes * self.height
+        if image_bytes + 54 > 0xFFFFFFFF:
+            logger.warning("The image is too large for a BMP file")
+            return False
+        try:
+            with open(file_path, 'wb') as bmp_file:
+                # 32-bit BI_RGB rows are stored (blue, green, red, unused), the same as the working layout
+                bmp_file.write(struct.pack('<2sIHHI', b'BM', 54 + image_bytes, 0, 0, 54))
+                bmp_file.write(struct.pack('<IiiHHIIiiII', 40, self.width, -self.height, 1, 32, 0, image_bytes,
+                                           2835, 2835, 0, 0))
+                for top, bottom in self.bands():
+                    bmp_file.write(np.ascontiguousarray(self.array[top:bottom]).tobytes())
+                    self.release(top, bottom)
+                    if progress is not None:
+                        progress(bottom / self.height)
+        except OSError as e:
+            logger.error("Could not write %s: %s", file_path, e)
+            return False
+        return True
+
+    def _save_png(self, file_path, quality=-1, progress=None):
+        # 8-bit RGBA rows, each with the "up" filter (the difference to the row above), which numpy computes for
+        # a whole band at once, compressed by a single zlib stream. Quality 100 stores the rows uncompressed,
+        # 0 compresses the most, -1 is the default level of zlib
+        level = zlib.Z_DEFAULT_COMPRESSION if quality < 0 else min(max((100 - quality) * 9 // 100, 0), 9)
+        compressor = zlib.compressobj(level)
+        previous = np.zeros((self.width, 4), dtype=np.uint8)
+        try:
+            with open(file_path, 'wb') as png_file:
+                png_file.write(b'\x89PNG\r\n\x1a\n')
+                _png_chunk(png_file, b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 6, 0, 0, 0))
+                for top, bottom in self.bands():
+                    # the working layout is (blue, green, red, alpha)
+                    band = self.array[top:bottom][:, :, (2, 1, 0, 3)]
+                    rows = np.empty((bottom - top, 1 + self.width * 4), dtype=np.uint8)
+                    rows[:, 0] = 2
+                    above = rows[:, 1:].reshape(bottom - top, self.width, 4)
+                    above[0] = previous
+                    above[1:] = band[:-1]
+                    np.subtract(band, above, out=above)
+                    previous = band[-1]
+                    self.release(top, bottom)
+                    data = compressor.compress(rows.tobytes())
+                    if data:
+                        _png_chunk(png_file, b'IDAT', data)
+                    if progress is not None:
+                        progress(bottom / self.height)
+                _png_chunk(png_file, b'IDAT', compressor.flush())
+                _png_chunk(png_file, b'IEND', b'')
+        except OSError as e:
+            logger.error("Could not write %s: %s", file_path, e)
+            return False
+        return True
+
+    def close(self):
+        """
+        Deletes the file of the store. The store cannot be used anymore.
+        """
+        if self.array is None:
+            return
+        # the mapping itself is closed by numpy once no view of it is left, closing it here could free
+        # memory still used by such a view. On POSIX the file can be removed while it is mapped
+        self.array = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def stream(function, source, out, halo=0, workers=None):
+    """
+    Runs an operation over the bands of a TileStore, with the same calling convention as tiling.run_tiled():
+    function(source_band, out_band, top_halo). \n
+    The bands are sized from the memory limit of the source, and at most workers of them are in flight.
+    Every band is released from memory when it is done, so the resident memory stays bounded by the limit.
+    :param function: the operation for one band
+    :param source: TileStore object
+    :param out: TileStore object with the same number of rows
+    :param halo: rows of context the operation needs on each side
+    :param workers: number of threads. None uses every core
+    :return: out
+    """
+    workers = workers or tiling.default_workers()
+    height = source.height
+
+    def run_band(bounds):
+        top, bottom = bounds
+        source_top, source_bottom = max(top - halo, 0), min(bottom + halo, height)
+        function(source.array[source_top:source_bottom], out.array[top:bottom], top - source_top)
+        source.release(source_top, source_bottom)
+        out.release(top, bottom)
+
+    tiling.map_limited(run_band, source.bands(halo, workers), workers)
+    return out
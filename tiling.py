@@ -0,0 +1,147 @@
+import concurrent.futures
+import math
+import os
+import threading
+
+import numpy as np
+
+# Tiles are never shorter than this, so the per-tile overhead stays small
+MIN_TILE_ROWS = 64
+
+# Tiles per worker. More than one evens out the load when some tiles are slower
+TILES_PER_WORKER = 2
+
+# Tiles are never larger than this many bytes of source rows (unless MIN_TILE_ROWS or the halo need more),
+# so the temporary arrays an operation makes per tile stay small however large the image and however few the workers
+MAX_TILE_BYTES = 8 * 1024 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+_default_workers = None
+
+
+def set_default_workers(workers):
+    """
+    Limits the number of threads run_tiled() uses when none is given, e.g. when several processes share the CPU.
+    :param workers: number of threads, or None for one per core
+    """
+    global _default_workers
+    _default_workers = workers
+
+
+def default_workers():
+    """
+    The number of threads used by run_tiled() when none is given.
+    :return: the limit set by set_default_workers(), otherwise the number of CPU cores available to the process
+    """
+    if _default_workers:
+        return _default_workers
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_executor():
+    """
+    Returns the shared thread pool. It is created once, with a thread per CPU core, and never replaced,
+    so pools in use are never shut down under another caller. Callers limit their own concurrency by the
+    number of tasks they keep submitted, see map_limited().
+    NumPy releases the GIL inside its loops, so tiles really run in parallel.
+    :return: concurrent.futures.ThreadPoolExecutor
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1,
+                                                              thread_name_prefix='tile')
+        return _executor
+
+
+def map_limited(function, items, workers=None):
+    """
+    Calls function(item) for every item on the shared thread pool, with at most workers calls running at once.
+    :param function: function of one item
+    :param items: list of the arguments
+    :param workers: number of threads. None uses default_workers()
+    :return: list of the results, in the order of items
+    """
+    workers = workers or default_workers()
+    executor = get_executor()
+    results = [None] * len(items)
+    in_flight = {}
+    for index, item in enumerate(items):
+        if len(in_flight) >= workers:
+            done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                results[in_flight.pop(future)] = future.result()
+        in_flight[executor.submit(function, item)] = index
+    for future, index in in_flight.items():
+        results[index] = future.result()
+    return results
+
+
+def tile_bounds(height, tile_rows):
+    """
+    Splits the rows of an image into horizontal tiles.
+    :param height: number of rows
+    :param tile_rows: rows per tile
+    :return: list of (top, bottom) row ranges
+    """
+    return [(top, min(top + tile_rows, height)) for top in range(0, height, tile_rows)]
+
+
+def run_tiled(function, source, out, halo=0, workers=None, tile_rows=None):
+    """
+    Runs an operation over horizontal tiles of an image on a thread pool. \n
+    Every tile is read together with halo extra rows above and below it (fewer at the image border),
+    so operations that look at neighbouring pixels produce the same result as on the whole image:
+        - point operations need no halo
+        - a blur or convolution needs its kernel radius
+    The operation is called as function(source_tile, out_tile, top_halo), where source_tile includes the halo,
+    out_tile is the part of out the tile must be written to and top_halo is the number of halo rows at the top
+    of source_tile.
+    :param function: the operation for one tile
+    :param source: (height, width, ...) numpy array
+    :param out: numpy array with the same number of rows to write the result into
+    :param halo: rows of context the operation needs on each side
+    :param workers: number of threads. None uses every core
+    :param tile_rows: rows per tile. None picks a size from the image height and the number of workers,
+    at most MAX_TILE_BYTES of source rows
+    :return: out
+    """
+    height = source.shape[0]
+    workers = workers or default_workers()
+    if tile_rows is None:
+        row_bytes = max(source[:1].nbytes, 1)
+        tile_rows = max(MIN_TILE_ROWS, 4 * halo,
+                        min(math.ceil(height / (workers * TILES_PER_WORKER)), MAX_TILE_BYTES // row_bytes))
+
+    bounds = tile_bounds(height, tile_rows)
+    if len(bounds) == 1:
+        function(source, out, 0)
+        return out
+
+    def run_tile(tile):
+        top, bottom = tile
+        source_top, source_bottom = max(top - halo, 0), min(bottom + halo, height)
+        function(source[source_top:source_bottom], out[top:bottom], top - source_top)
+
+    if workers == 1:
+        # one tile after the other in this thread, the memory of a tile is still all an operation needs
+        for tile in bounds:
+            run_tile(tile)
+        return out
+
+    map_limited(run_tile, bounds, workers)
+    return out
+
+
+def crop_halo(result, out_tile, top_halo):
+    """
+    Copies the rows of a tile result that belong to the tile itself (without the halo) into out_tile.
+    :param result: result computed for the tile including its halo
+    :param out_tile: the part of the output the tile is written to
+    :param top_halo: number of halo rows at the top of result
+    """
+    np.copyto(out_tile, result[top_halo:top_halo + out_tile.shape[0]])
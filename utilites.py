@@ -2,6 +2,8 @@ import numpy as np
 from PyQt6.QtCore import QObject, pyqtSignal
 from PyQt6.QtGui import QPixmap, QImage
 
+import image_bridge
+
 
 class ValueProperty(QObject):
     valueChanged = pyqtSignal(object)
@@ -30,10 +32,8 @@ def cv_image_to_q_pixmap(cv_image):
 
 
 def pixmap_to_numpy(pixmap):
-    image = pixmap.toImage()
-    width, height = image.width(), image.height()
-    buffer = image.bits().asarray(height * width * 3)
-    return np.array(buffer).reshape((height, width, 3))
+    image = image_bridge.to_working_format(pixmap.toImage())
+    return image_bridge.view(image)
 
 
 def numpy_to_pixmap(numpy_array):
@@ -41,3 +41,14 @@ def numpy_to_pixmap(numpy_array):
     bytes_per_line = 3 * width  # Assuming 3 channels (RGB)
     image = QImage(numpy_array.tobytes(), width, height, bytes_per_line, QImage.Format.Format_RGB888)
     return QPixmap.fromImage(image)
+
+
+class Signal(QObject):
+    """
+    A signal for classes that are not QObjects themselves. Unlike ValueProperty it is emitted every time,
+    even with the same value: signal.emitted.connect(slot), signal.emit(value).
+    """
+    emitted = pyqtSignal(object)
+
+    def emit(self, value=None):
+        self.emitted.emit(value)
@@ -1,9 +1,11 @@
 from PyQt6 import uic
 from PyQt6.QtWidgets import *
 
+import edit_graph
 import image_operations
 from canvas_controller import CanvasController
 from filepaths import Filepaths
+from widgets.histogram_widget import HistogramWidget
 
 
 class UI_AdjustWidget(QWidget):
@@ -22,6 +24,7 @@ class UI_AdjustWidget(QWidget):
         self.exposure_slider = self.findChild(QSlider, "exposure_slider")
         self.warmth_slider = self.findChild(QSlider, "warmth_slider")
         self.saturation_slider = self.findChild(QSlider, "saturation_slider")
+        self.straighten_slider = self.findChild(QSlider, "straighten_slider")
         self.canvas_controller = canvas_controller
 
         self.blur_slider.valueChanged.connect(self.blur)
@@ -31,54 +34,102 @@ class UI_AdjustWidget(QWidget):
         self.saturation_slider.valueChanged.connect(self.other_effects)
         self.warmth_slider.valueChanged.connect(self.other_effects)
         self.exposure_slider.valueChanged.connect(self.other_effects)
+        self.straighten_slider.valueChanged.connect(self.straighten)
+        # undo, redo and revert replace the edits, the sliders are moved to match them
+        self.canvas_controller.edits_restored.emitted.connect(self.restore_sliders)
 
-    def blur(self):
-        if self.blur_slider.value() < 3:
-                self.canvas_controller.scene_image = image_operations.blur(self.canvas_controller.original_image, 0)
+        # The histogram of the preview, above the sliders. The controller computes it with every preview
+        self.histogram_widget = HistogramWidget()
+        self.main_widget.layout().insertWidget(0, self.histogram_widget)
+        self.canvas_controller.statistics.valueChanged.connect(self.histogram_widget.set_statistics)
+        self.histogram_widget.set_statistics(self.canvas_controller.statistics.value)
+
+    @staticmethod
+    def _factor_to_slider(slider, factor):
+        # inverse of the factor mapping of other_effects(), 1.0 is the middle of the slider
+        return round(slider.minimum() + (factor - 0.6) / 0.8 * (slider.maximum() - slider.minimum()))
+
+    def restore_sliders(self, nodes):
+        """
+        Moves the sliders to the parameters of the nodes of the edit graph, the identity for the missing ones.
+        The sliders do not emit meanwhile, so no edit is set again.
+        :param nodes: tuple of EditNode objects
+        """
+        params = {node.key: node.params for node in nodes}
+        sliders = (self.blur_slider, self.sharpen_slider, self.contrast_slider, self.brightness_slider,
+                   self.exposure_slider, self.warmth_slider, self.saturation_slider, self.straighten_slider)
+        for slider in sliders:
+            slider.blockSignals(True)
+
+        radius = params.get('blur', {}).get('radius', 0)
+        self.blur_slider.setValue(radius if radius >= 3 else self.blur_slider.minimum())
+
+        strength = params.get('sharpen', {}).get('strength', 0.0)
+        if strength >= 0:
+            self.sharpen_slider.setValue(round(strength / 2.0 * self.sharpen_slider.maximum()))
         else:
-                self.canvas_controller.scene_image = image_operations.blur(self.canvas_controller.original_image, self.blur_slider.value())
-                self.canvas_controller.scene_image_updated.value = True
+            self.sharpen_slider.setValue(round(strength / -0.2 * self.sharpen_slider.minimum()))
+
+        adjust = dict(edit_graph.ADJUST_IDENTITY)
+        adjust.update(params.get('adjust', {}))
+        brightness_factor, brightness_gamma = adjust['brightness_factor'], adjust['brightness_gamma']
+        if brightness_gamma < 1.0:
+            minimum = self.brightness_slider.minimum()
+            self.brightness_slider.setValue(round(minimum + (brightness_gamma - 0.3) / 0.7 * (-0.0001 - minimum)))
+        else:
+            self.brightness_slider.setValue(round(brightness_factor / 100.0 * self.brightness_slider.maximum()))
+
+        for name, slider in (('contrast_factor', self.contrast_slider), ('warmth_factor', self.warmth_slider),
+                             ('saturation_factor', self.saturation_slider), ('exposure_factor', self.exposure_slider)):
+            slider.setValue(self._factor_to_slider(slider, adjust[name]))
+
+        self.straighten_slider.setValue(round(params.get('straighten', {}).get('angle', 0.0) * 10))
+
+        for slider in sliders:
+            slider.blockSignals(False)
+
+    def blur(self):
+        radius = self.blur_slider.value() if self.blur_slider.value() >= 3 else 0
+        self.canvas_controller.set_edit('blur', radius=radius)
 
     def sharpen(self):
-        self.canvas_controller.scene_image = image_operations.sharpen(self.canvas_controller.original_image)
-        self.canvas_controller.scene_image_updated.value = True
+        if self.sharpen_slider.value() >= 0:
+                strength = (self.sharpen_slider.value() / self.sharpen_slider.maximum()) * 2.0
+        else:
+                strength = (self.sharpen_slider.value() / self.sharpen_slider.minimum()) * -0.2
+        self.canvas_controller.set_edit('sharpen', strength=strength)
+
+    def straighten(self):
+        # the slider is in tenths of a degree
+        self.canvas_controller.straighten(self.straighten_slider.value() / 10)
 
     def other_effects(self):
         contrast_factor = ((self.contrast_slider.value() - self.contrast_slider.minimum()) / (
                 self.contrast_slider.maximum() - self.contrast_slider.minimum())) * 0.8 + 0.6
-        self.canvas_controller.scene_image = image_operations.change_contrast(self.canvas_controller.original_image,
-                                                                              contrast_factor)
-        
-        print(self.brightness_slider.value())
-        
+
+        brightness_factor = 0.0
+        brightness_gamma = 1.0
         if self.brightness_slider.value() >= 0:
                 brightness_factor = ((self.brightness_slider.value()) / (
                         self.brightness_slider.maximum())) * 100.0
-                self.canvas_controller.scene_image = image_operations.change_brightness(self.canvas_controller.scene_image,
-                                                                                brightness_factor)
         else:
-                brightness_factor = ((self.brightness_slider.value() - self.brightness_slider.minimum()) / (
+                brightness_gamma = ((self.brightness_slider.value() - self.brightness_slider.minimum()) / (
                         -0.0001 - self.brightness_slider.minimum())) * 0.7 + 0.3
-                self.canvas_controller.scene_image = image_operations.change_brightness_rev(self.canvas_controller.scene_image,
-                                                                                        brightness_factor)
-                
-        
-        
+
         warmth_factor = ((self.warmth_slider.value() - self.warmth_slider.minimum()) / (
                 self.warmth_slider.maximum() - self.warmth_slider.minimum())) * 0.8 + 0.6
-        self.canvas_controller.scene_image = image_operations.change_warmth(self.canvas_controller.scene_image,
-                                                                            warmth_factor)
         saturation_factor = ((self.saturation_slider.value() - self.saturation_slider.minimum()) / (
                 self.saturation_slider.maximum() - self.saturation_slider.minimum())) * 0.8 + 0.6
-        self.canvas_controller.scene_image = image_operations.change_saturation(self.canvas_controller.scene_image,
-                                                                                saturation_factor)
         exposure_factor = ((self.exposure_slider.value() - self.exposure_slider.minimum()) / (
                 self.exposure_slider.maximum() - self.exposure_slider.minimum())) * 0.8 + 0.6
-        self.canvas_controller.scene_image = image_operations.change_exposure(self.canvas_controller.scene_image,
-                                                                              exposure_factor)
-        self.canvas_controller.scene_image_updated.value = True
-
 
+        # one node, so the five adjustments are computed in a single pass by image_operations.adjust()
+        self.canvas_controller.edit_graph.set_node('adjust', contrast_factor=contrast_factor,
+                                                   brightness_factor=brightness_factor,
+                                                   brightness_gamma=brightness_gamma, warmth_factor=warmth_factor,
+                                                   saturation_factor=saturation_factor,
+                                                   exposure_factor=exposure_factor)
+        self.canvas_controller.update_preview()
 
 
 if __name__ == "__main__":
@@ -1,4 +1,4 @@
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import QPoint, Qt
 from PyQt6.QtGui import QPalette, QCursor
 from PyQt6.QtWidgets import QHBoxLayout, QSizeGrip, QRubberBand, QWidget
 
@@ -55,16 +55,21 @@ class CropRubberBandWidget(QWidget):
             self.mouse_event_previous_pos = QCursor.pos()
 
     def update_crop_dimensions(self):
-        diff_x = (self.parent().width() - self.canvas_controller.scene_image.width()) // 2
-        diff_y = (self.parent().height() - self.canvas_controller.scene_image.height()) // 2
-        self.left = self.pos().x() - diff_x
-        self.right = self.pos().x() + self.width() - diff_x
-        self.top = self.pos().y() - diff_y
-        self.bottom = self.pos().y() + self.height() - diff_y
+        """
+        Maps the widget through the canvas (the parent QGraphicsView) into the scene, whose coordinates are the
+        pixels of the displayed image, wherever the view placed it.
+        """
+        view = self.parent()
+        offset = view.viewport().pos()
+        top_left = view.mapToScene(self.pos() - offset)
+        bottom_right = view.mapToScene(self.pos() + QPoint(self.width(), self.height()) - offset)
+        self.left, self.top = round(top_left.x()), round(top_left.y())
+        self.right, self.bottom = round(bottom_right.x()), round(bottom_right.y())
 
     def get_crop_dimensions(self):
         """
-        Returns the crop dimensions of the widget that will be used to crop an image
+        Returns the crop dimensions of the widget that will be used to crop an image, in displayed image pixels.
+        See CanvasController.display_to_original_rect() for the pixels of the original.
         :return: Top, Bottom, Right, Left column indices
         """
         return self.top, self.bottom, self.right, self.left
@@ -2,16 +2,23 @@ from PyQt6 import uic
 from PyQt6.QtWidgets import *
 
 import image_operations
+import color_lut
 from filepaths import Filepaths
 import json
+import logging
+import os
+import shutil
 import copy
 from PyQt6 import uic
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 
+from thumbnails import ThumbnailRenderer, THUMBNAIL_SIZE
 from widgets.filter_input_dialog import UI_FilterInputDialog
 
+logger = logging.getLogger(__name__)
+
 
 class UI_FilterWidget(QWidget):
     def __init__(self, canvas_controller):
@@ -19,13 +26,25 @@ class UI_FilterWidget(QWidget):
         uic.loadUi(Filepaths.FILTER_WIDGET(), self)
 
         self.filters = None
+        self.filter_buttons = {}
+        self.selected_filter = None
+
+        """Every preset button shows the image with the preset applied, rendered in the background."""
+        self.thumbnail_renderer = ThumbnailRenderer()
+        self.thumbnail_renderer.thumbnail_ready.connect(self.set_thumbnail)
 
         self.main_widget = self.findChild(QWidget, "main_widget")
         self.filter_area = self.findChild(QScrollArea, "scrollArea")
         self.add_new_filter_button = self.findChild(QPushButton, "add_new_filter_button")
         self.add_new_filter_button.clicked.connect(self.open_filter_input_dialog)
+        self.import_cube_button = self.findChild(QPushButton, "import_cube_button")
+        self.import_cube_button.clicked.connect(self.import_cube)
+        self.export_cube_button = self.findChild(QPushButton, "export_cube_button")
+        self.export_cube_button.clicked.connect(self.export_cube)
         self.read_filters(Filepaths.FILTER_FILE())
         self.canvas_controller = canvas_controller
+        if canvas_controller is not None:
+            canvas_controller.scene_image_updated.valueChanged.connect(self.event_preview_updated)
 
         self.add_filter_buttons()
 
@@ -39,19 +58,8 @@ class UI_FilterWidget(QWidget):
 
     def apply_filter(self, filter_name):
         try:
-            self.canvas_controller.scene_image = image_operations.change_contrast(self.canvas_controller.original_image,
-                                                                                  self.filters[filter_name]["Contrast"])
-            self.canvas_controller.scene_image = image_operations.change_exposure(self.canvas_controller.scene_image,
-                                                                                  self.filters[filter_name]["Exposure"])
-            self.canvas_controller.scene_image = image_operations.change_warmth(self.canvas_controller.scene_image,
-                                                                                self.filters[filter_name]["Warmth"])
-            self.canvas_controller.scene_image = image_operations.change_brightness(self.canvas_controller.scene_image,
-                                                                                    self.filters[filter_name][
-                                                                                        "Brightness"])
-            self.canvas_controller.scene_image = image_operations.change_saturation(self.canvas_controller.scene_image,
-                                                                                    self.filters[filter_name][
-                                                                                        "Saturation"])
-            self.canvas_controller.scene_image_updated.value = True
+            self.canvas_controller.set_edit('filter', preset=dict(self.filters[filter_name]))
+            self.selected_filter = filter_name
         except Exception as e:
             print(e)
 
@@ -65,17 +73,89 @@ class UI_FilterWidget(QWidget):
             self.filters = json.load(json_file)
 
     def add_filter_button(self, filter_name):
-        button = QPushButton(filter_name)
-        button.setObjectName(filter_name)
-        button.setFixedWidth(120)
-        button.setFixedHeight(50)
-        button.clicked.connect(self.event_clicked_on_vintage)
-        self.filter_area.widget().layout().insertWidget(len(self.filter_area.widget().layout()) - 2, button)
-    
+        button = self.filter_buttons.get(filter_name)
+        if button is None:
+            button = QToolButton()
+            button.setText(filter_name)
+            button.setObjectName(filter_name)
+            button.setToolButtonStyle(Qt.ToolButtonStyle.ToolButtonTextUnderIcon)
+            button.setIconSize(QSize(*THUMBNAIL_SIZE))
+            button.setFixedWidth(120)
+            button.setFixedHeight(THUMBNAIL_SIZE[1] + 30)
+            button.clicked.connect(self.event_clicked_on_vintage)
+            layout = self.filter_area.widget().layout()
+            layout.insertWidget(layout.indexOf(self.add_new_filter_button), button)
+            self.filter_buttons[filter_name] = button
+        self.thumbnail_renderer.request(filter_name, self.filters[filter_name])
+
     def add_filter_buttons(self):
         for filter_name in self.filters.keys():
             self.add_filter_button(filter_name)
 
+    def update_thumbnails(self):
+        """
+        Shows the current preview with each preset on the preset buttons. Cached thumbnails are shown right away,
+        the others appear one by one as they are rendered.
+        """
+        if self.canvas_controller is None:
+            return
+        self.thumbnail_renderer.set_source(self.canvas_controller.proxy_image, self.canvas_controller.proxy_scale,
+                                           self.canvas_controller.edit_graph.nodes)
+        for filter_name, preset in self.filters.items():
+            self.thumbnail_renderer.request(filter_name, preset)
+
+    def event_preview_updated(self, updated):
+        # the thumbnails follow the edits while the presets are shown
+        if updated and self.main_widget.isVisible():
+            self.update_thumbnails()
+
+    def set_thumbnail(self, filter_name, image):
+        button = self.filter_buttons.get(filter_name)
+        if button is not None:
+            button.setIcon(QIcon(QPixmap.fromImage(image)))
+
+    def import_cube(self):
+        """
+        Adds a .cube file made by another tool as a new preset. The file is copied to the LUT directory
+        and the preset refers to it, see color_lut.compile_preset().
+        """
+        file_path, _ = QFileDialog.getOpenFileName(self, filter="3D LUT (*.cube)")
+        if not file_path:
+            return
+        try:
+            lut = color_lut.read_cube(file_path)
+            os.makedirs(Filepaths.LUT_DIRECTORY(), exist_ok=True)
+            destination = os.path.join(Filepaths.LUT_DIRECTORY(), os.path.basename(file_path))
+            if os.path.abspath(file_path) != destination:
+                shutil.copyfile(file_path, destination)
+        except Exception as e:
+            logger.exception("Could not import %s", file_path)
+            QMessageBox.warning(self, 'Import', f"Could not import {file_path}: {e}")
+            return
+
+        filter_name = lut.title
+        self.filters[filter_name] = {"LUT": os.path.relpath(destination)}
+        self.add_filter_button(filter_name)
+        self.write_filters(Filepaths.FILTER_FILE())
+
+    def export_cube(self):
+        """
+        Saves the last applied preset as a .cube file, so other tools can use the look.
+        """
+        if self.selected_filter is None:
+            QMessageBox.information(self, 'Export', "Apply a filter first to export it")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, filter="3D LUT (*.cube)",
+                                                   directory=self.selected_filter + ".cube")
+        if not file_path:
+            return
+        try:
+            lut = color_lut.compile_preset(self.filters[self.selected_filter])
+            color_lut.ColorLUT(lut.table, self.selected_filter).write_cube(file_path)
+        except Exception as e:
+            logger.exception("Could not export %s", file_path)
+            QMessageBox.warning(self, 'Export', f"Could not export {file_path}: {e}")
+
     def open_filter_input_dialog(self):
         self.filter_input_dialog = UI_FilterInputDialog()
         self.filter_input_dialog.save_button.clicked.connect(self.event_click_save_button)
@@ -0,0 +1,79 @@
+import numpy as np
+from PyQt6.QtCore import QPointF
+from PyQt6.QtGui import QColor, QPainter, QPainterPath, QPen
+from PyQt6.QtWidgets import QApplication, QSizePolicy, QWidget
+
+# The histograms drawn, back to front, and their colors
+CURVES = (
+    ('luminance', QColor(160, 160, 170, 160), True),
+    ('red', QColor(220, 60, 60), False),
+    ('green', QColor(60, 170, 60), False),
+    ('blue', QColor(60, 90, 220), False),
+)
+
+HISTOGRAM_HEIGHT = 100
+
+
+class HistogramWidget(QWidget):
+    """
+    Shows the histograms of an image_statistics.ImageStatistics: the luminance filled, the channels as lines. \n
+    The heights are computed once per statistics, paint events only draw them. The bins at both ends are left out
+    of the vertical scale, so a clipped image does not flatten the rest of the curves.
+    """
+
+    def __init__(self, parent=None):
+        super(HistogramWidget, self).__init__(parent)
+        self.setFixedHeight(HISTOGRAM_HEIGHT)
+        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
+        self.statistics = None
+        # name -> (256,) float numpy array of the heights from 0 to 1
+        self.curves = {}
+
+    def set_statistics(self, statistics):
+        """
+        :param statistics: image_statistics.ImageStatistics object, or None to show nothing
+        """
+        self.statistics = statistics
+        self.curves = {}
+        if statistics is not None and statistics.samples:
+            for name, _, _ in CURVES:
+                histogram = statistics.histograms[name].astype(np.float64)
+                peak = max(histogram[1:255].max(), 1.0)
+                self.curves[name] = np.minimum(histogram / peak, 1.0)
+        self.update()
+
+    def _path(self, heights, filled):
+        width, height = self.width(), self.height()
+        xs = np.linspace(0, width, 256)
+        ys = height - heights * (height - 1)
+        path = QPainterPath()
+        path.moveTo(QPointF(0, height) if filled else QPointF(xs[0], ys[0]))
+        for x, y in zip(xs, ys):
+            path.lineTo(QPointF(x, y))
+        if filled:
+            path.lineTo(QPointF(width, height))
+            path.closeSubpath()
+        return path
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(40, 40, 46))
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        for name, color, filled in CURVES:
+            if name not in self.curves:
+                continue
+            path = self._path(self.curves[name], filled)
+            if filled:
+                painter.fillPath(path, color)
+            else:
+                painter.setPen(QPen(color, 1))
+                painter.drawPath(path)
+        painter.end()
+
+
+if __name__ == "__main__":
+    app = QApplication([])
+    widget = HistogramWidget()
+    widget.resize(256, HISTOGRAM_HEIGHT)
+    widget.show()
+    app.exec()
@@ -1,10 +1,14 @@
+import time
+
 from PyQt6 import uic
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 
 import image_operations
+import instrumentation
 from canvas_controller import CanvasController
+from exporter import DEFAULT_QUALITY, ExportOptions
 from filepaths import Filepaths
 from widgets.adjust_widget import UI_AdjustWidget
 from widgets.crop_rubberband_widget import CropRubberBandWidget
@@ -12,6 +16,17 @@ from widgets.edit_toolbar import UI_EditToolbarWidget
 from widgets.view_toolbar import UI_ViewToolbarWidget
 from widgets.filter_widget import UI_FilterWidget
 from widgets.crop_toolbar import UI_CropToolbarWidget
+from widgets.pyramid_item import PyramidItem
+
+# Zoom steps of the mouse wheel and the zoom shortcuts, and the largest zoom (in screen pixels per image pixel)
+ZOOM_STEP = 1.25
+MAX_ZOOM = 16.0
+
+# Time without a resize event before the canvas is rendered for the new size
+RESIZE_DELAY_MS = 150
+
+# Operations whose last latency the latency overlay shows
+HUD_OPERATIONS = ('edit to paint', 'preview render', 'update_canvas')
 
     
 class UI_MainWindow(QMainWindow):
@@ -28,18 +43,33 @@ class UI_MainWindow(QMainWindow):
         self.horizontalLayout_3 = self.findChild(QHBoxLayout, 'horizontalLayout_3')
         self.cancel_button = self.findChild(QPushButton, 'cancel_button')
         self.toolbar = self.findChild(QHBoxLayout, 'toolbar')
+        self.status_bar = self.findChild(QStatusBar, 'status_bar')
 
         """Some necessary variables needed for canvas. Initializing with None now. will need later."""
+        # One scene and one pixmap item for the fitted image, updated in place
         self.scene = QGraphicsScene()
+        self.pixmap_item = self.scene.addPixmap(QPixmap())
         self.canvas.setScene(self.scene)
+        # (cache key of the displayed image, canvas size) of the pixmap shown, to skip updates that change nothing
+        self.displayed_key = None
+        # Resizing renders once, after the window stopped changing size for RESIZE_DELAY_MS
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(RESIZE_DELAY_MS)
+        self.resize_timer.timeout.connect(self.event_resize_settled)
         self.adjust_widget = None
         self.filter_widget = None
         self.save_file_path = None
+        self.export_options = None
         self.scene_pixmap = None
         self.original_pixmap = None
         self.crop_rubber_band = None
         self.view_toolbar_edit_button = None
         self.view_toolbar_rotate_button = None
+        # Screen pixels per full resolution image pixel. None fits the image to the canvas
+        self.zoom = None
+        self.zoom_scene = None
+        self.pyramid_item = None
 
         """create a CanvasController to store all the elements related to the canvas."""
         self.canvas_controller = CanvasController()
@@ -69,6 +99,43 @@ class UI_MainWindow(QMainWindow):
         self.crop_toolbar_widget.save_button.clicked.connect(self.save_button_clicked_on_crop_toolbar)
         self.crop_toolbar_widget.cancel_button.clicked.connect(self.cancel_clicked_on_crop)
 
+        """Ctrl+Z and Ctrl+Y (or the platform's keys) undo and redo the edits."""
+        self.undo_shortcut = QShortcut(QKeySequence.StandardKey.Undo, self)
+        self.undo_shortcut.activated.connect(self.canvas_controller.undo)
+        self.redo_shortcut = QShortcut(QKeySequence.StandardKey.Redo, self)
+        self.redo_shortcut.activated.connect(self.canvas_controller.redo)
+
+        """The mouse wheel and Ctrl+Plus/Minus zoom, Ctrl+0 fits the image and Ctrl+1 shows it at 100%."""
+        self.canvas.viewport().installEventFilter(self)
+        self.canvas_controller.pyramid.valueChanged.connect(self.event_pyramid_ready)
+        QShortcut(QKeySequence.StandardKey.ZoomIn, self).activated.connect(lambda: self.zoom_by(ZOOM_STEP))
+        QShortcut(QKeySequence.StandardKey.ZoomOut, self).activated.connect(lambda: self.zoom_by(1 / ZOOM_STEP))
+        QShortcut(QKeySequence('Ctrl+0'), self).activated.connect(lambda: self.set_zoom(None))
+        QShortcut(QKeySequence('Ctrl+1'), self).activated.connect(lambda: self.set_zoom(1.0))
+
+        """Saving runs in the background, its progress is shown in the status bar with a button to cancel it."""
+        self.export_progress = QProgressBar()
+        self.export_progress.setRange(0, 100)
+        self.export_progress.setMaximumWidth(200)
+        self.export_cancel_button = QPushButton('Cancel')
+        self.export_cancel_button.clicked.connect(self.canvas_controller.exporter.cancel)
+        self.status_bar.addPermanentWidget(self.export_progress)
+        self.status_bar.addPermanentWidget(self.export_cancel_button)
+        self.export_progress.hide()
+        self.export_cancel_button.hide()
+        exporter = self.canvas_controller.exporter
+        exporter.progress.connect(lambda fraction: self.export_progress.setValue(round(fraction * 100)))
+        exporter.finished.connect(self.event_export_finished)
+        exporter.failed.connect(self.event_export_failed)
+        exporter.cancelled.connect(self.event_export_cancelled)
+
+        """F12 shows the latency of the last edit, from the change to the paint of its preview, on the canvas."""
+        self.latency_hud = QLabel(self.canvas.viewport())
+        self.latency_hud.setStyleSheet('background-color: rgba(0, 0, 0, 160); color: white; padding: 4px;')
+        self.latency_hud.move(8, 8)
+        self.latency_hud.hide()
+        QShortcut(QKeySequence('F12'), self).activated.connect(self.toggle_latency_hud)
+
 
     def choose_file(self):
         """
@@ -92,13 +159,20 @@ class UI_MainWindow(QMainWindow):
         """
         self.add_view_toolbar_widget()
         image_file_path = self.choose_file()
-        self.canvas_controller.file_path = image_file_path
+        if not image_file_path:
+            return
+        self.set_zoom(None)
+        self.update_proxy_size()
+        # decoded once into the working format, or taken from the cache if the file was opened recently
+        if not self.canvas_controller.open_image(image_file_path):
+            # the reason is logged by the module that failed
+            self.status_bar.showMessage(f'Could not open {image_file_path}', 5000)
+            return
         self.enable_all()
         self.save_file_path = None
-        self.original_pixmap = QPixmap(image_file_path)
-        self.scene_pixmap = self.original_pixmap.copy()
-        self.canvas_controller.original_image = self.scene_pixmap.toImage().copy()
-        self.canvas_controller.scene_image = self.canvas_controller.original_image.copy()
+        self.canvas_controller.scene_image = self.canvas_controller.proxy_image
+        self.original_pixmap = QPixmap.fromImage(self.canvas_controller.scene_image)
+        self.scene_pixmap = self.original_pixmap
         if self.scene_pixmap is not None and not self.scene_pixmap.isNull():
             self.event_update_canvas()
 
@@ -118,38 +192,95 @@ class UI_MainWindow(QMainWindow):
         file_dialogue = QFileDialog(self)
         filters = "Images (*.jpg *.png *.bmp)"
         file_path, _ = file_dialogue.getSaveFileName(filter=filters, parent=self)
+        if not file_path:
+            return
+        options = ExportOptions(file_path)
+        # lossy formats ask for the quality, it is kept for the next saves
+        if options.file_format in DEFAULT_QUALITY:
+            quality, accepted = QInputDialog.getInt(self, 'Save as', 'Quality (0 - 100):', options.quality, 0, 100)
+            if not accepted:
+                return
+            options.quality = quality
+        longest_side, accepted = QInputDialog.getInt(self, 'Save as', 'Longest side in pixels (0 for the full size):',
+                                                     0, 0, 1_000_000)
+        if not accepted:
+            return
+        if longest_side:
+            options.max_size = (longest_side, longest_side)
         self.save_file_path = file_path
-        if file_path:
-            self.scene_pixmap.save(file_path)
+        self.export_options = options
+        self.export(options)
 
     def save_file(self):
         """
         Clicking 'Save' or pressing Ctrl+S. \n
-        Save the file, when the save-file already exists/created,
+        Save the file, when the save-file already exists/created, \n
+        The edits are rendered at the full resolution of the original image.
         :return:
         """
         if self.save_file_path:
-            self.scene_pixmap.save(self.save_file_path)
+            self.export(self.export_options)
         else:  # If the save-file is not created, call save_new_file()
             self.save_new_file()
 
+    def export(self, options):
+        """
+        Starts saving the edits in the background. The window stays usable while the image is rendered and encoded.
+        :param options: exporter.ExportOptions object
+        """
+        # a running export is cancelled first
+        self.canvas_controller.export(options)
+        self.export_progress.setValue(0)
+        self.export_progress.show()
+        self.export_cancel_button.show()
+        self.status_bar.showMessage(f'Saving {options.file_path}')
+
+    def hide_export_progress(self):
+        self.export_progress.hide()
+        self.export_cancel_button.hide()
+
+    def event_export_finished(self, file_path):
+        self.hide_export_progress()
+        self.status_bar.showMessage(f'Saved {file_path}', 5000)
+
+    def event_export_failed(self, message):
+        self.hide_export_progress()
+        self.status_bar.clearMessage()
+        QMessageBox.warning(self, 'Save', message)
+
+    def event_export_cancelled(self):
+        self.hide_export_progress()
+        self.status_bar.showMessage('Saving cancelled', 5000)
+
+    def closeEvent(self, event):
+        # a running export finishes writing its file before the window closes
+        self.canvas_controller.exporter.wait()
+        super().closeEvent(event)
+
     def scale_pixmap(self):
         """
         If the original image is bigger than the canvas, scale it down to fit. \n
         But if it is smaller or equal, keep it as it is.
         :return:
         """
-        if self.canvas_controller.scene_image.width() >= self.canvas.width() or \
-            self.canvas_controller.scene_image.height() >= self.canvas.height():
-            self.canvas_controller.scene_image = self.canvas_controller.scene_image.scaled(
-                int(self.canvas.width() * .99),
-                int(self.canvas.height() * .99),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation)
-            self.scene_pixmap = QPixmap.fromImage(self.canvas_controller.scene_image)
-
-        else:
-            self.scene_pixmap = self.original_pixmap.copy()
+        # the image is shown rotated by the display transform, so it fits the canvas turned by the same angle
+        canvas_width, canvas_height = self.canvas_controller.preview_orientation.size(self.canvas.width(),
+                                                                                      self.canvas.height())
+        if self.canvas_controller.scene_image.width() >= canvas_width or \
+            self.canvas_controller.scene_image.height() >= canvas_height:
+            self.canvas_controller.scene_image = image_operations.scale_to_fit(
+                self.canvas_controller.scene_image,
+                int(canvas_width * .99),
+                int(canvas_height * .99),
+                'area')
+        self.scene_pixmap = QPixmap.fromImage(self.canvas_controller.scene_image)
+
+    def update_proxy_size(self):
+        """
+        Interactive edits are previewed on a copy of the image scaled to the canvas size.
+        :return:
+        """
+        self.canvas_controller.set_proxy_size(int(self.canvas.width() * .99), int(self.canvas.height() * .99))
 
     def event_update_canvas(self):
         if not self.canvas_controller.scene_image_updated:
@@ -157,12 +288,123 @@ class UI_MainWindow(QMainWindow):
         self.update_canvas()
     
     def update_canvas(self):
-        self.original_pixmap = QPixmap(self.canvas_controller.scene_image)
-        self.scale_pixmap()
-        self.scene = QGraphicsScene()
-        self.scene.addPixmap(self.scene_pixmap)
-        self.canvas.setScene(self.scene)
-        self.canvas_controller.scene_image_updated.value = False
+        with instrumentation.timer('update_canvas', self.canvas_controller.scene_image):
+            if self.zoom is not None:
+                self.show_zoomed_state()
+                self.canvas_controller.scene_image_updated.value = False
+                return
+            self.update_proxy_size()
+            # the image is only converted and scaled again when it, its orientation or the canvas size changed
+            canvas_size = (self.canvas.width(), self.canvas.height())
+            orientation = self.canvas_controller.preview_orientation
+            displayed_key = (self.canvas_controller.scene_image.cacheKey(), orientation, canvas_size)
+            if self.displayed_key != displayed_key:
+                self.scale_pixmap()
+                self.pixmap_item.setPixmap(self.scene_pixmap)
+                # rotations and mirrors at the end of the edits are shown without moving any pixels
+                self.pixmap_item.setTransform(orientation.q_transform(self.scene_pixmap.width(),
+                                                                      self.scene_pixmap.height()))
+                self.scene.setSceneRect(self.pixmap_item.sceneBoundingRect())
+                self.displayed_key = (self.canvas_controller.scene_image.cacheKey(), orientation, canvas_size)
+            if self.canvas.scene() is not self.scene:
+                self.canvas.setScene(self.scene)
+            self.canvas_controller.scene_image_updated.value = False
+
+    def fit_zoom(self):
+        """
+        The zoom at which the image fits the canvas, as shown when not zoomed.
+        """
+        return 1 / self.canvas_controller.display_to_original_scale()
+
+    def zoom_by(self, factor):
+        self.set_zoom((self.zoom or self.fit_zoom()) * factor)
+
+    def set_zoom(self, zoom):
+        """
+        Zooms the canvas. Zoomed in, the canvas shows the full resolution result from a mipmap pyramid,
+        only drawing the visible tiles, and can be panned by dragging.
+        :param zoom: screen pixels per full resolution image pixel. None, or any zoom that fits, fits the image
+        """
+        if self.canvas_controller.preview_image.isNull():
+            return
+        if zoom is None or zoom <= self.fit_zoom():
+            if self.zoom is None:
+                return
+            self.zoom = None
+            self.canvas.setDragMode(QGraphicsView.DragMode.NoDrag)
+            self.canvas.resetTransform()
+            self.update_canvas()
+            return
+
+        zoom = min(zoom, MAX_ZOOM)
+        if self.zoom is None:
+            self.zoom_scene = QGraphicsScene()
+            self.pyramid_item = PyramidItem()
+            self.zoom_scene.addItem(self.pyramid_item)
+            self.canvas.setScene(self.zoom_scene)
+            self.canvas.setDragMode(QGraphicsView.DragMode.ScrollHandDrag)
+            self.canvas.resetTransform()
+            self.show_zoomed_state()
+            self.zoom = 1.0
+        self.canvas.scale(zoom / self.zoom, zoom / self.zoom)
+        self.zoom = zoom
+
+    def show_zoomed_state(self):
+        """
+        Shows the current edits on the zoomed canvas: the preview right away, the full resolution pyramid when
+        it is built.
+        """
+        controller = self.canvas_controller
+        if controller.request_pyramid():
+            self.pyramid_item.set_pyramid(controller.pyramid.value)
+            self.zoom_scene.setSceneRect(self.pyramid_item.boundingRect())
+            return
+        preview = controller.preview_orientation.apply(controller.preview_image)
+        scale = controller.proxy_scale
+        self.pyramid_item.set_preview(QPixmap.fromImage(preview), round(preview.width() / scale),
+                                      round(preview.height() / scale))
+        self.zoom_scene.setSceneRect(self.pyramid_item.boundingRect())
+
+    def event_pyramid_ready(self, pyramid):
+        if self.zoom is not None and pyramid is not None:
+            self.pyramid_item.set_pyramid(pyramid)
+            self.zoom_scene.setSceneRect(self.pyramid_item.boundingRect())
+
+    def toggle_latency_hud(self):
+        """
+        Shows or hides the latencies on the canvas. Showing them starts the instrumentation.
+        """
+        if self.latency_hud.isVisible():
+            self.latency_hud.hide()
+            return
+        instrumentation.enable()
+        self.update_latency_hud()
+        self.latency_hud.show()
+
+    def update_latency_hud(self):
+        last = instrumentation.recorder.last
+        lines = [f"{name}: {last[name]:.1f} ms" if name in last else f"{name}: -" for name in HUD_OPERATIONS]
+        self.latency_hud.setText('\n'.join(lines))
+        self.latency_hud.adjustSize()
+
+    def eventFilter(self, source, event):
+        if source is self.canvas.viewport() and event.type() == QEvent.Type.Paint:
+            requested = self.canvas_controller.preview_requested
+            if requested is not None:
+                # the first paint after a new preview, the end of the latency from the edit to the screen
+                self.canvas_controller.preview_requested = None
+                instrumentation.recorder.record('edit to paint', time.perf_counter() - requested,
+                                                instrumentation.megapixels(self.canvas_controller.preview_image))
+                if self.latency_hud.isVisible():
+                    self.update_latency_hud()
+            return False
+        if source is self.canvas.viewport() and event.type() == QEvent.Type.Wheel:
+            steps = event.angleDelta().y() / 120
+            if steps:
+                self.canvas.setTransformationAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
+                self.zoom_by(ZOOM_STEP ** steps)
+            return True
+        return super().eventFilter(source, event)
 
     def add_adjust_widget(self):
         self.editor_container.setStretch(0, 1)
@@ -185,10 +427,9 @@ class UI_MainWindow(QMainWindow):
 
     def add_crop_rubberband(self):
         self.crop_rubber_band = CropRubberBandWidget(self.canvas, self.canvas_controller)
-        self.crop_rubber_band.setGeometry((self.canvas.width() - self.canvas_controller.scene_image.width()) // 2, 
-                                          (self.canvas.height() - self.canvas_controller.scene_image.height()) // 2,
-                                            self.scene_pixmap.width(),
-                                            self.scene_pixmap.height())
+        # the rubber band covers the displayed image, wherever the canvas placed it
+        top_left = self.canvas.mapFromScene(QPointF(0, 0)) + self.canvas.viewport().pos()
+        self.crop_rubber_band.setGeometry(QRect(top_left, self.scene.sceneRect().size().toSize()))
         self.crop_rubber_band.show()
 
     def remove_crop_rubberband(self):
@@ -196,6 +437,11 @@ class UI_MainWindow(QMainWindow):
             self.crop_rubber_band.close()
 
     def resizeEvent(self, event):
+        # a resize sends many events, the canvas is rendered once they stop
+        if self.original_pixmap:
+            self.resize_timer.start()
+
+    def event_resize_settled(self):
         if self.original_pixmap:
             self.update_canvas()
 
@@ -234,11 +480,12 @@ class UI_MainWindow(QMainWindow):
         self.remove_crop_toolbar_widget()
         self.add_view_toolbar_widget()
         self.canvas.show()
-        self.canvas_controller.scene_image = QImage(self.canvas_controller.file_path)
-        self.canvas_controller.original_image = self.canvas_controller.scene_image
+        self.canvas_controller.revert()
         self.update_canvas()
 
     def event_clicked_on_crop_button(self):
+        # the crop rubber band works on the fitted image
+        self.set_zoom(None)
         self.remove_adjust_widget()
         self.remove_filter_widget()
         self.remove_edit_toolbar_widget()
@@ -247,19 +494,20 @@ class UI_MainWindow(QMainWindow):
         self.update_canvas()
 
     def save_button_clicked_on_crop_toolbar(self):
-        top, bottom, right, left = self.crop_rubber_band.get_crop_dimensions()
-        self.canvas_controller.scene_image = image_operations.crop(self.canvas_controller.scene_image, top, bottom,
-                                                                   right, left)
-        self.remove_crop_rubberband()        
+        # the rubber band is placed on the displayed image, the crop node works in original image pixels
+        top, bottom, right, left = self.canvas_controller.display_to_original_rect(
+            *self.crop_rubber_band.get_crop_dimensions())
+        self.canvas_controller.add_edit('crop', top=top, bottom=bottom, right=right, left=left)
+        self.remove_crop_rubberband()
         self.remove_crop_toolbar_widget()
         self.add_edit_toolbar_widget()
-        self.canvas_controller.original_image = self.canvas_controller.scene_image
         self.update_canvas()
 
     def add_filter_widget(self):
         self.editor_container.setStretch(0, 1)
         self.editor_container.addWidget(self.filter_widget.main_widget)
         self.filter_widget.main_widget.show()
+        self.filter_widget.update_thumbnails()
 
     def remove_filter_widget(self):
         self.editor_container.removeWidget(self.filter_widget.main_widget)
@@ -272,18 +520,15 @@ class UI_MainWindow(QMainWindow):
         self.update_canvas()
 
     def event_clicked_on_mirror_lr_button(self):
-        self.canvas_controller.scene_image = image_operations.mirror_lr(self.canvas_controller.scene_image)
-        self.canvas_controller.original_image = self.canvas_controller.scene_image
+        self.canvas_controller.orient('mirror_lr')
         self.update_canvas()
 
     def event_clicked_on_mirror_ud_button(self):
-        self.canvas_controller.scene_image = image_operations.mirror_ud(self.canvas_controller.scene_image)
-        self.canvas_controller.original_image = self.canvas_controller.scene_image
+        self.canvas_controller.orient('mirror_ud')
         self.update_canvas()
 
     def event_clicked_on_rotate_button(self):
-        self.canvas_controller.scene_image = image_operations.rotate(self.canvas_controller.scene_image)
-        self.canvas_controller.original_image = self.canvas_controller.scene_image
+        self.canvas_controller.orient('rotate')
         self.update_canvas()
     
 
@@ -294,8 +539,7 @@ class UI_MainWindow(QMainWindow):
         self.remove_filter_widget()
         self.add_edit_toolbar_widget()
         self.canvas.show()
-        self.canvas_controller.scene_image = QImage(self.canvas_controller.file_path)
-        self.canvas_controller.original_image = self.canvas_controller.scene_image
+        self.canvas_controller.revert()
         self.update_canvas()
 
 
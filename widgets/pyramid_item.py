@@ -0,0 +1,67 @@
+from PyQt6.QtCore import QRectF
+from PyQt6.QtGui import QPainter, QPixmap
+from PyQt6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+from image_pyramid import TILE_SIZE
+
+
+class PyramidItem(QGraphicsItem):
+    """
+    Draws an ImagePyramid in a QGraphicsScene, in the pixels of its full resolution image. \n
+    Only the tiles inside the exposed part of the view are drawn, from the level matching the zoom of the view.
+    Until the pyramid is ready, a lower resolution preview is stretched over the same area.
+    """
+
+    def __init__(self, parent=None):
+        super(PyramidItem, self).__init__(parent)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption, True)
+        self.pyramid = None
+        self.preview = QPixmap()
+        self.width, self.height = 0, 0
+
+    def set_pyramid(self, pyramid):
+        self._resize(pyramid.width, pyramid.height)
+        self.pyramid = pyramid
+        self.update()
+
+    def set_preview(self, pixmap, width, height):
+        """
+        Shows a preview instead of the pyramid, e.g. while the pyramid of a new state is built.
+        :param pixmap: QPixmap object
+        :param width: full resolution width the preview is stretched to
+        :param height: full resolution height the preview is stretched to
+        """
+        self._resize(width, height)
+        self.pyramid = None
+        self.preview = pixmap
+        self.update()
+
+    def _resize(self, width, height):
+        if (width, height) != (self.width, self.height):
+            self.prepareGeometryChange()
+            self.width, self.height = width, height
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    def paint(self, painter, option, widget=None):
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, scale < 1)
+
+        if self.pyramid is None:
+            if not self.preview.isNull():
+                painter.drawPixmap(self.boundingRect(), self.preview, QRectF(self.preview.rect()))
+            return
+
+        level = self.pyramid.level_for_scale(scale)
+        size = TILE_SIZE << level
+        exposed = option.exposedRect
+        # the last tiles of the small levels can reach a little past the image
+        painter.setClipRect(self.boundingRect())
+        first_column, first_row, last_column, last_row = self.pyramid.tile_range(
+            level, exposed.left(), exposed.top(), exposed.right(), exposed.bottom())
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                tile = self.pyramid.tile(level, column, row)
+                target = QRectF(column * size, row * size, tile.width() << level, tile.height() << level)
+                painter.drawPixmap(target, tile, QRectF(tile.rect()))